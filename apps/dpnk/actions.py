@@ -285,6 +285,20 @@ create_shape_files_for_cities.short_description = _(
 )
 
 
+def generate_heatmaps_for_cities(modeladmin, request, queryset, celery=True):
+    city_pks = [c.pk for c in queryset]
+    if celery:
+        tasks.generate_heatmaps.delay(city_pks)
+    else:
+        for city_pk in city_pks:
+            tasks.generate_city_heatmap(city_pk)
+
+
+generate_heatmaps_for_cities.short_description = _(
+    "Vytvořit rastrovou heatmapu z tabulky anonymních jízd"
+)
+
+
 def send_notifications(modeladmin, request, queryset):
     tasks.send_unfilled_rides_notification.apply_async(
         kwargs={
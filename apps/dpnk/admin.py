@@ -201,12 +201,15 @@ class CityInCampaignAdmin(RelatedFieldAdmin):
         "name",
         "organizer",
         "organizer_url",
+        "data_export_status",
+        "data_export_progress",
     )
     list_filter = (CampaignFilter,)
     actions = (
         make_pdfsandwich,
         actions.create_shape_files_for_cities,
         actions.build_table_and_create_shape_files_for_cities,
+        actions.generate_heatmaps_for_cities,
     )
 
 
@@ -1460,11 +1463,49 @@ class CompetitionResultAdmin(ImportExportMixin, admin.ModelAdmin):
     resource_class = resources.AdminCompetitionResultResource
 
 
+@admin.register(models.CompetitionRecalculation)
+class CompetitionRecalculationAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "competition",
+        "get_progress",
+        "created",
+        "get_eta",
+        "finished",
+        "failed",
+    )
+    list_filter = (
+        campaign_filter_generator("competition__campaign"),
+        "competition",
+        ("failed", admin.EmptyFieldListFilter),
+    )
+    readonly_fields = (
+        "competition",
+        "chunks_total",
+        "chunks_done",
+        "created",
+        "finished",
+        "get_eta",
+        "failed",
+        "error",
+    )
+    list_select_related = ("competition",)
+
+    def has_add_permission(self, request):
+        return False
+
+
 @admin.register(models.Occupation)
 class OccupationAdmin(ImportExportMixin, SortableAdminMixin, admin.ModelAdmin):
     list_display = ("name",)
 
 
+@admin.register(models.PublicHoliday)
+class PublicHolidayAdmin(ImportExportMixin, admin.ModelAdmin):
+    list_display = ("date", "name", "every_year")
+    list_filter = ("every_year",)
+
+
 class PhaseInline(admin.TabularInline):
     model = models.Phase
     extra = 0
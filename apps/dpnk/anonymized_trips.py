@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2026 o.s. Auto*Mat
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Table of anonymized trips (dpnk_trip_anonymized) used for heatmaps
+and GIS exports of cities.
+
+Every line of a trip track is shortened by 100 m on both ends,
+lines that are too short or too long, have too few points
+or have longer section than 1 km (GPS jumps) are left out.
+
+The table is rebuilt into a shadow table, that replaces the table
+by atomic rename, so readers of the table are never blocked
+by the rebuild. The table can be also updated incrementally
+by trips changed since the last update.
+"""
+import datetime
+import logging
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .heatmap import ANONYMIZED_TRIPS_TABLE
+
+logger = logging.getLogger(__name__)
+
+SHADOW_TABLE = ANONYMIZED_TRIPS_TABLE + "_new"
+OLD_TABLE = ANONYMIZED_TRIPS_TABLE + "_old"
+# Start time of the last rebuild or update of the table
+RUN_TABLE = ANONYMIZED_TRIPS_TABLE + "_run"
+# Maximal length of section between two points of the track (in meters)
+MAX_SECTION_LENGTH = 1000
+
+ANONYMIZED_TRIPS_SQL = """
+SELECT * FROM (
+    SELECT
+        a.id,
+        a.campaign_id,
+        a.age_group,
+        a.sex,
+        a.commute_mode,
+        a.city,
+        a.occupation_id,
+        ST_LineSubstring(
+            a.track,
+            100 / ST_Length(a.track::geography),
+            1 - 100 / ST_Length(a.track::geography)
+        ) AS the_geom,
+        a.updated
+    FROM (
+        SELECT
+            dpnk_trip.id,
+            dpnk_userattendance.campaign_id,
+            dpnk_userprofile.age_group,
+            dpnk_userprofile.sex,
+            dpnk_commutemode.slug AS commute_mode,
+            dpnk_city.slug AS city,
+            dpnk_userprofile.occupation_id,
+            dpnk_trip.updated,
+            (ST_Dump(dpnk_trip.track::geometry)).geom AS track
+        FROM dpnk_trip
+        JOIN dpnk_userattendance
+            ON (dpnk_trip.user_attendance_id = dpnk_userattendance.id)
+        JOIN dpnk_userprofile
+            ON (dpnk_userattendance.userprofile_id = dpnk_userprofile.id)
+        JOIN dpnk_team ON (dpnk_userattendance.team_id = dpnk_team.id)
+        JOIN dpnk_subsidiary ON (dpnk_team.subsidiary_id = dpnk_subsidiary.id)
+        JOIN dpnk_city ON (dpnk_subsidiary.city_id = dpnk_city.id)
+        JOIN dpnk_commutemode ON (dpnk_trip.commute_mode_id = dpnk_commutemode.id)
+        {where}
+    ) AS a
+    WHERE a.track IS NOT NULL
+        AND ST_NumPoints(a.track) > 15
+        AND ST_Length(a.track::geography) < 100000
+        AND ST_Length(a.track::geography) > 200
+        AND NOT EXISTS (
+            SELECT 1 FROM ST_DumpSegments(a.track) AS segment
+            WHERE ST_Length(segment.geom::geography) > {max_section_length}
+        )
+) AS b
+WHERE ST_NumPoints(b.the_geom) > 15
+"""
+
+CREATE_INDEXES_SQL = """
+CREATE INDEX {table}_idx ON {table} USING GIST (the_geom);
+CREATE INDEX {table}_id_idx ON {table} (id);
+CREATE INDEX {table}_campaign_city_idx ON {table} (campaign_id, city);
+"""
+
+# Tables created before the other indexes were introduced have only the GIST index
+RENAME_INDEXES_SQL = """
+ALTER INDEX IF EXISTS {old}_idx RENAME TO {new}_idx;
+ALTER INDEX IF EXISTS {old}_id_idx RENAME TO {new}_id_idx;
+ALTER INDEX IF EXISTS {old}_campaign_city_idx RENAME TO {new}_campaign_city_idx;
+"""
+
+
+def get_anonymized_trips_sql(where=""):
+    return ANONYMIZED_TRIPS_SQL.format(
+        where=where,
+        max_section_length=MAX_SECTION_LENGTH,
+    )
+
+
+def get_table_columns(table):
+    """Return column names of the table, None if the table doesn't exist"""
+    with connection.cursor() as cursor:
+        if table not in connection.introspection.table_names(cursor):
+            return None
+        return [
+            column.name
+            for column in connection.introspection.get_table_description(cursor, table)
+        ]
+
+
+def get_last_run_start(cursor):
+    """Return start time of the last rebuild or update of the table"""
+    if RUN_TABLE not in connection.introspection.table_names(cursor):
+        return None
+    cursor.execute("SELECT started FROM %s WHERE id = 1" % RUN_TABLE)
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def save_run_start(cursor, started):
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS %s ("
+        "id integer PRIMARY KEY, started timestamp with time zone NOT NULL)"
+        % RUN_TABLE,
+    )
+    cursor.execute(
+        "INSERT INTO {table} (id, started) VALUES (1, %s) "
+        "ON CONFLICT (id) DO UPDATE SET started = EXCLUDED.started".format(
+            table=RUN_TABLE
+        ),
+        [started],
+    )
+
+
+def rebuild_anonymized_trips_table():
+    """
+    Build the table of anonymized trips from all trips in the shadow table
+    and replace the table by it.
+    Return number of rows of the table.
+    """
+    with connection.cursor() as cursor:
+        # Tables left by interrupted rebuild
+        cursor.execute("DROP TABLE IF EXISTS %s, %s" % (SHADOW_TABLE, OLD_TABLE))
+        cursor.execute("SELECT now()")
+        started = cursor.fetchone()[0]
+        cursor.execute(
+            "CREATE TABLE %s AS %s" % (SHADOW_TABLE, get_anonymized_trips_sql()),
+        )
+        row_count = cursor.rowcount
+        cursor.execute(CREATE_INDEXES_SQL.format(table=SHADOW_TABLE))
+        if settings.ANONYMIZED_TRIPS_TABLE_GRANT_ROLE:
+            cursor.execute(
+                "GRANT ALL PRIVILEGES ON TABLE %s TO %s"
+                % (SHADOW_TABLE, settings.ANONYMIZED_TRIPS_TABLE_GRANT_ROLE),
+            )
+        with transaction.atomic():
+            if get_table_columns(ANONYMIZED_TRIPS_TABLE) is not None:
+                cursor.execute(
+                    "ALTER TABLE %s RENAME TO %s" % (ANONYMIZED_TRIPS_TABLE, OLD_TABLE),
+                )
+                cursor.execute(
+                    RENAME_INDEXES_SQL.format(
+                        old=ANONYMIZED_TRIPS_TABLE, new=OLD_TABLE
+                    ),
+                )
+            cursor.execute(
+                "ALTER TABLE %s RENAME TO %s" % (SHADOW_TABLE, ANONYMIZED_TRIPS_TABLE),
+            )
+            cursor.execute(
+                RENAME_INDEXES_SQL.format(old=SHADOW_TABLE, new=ANONYMIZED_TRIPS_TABLE),
+            )
+            save_run_start(cursor, started)
+        # Readers of the old table have to finish before it is dropped
+        cursor.execute("DROP TABLE IF EXISTS %s" % OLD_TABLE)
+    logger.info("Anonymized trips table rebuilt with %s rows", row_count)
+    return row_count
+
+
+def update_anonymized_trips_table():
+    """
+    Update the table of anonymized trips by trips changed since the start
+    of the last update (less ANONYMIZED_TRIPS_UPDATE_MARGIN seconds
+    for trips saved before, but committed after the last update started)
+    and remove deleted trips.
+    Rebuild the whole table, if it doesn't exist, has old structure
+    or the last update is not known.
+    Return number of inserted rows.
+    """
+    columns = get_table_columns(ANONYMIZED_TRIPS_TABLE)
+    if columns is None or "updated" not in columns:
+        return rebuild_anonymized_trips_table()
+    with connection.cursor() as cursor:
+        last_run_start = get_last_run_start(cursor)
+    if last_run_start is None:
+        return rebuild_anonymized_trips_table()
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT now()")
+        save_run_start(cursor, cursor.fetchone()[0])
+        since = last_run_start - datetime.timedelta(
+            seconds=settings.ANONYMIZED_TRIPS_UPDATE_MARGIN
+        )
+        where, params = "WHERE dpnk_trip.updated >= %s", [since]
+        cursor.execute(
+            "DELETE FROM {table} AS anonymized WHERE NOT EXISTS ("
+            "SELECT 1 FROM dpnk_trip WHERE dpnk_trip.id = anonymized.id)".format(
+                table=ANONYMIZED_TRIPS_TABLE
+            ),
+        )
+        deleted_count = cursor.rowcount
+        cursor.execute(
+            "DELETE FROM {table} WHERE id IN ("
+            "SELECT dpnk_trip.id FROM dpnk_trip {where})".format(
+                table=ANONYMIZED_TRIPS_TABLE, where=where
+            ),
+            params,
+        )
+        cursor.execute(
+            "INSERT INTO %s %s"
+            % (ANONYMIZED_TRIPS_TABLE, get_anonymized_trips_sql(where)),
+            params,
+        )
+        row_count = cursor.rowcount
+    logger.info(
+        "Anonymized trips table updated with %s rows of trips changed since %s, "
+        "%s rows of deleted trips removed",
+        row_count,
+        since,
+        deleted_count,
+    )
+    return row_count
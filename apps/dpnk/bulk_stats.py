@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2026 o.s. Auto*Mat
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Vectorised computation of trip statistics (rides count, length, working trips
+count and frequency) of many user attendances at once.
+
+Trips of all user attendances are streamed by one query into compact arrays
+of (user, day, direction, commute mode) and reduced by NumPy.
+The numbers are the same as computed by get_rides_count,
+get_userprofile_length and get_working_trips_count in results module.
+"""
+from array import array
+from collections import namedtuple
+
+from django.contrib import contenttypes
+from django.db import transaction
+from django.db.models import Max
+
+import denorm
+
+import numpy as np
+
+from . import util
+from .models import CommuteMode, Phase, Team, Trip, UserAttendance
+
+DIRECTION_CODES = {
+    "trip_to": 0,
+    "trip_from": 1,
+    "recreational": 2,
+}
+
+TRIPS_CHUNK_SIZE = 10000
+BULK_UPDATE_BATCH_SIZE = 1000
+
+TripStatsArrays = namedtuple(
+    "TripStatsArrays",
+    (
+        "user_attendance_ids",
+        "rides_count",
+        "length",
+        "length_including_recreational",
+        "working_trips_count_without_minimum",
+        "working_trips_count",
+        "frequency",
+    ),
+)
+
+
+def _commute_mode_classes(competition):
+    """
+    Return boolean arrays indexed by commute mode id:
+    modes counted as rides, modes counted in non-working days
+    and modes that are non-working rides in working days.
+    """
+    modes = list(CommuteMode.objects.values_list("pk", "eco", "does_count"))
+    size = max([pk for pk, eco, does_count in modes], default=0) + 1
+    counted = np.zeros(size, dtype=bool)
+    counted_in_non_working_day = np.zeros(size, dtype=bool)
+    non_working_ride = np.zeros(size, dtype=bool)
+    if isinstance(competition, Phase):
+        for pk, eco, does_count in modes:
+            counted[pk] = eco and does_count
+            counted_in_non_working_day[pk] = does_count
+            non_working_ride[pk] = not does_count
+    else:
+        competition_modes = set(competition.commute_modes.values_list("pk", flat=True))
+        for pk, eco, does_count in modes:
+            counted[pk] = pk in competition_modes
+            counted_in_non_working_day[pk] = pk in competition_modes
+            non_working_ride[pk] = pk not in competition_modes
+    return counted, counted_in_non_working_day, non_working_ride
+
+
+def load_trips(user_attendances, start_day, end_day):
+    """
+    Stream trips of the user attendances between start_day and end_day
+    into arrays of user attendance ids, day indexes (from start_day),
+    direction codes, commute mode ids and distances.
+    """
+    user_attendance_ids = array("q")
+    days = array("l")
+    directions = array("b")
+    commute_modes = array("l")
+    distances = array("d")
+    trips = (
+        Trip.objects.filter(
+            user_attendance__in=user_attendances,
+            date__range=(start_day, end_day),
+        )
+        .order_by()
+        .values_list(
+            "user_attendance_id", "date", "direction", "commute_mode_id", "distance"
+        )
+    )
+    for (
+        user_attendance_id,
+        date,
+        direction,
+        commute_mode_id,
+        distance,
+    ) in trips.iterator(
+        chunk_size=TRIPS_CHUNK_SIZE,
+    ):
+        user_attendance_ids.append(user_attendance_id)
+        days.append((date - start_day).days)
+        directions.append(DIRECTION_CODES[direction])
+        commute_modes.append(commute_mode_id)
+        distances.append(distance or 0)
+    return (
+        np.array(user_attendance_ids, dtype=np.int64),
+        np.array(days, dtype=np.int64),
+        np.array(directions, dtype=np.int8),
+        np.array(commute_modes, dtype=np.int64),
+        np.array(distances, dtype=np.float64),
+    )
+
+
+def get_trip_stats_arrays(user_attendances, competition, day=None):
+    """
+    Compute trip statistics of all the user attendances
+    in the competition (or competition phase).
+
+    @return TripStatsArrays with arrays ordered by user_attendance_ids
+    """
+    if not day:
+        day = util.today()
+    user_attendance_ids = np.array(
+        sorted(set(user_attendances.values_list("pk", flat=True))), dtype=np.int64
+    )
+    calendar, end_day = util.competition_calendar(competition, day)
+    start_day = calendar.start_day
+    users, days, directions, modes, distances = load_trips(
+        user_attendances, start_day, end_day
+    )
+    user_indexes = np.searchsorted(user_attendance_ids, users)
+    user_count = len(user_attendance_ids)
+
+    counted, counted_in_non_working_day, non_working_ride = _commute_mode_classes(
+        competition
+    )
+    is_working_day = np.zeros(max(len(calendar.days), 1), dtype=bool)
+    for working_day in calendar.working_days_until(end_day):
+        is_working_day[(working_day - start_day).days] = True
+    working_day_trips = is_working_day[days]
+    commute_trips = directions != DIRECTION_CODES["recreational"]
+    recreational = getattr(competition, "recreational", False)
+
+    counted_trips = counted[modes] & (commute_trips | recreational)
+    rides_count = np.bincount(user_indexes, weights=counted_trips, minlength=user_count)
+    length = np.bincount(
+        user_indexes, weights=distances * counted_trips, minlength=user_count
+    )
+    length_including_recreational = np.bincount(
+        user_indexes, weights=distances * counted[modes], minlength=user_count
+    )
+    trips_in_non_working_day = np.bincount(
+        user_indexes,
+        weights=counted_in_non_working_day[modes] & ~working_day_trips,
+        minlength=user_count,
+    )
+    non_working_rides_in_working_day = np.bincount(
+        user_indexes,
+        weights=non_working_ride[modes] & working_day_trips & commute_trips,
+        minlength=user_count,
+    )
+
+    from .results import get_minimum_rides_base_proportional
+
+    working_trips_count_without_minimum = (
+        util.working_days_count(competition) * 2
+        + trips_in_non_working_day
+        - non_working_rides_in_working_day
+    ).astype(np.int64)
+    working_trips_count = np.maximum(
+        working_trips_count_without_minimum,
+        get_minimum_rides_base_proportional(competition, day),
+    )
+    frequency = np.divide(
+        rides_count,
+        working_trips_count,
+        out=np.zeros(user_count),
+        where=working_trips_count != 0,
+    )
+    return TripStatsArrays(
+        user_attendance_ids,
+        rides_count.astype(np.int64),
+        length,
+        length_including_recreational,
+        working_trips_count_without_minimum,
+        working_trips_count,
+        frequency,
+    )
+
+
+def get_trip_stats(user_attendances, competition, day=None):
+    """
+    Vectorised version of results.get_trip_stats
+
+    @return dict {user_attendance_id: TripStats}
+    """
+    from .results import TripStats
+
+    stats = get_trip_stats_arrays(user_attendances, competition, day)
+    return {
+        int(pk): TripStats(
+            int(rides_count),
+            float(length),
+            int(working_trips_count),
+            int(working_trips_count_without_minimum),
+        )
+        for (
+            pk,
+            rides_count,
+            length,
+            working_trips_count,
+            working_trips_count_without_minimum,
+        ) in zip(
+            stats.user_attendance_ids,
+            stats.rides_count,
+            stats.length,
+            stats.working_trips_count,
+            stats.working_trips_count_without_minimum,
+        )
+    }
+
+
+def recalculate_campaign_trip_stats(campaign):
+    """
+    Recalculate denormalized trip statistics (rides count, frequency, length,
+    working rides base) of all user attendances and teams of the campaign
+    in the competition phase and write them in bulk.
+    """
+    from . import results
+
+    try:
+        competition_phase = campaign.phase("competition")
+    except Phase.DoesNotExist:
+        return 0
+    user_attendances = UserAttendance.objects.filter(campaign=campaign)
+    stats = get_trip_stats_arrays(user_attendances, competition_phase)
+
+    user_attendance_objects = []
+    for index, pk in enumerate(stats.user_attendance_ids):
+        user_attendance_objects.append(
+            UserAttendance(
+                pk=int(pk),
+                get_rides_count_denorm=int(stats.rides_count[index]),
+                frequency=float(stats.frequency[index]),
+                trip_length_total=float(stats.length[index]),
+                total_trip_length_including_recreational=float(
+                    stats.length_including_recreational[index]
+                ),
+                working_rides_base_count=int(stats.working_trips_count[index]),
+            ),
+        )
+
+    with transaction.atomic():
+        last_dirty_instance_pk = (
+            denorm.models.DirtyInstance.objects.aggregate(Max("pk"))["pk__max"] or 0
+        )
+        UserAttendance.objects.bulk_update(
+            user_attendance_objects,
+            [
+                "get_rides_count_denorm",
+                "frequency",
+                "trip_length_total",
+                "total_trip_length_including_recreational",
+                "working_rides_base_count",
+            ],
+            batch_size=BULK_UPDATE_BATCH_SIZE,
+        )
+        teams = Team.objects.filter(campaign=campaign)
+        results.update_team_stats(teams)
+        # Teams were marked dirty by the denorm triggers on user attendance
+        # update, but their fields were just written. Marks pending before
+        # (changes of other team fields) are kept, the triggers don't add
+        # a mark for already marked team.
+        denorm.models.DirtyInstance.objects.filter(
+            pk__gt=last_dirty_instance_pk,
+            content_type=contenttypes.models.ContentType.objects.get_for_model(Team),
+            object_id__in=[str(pk) for pk in teams.values_list("pk", flat=True)],
+        ).delete()
+    return len(user_attendance_objects)
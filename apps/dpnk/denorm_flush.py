@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2026 o.s. Auto*Mat
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Single-flight denorm flush.
+
+Only one flush runs at a time (guarded by a lock), flush requests arriving
+while the flush is running are collapsed into one follow-up run
+and the dirty instances are processed in batches of DENORM_FLUSH_BATCH_SIZE.
+"""
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+import denorm
+from denorm.models import DirtyInstance
+
+import redis
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RedisFlushCoordinator:
+    """Flush lock, pending request flag and metrics stored in Redis"""
+
+    lock_key = "dpnk:denorm-flush:lock"
+    pending_key = "dpnk:denorm-flush:pending"
+    metrics_key = "dpnk:denorm-flush:metrics"
+
+    def __init__(self, url):
+        parsed_redis_url = urlparse(url)
+        self.redis = redis.StrictRedis(
+            host=parsed_redis_url.hostname,
+            port=parsed_redis_url.port if parsed_redis_url.port else 6379,
+            db=0,
+        )
+
+    def request(self):
+        """
+        Return True if the flush was not requested yet.
+        The request expires, so it isn't left forever if the requested
+        flush never runs (e.g. the worker died before taking it).
+        """
+        return bool(
+            self.redis.set(
+                self.pending_key,
+                1,
+                nx=True,
+                ex=settings.DENORM_FLUSH_LOCK_TIMEOUT,
+            )
+        )
+
+    def take_request(self):
+        """Clear the request flag, return True if the flush was requested"""
+        return bool(self.redis.delete(self.pending_key))
+
+    def is_requested(self):
+        return bool(self.redis.exists(self.pending_key))
+
+    def lock(self):
+        return self.redis.lock(
+            self.lock_key,
+            timeout=settings.DENORM_FLUSH_LOCK_TIMEOUT,
+        )
+
+    def save_metrics(self, metrics):
+        self.redis.hset(self.metrics_key, mapping=metrics)
+
+    def get_metrics(self):
+        return {
+            key.decode(): float(value)
+            for key, value in self.redis.hgetall(self.metrics_key).items()
+        }
+
+
+class LocalFlushCoordinator:
+    """In-process stand-in of the Redis coordinator (development and tests)"""
+
+    def __init__(self):
+        self.flag_lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending = False
+        self.metrics = {}
+
+    def request(self):
+        with self.flag_lock:
+            requested = not self.pending
+            self.pending = True
+        return requested
+
+    def take_request(self):
+        with self.flag_lock:
+            requested = self.pending
+            self.pending = False
+        return requested
+
+    def is_requested(self):
+        return self.pending
+
+    def lock(self):
+        return self.flush_lock
+
+    def save_metrics(self, metrics):
+        self.metrics.update(metrics)
+
+    def get_metrics(self):
+        return dict(self.metrics)
+
+
+_local_coordinator = LocalFlushCoordinator()
+
+
+def get_coordinator():
+    """
+    Return coordinator according to the DENORM_FLUSH_SINGLE_FLIGHT setting
+    or None if every flush request runs its own flush
+    """
+    if settings.DENORM_FLUSH_SINGLE_FLIGHT == "redis":
+        return RedisFlushCoordinator(
+            settings.DENORM_FLUSH_REDIS_URL or settings.BROKER_URL,
+        )
+    if settings.DENORM_FLUSH_SINGLE_FLIGHT == "local":
+        return _local_coordinator
+    return None
+
+
+def request_flush():
+    """Schedule denorm flush, unless it is already scheduled"""
+    from . import tasks
+
+    coordinator = get_coordinator()
+    if coordinator is None:
+        tasks.flush_denorm.delay()
+    elif coordinator.request():
+        try:
+            tasks.flush_denorm.delay()
+        except Exception:
+            # Don't block the following requests by the flush never scheduled
+            coordinator.take_request()
+            raise
+
+
+def flush_dirty_instances(batch_size):
+    """
+    Save the dirty instances (which recalculates their denormalized fields)
+    in batches the same way as denorm.flush does.
+    Return number of processed dirty instances.
+    """
+    rows = 0
+    while True:
+        dirty_instances = list(DirtyInstance.objects.order_by("pk")[:batch_size])
+        if not dirty_instances:
+            return rows
+        for dirty_instance in dirty_instances:
+            content_object = dirty_instance.content_object
+            if content_object:
+                content_object.save()
+            DirtyInstance.objects.filter(
+                content_type_id=dirty_instance.content_type_id,
+                object_id=dirty_instance.object_id,
+            ).delete()
+        rows += len(dirty_instances)
+
+
+def flush(blocking=False):
+    """
+    Flush the dirty instances if no other flush is running,
+    repeat it while new flush requests arrive.
+
+    With blocking=True wait until the running flush finishes
+    (for callers that need the denormalized fields consistent on return).
+    Return False if the flush was left for the already running flush.
+    """
+    coordinator = get_coordinator()
+    if coordinator is None:
+        denorm.flush()
+        return True
+
+    lock = coordinator.lock()
+    if not lock.acquire(blocking=blocking):
+        # The request will be taken by the running flush
+        coordinator.request()
+        return False
+    try:
+        coordinator.take_request()
+        while True:
+            start = time.monotonic()
+            rows = flush_dirty_instances(settings.DENORM_FLUSH_BATCH_SIZE)
+            duration = time.monotonic() - start
+            metrics = {
+                "backlog": DirtyInstance.objects.count(),
+                "duration": duration,
+                "rows": rows,
+                "rows_per_second": rows / duration if duration else 0,
+                "finished": time.time(),
+            }
+            coordinator.save_metrics(metrics)
+            logger.info("Denorm flush: %s", metrics)
+            if not coordinator.take_request():
+                break
+    finally:
+        lock.release()
+    # Request that arrived after the last check and was refused by the lock
+    if coordinator.is_requested():
+        from . import tasks
+
+        tasks.flush_denorm.delay()
+    return True
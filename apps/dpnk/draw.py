@@ -21,22 +21,27 @@
 import itertools
 import random
 
-from django.db.models import Q
+from django.db.models import F, Q
 
 from .models import Competition, CompetitionResult, Team
+from .results import update_results_rank
 
 
 def draw(competition_slug, limit=10):
     """Draw competitors above threshold in given competition"""
 
     competition = Competition.objects.get(slug=competition_slug)
+    # Ranks of changed results may not be updated yet
+    update_results_rank(competition)
     threshold = competition.campaign.minimum_percentage / 100.0
     condition = {}
     condition["competition"] = competition
     if competition.competition_type == "frequency":
         condition["result__gt"] = threshold
 
-    results = CompetitionResult.objects.filter(**condition).order_by("result")
+    results = CompetitionResult.objects.filter(**condition).order_by(
+        F("rank_from").desc(nulls_last=True), "id"
+    )
 
     if competition.competitor_type == "team":
         teams_all_members_paid = Team.objects.filter(
@@ -18,7 +18,6 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 import datetime
-import gzip
 import logging
 from collections import OrderedDict
 
@@ -44,8 +43,6 @@ from django.utils.safestring import mark_safe
 from django.utils.translation import ngettext
 from django.utils.translation import gettext_lazy as _
 
-from django_gpxpy import gpx_parse
-
 from initial_field import InitialFieldsMixin
 
 from leaflet.forms.widgets import LeafletWidget
@@ -58,7 +55,7 @@ import registration.forms
 
 from t_shirt_delivery.models import TShirtSize
 
-from . import email, models, util, views
+from . import email, models, track_parser, util, views
 from .fields import CommaFloatField, ShowPointsMultipleModelChoiceField
 from .string_lazy import format_html_lazy
 from .widgets import CommuteModeSelect
@@ -1006,21 +1003,9 @@ class FormWithTrackMixin:
             and "gpx_file" in self.cleaned_data
             and self.cleaned_data["gpx_file"]
         ):
-            if self.cleaned_data["gpx_file"].name.endswith(".gz"):
-                track_file = gzip.open(self.cleaned_data["gpx_file"])
-            else:
-                track_file = self.cleaned_data["gpx_file"]
-            try:
-                track_file = track_file.read().decode("utf-8")
-            except UnicodeDecodeError:
-                raise ValidationError(
-                    {
-                        "gpx_file": _(
-                            "Chyba při načítání GPX souboru. Jste si jistí, že jde o GPX soubor?"
-                        )
-                    }
-                )
-            self.cleaned_data["track"] = gpx_parse.parse_gpx(track_file)
+            self.cleaned_data["track"] = track_parser.parse_track_file(
+                self.cleaned_data["gpx_file"],
+            )
             self.changed_data.append("track")
         if self.cleaned_data.get("track", None) and (
             "track" in self.changed_data or not self.cleaned_data["distance"]
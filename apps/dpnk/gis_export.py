@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2026 o.s. Auto*Mat
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+GIS data exports of cities.
+
+Anonymized trips of a city are read from the dpnk_trip_anonymized table
+as a stream and written into Shapefile or GeoPackage
+(CITY_DATA_EXPORT_DRIVER) in a temporary directory of the export,
+so exports of more cities can run at the same time.
+The files are stored as password protected ZIP into CityInCampaign.data_export.
+
+Trips clipped by buffers around city boundaries
+(get_city_trip_geodata command) are written into GeoPackages
+by one query for all the cities.
+"""
+import json
+import logging
+import os
+import tempfile
+from contextlib import ExitStack
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.files.base import File
+from django.db import connection
+
+import fiona
+
+import numpy as np
+
+import pyzipper
+
+from . import heatmap
+from .models import CityInCampaign
+
+logger = logging.getLogger(__name__)
+
+FETCH_SIZE = 2000
+
+TRIPS_SQL = (
+    "SELECT id, campaign_id, age_group, sex, commute_mode, city, occupation_id,"
+    " ST_AsBinary(ST_Force2D(the_geom), 'NDR')"
+    " FROM {table} WHERE city = %s ORDER BY id"
+)
+TRIPS_COUNT_SQL = "SELECT count(*) FROM {table} WHERE city = %s"
+
+# Trips are found by one bitmap scan of the GIST index for bounding boxes
+# of all the buffers, only the candidates are intersected by the buffers
+CLIPPED_TRIPS_SQL = """
+WITH clip AS (
+    SELECT
+        boundary.city_index - 1 AS city_index,
+        ST_Buffer(ST_GeomFromWKB(boundary.wkb, 4326)::geography, %s)::geometry AS geom
+    FROM unnest(%s::bytea[]) WITH ORDINALITY AS boundary(wkb, city_index)
+)
+SELECT
+    clip.city_index,
+    trip.id,
+    trip.campaign_id,
+    trip.age_group,
+    trip.sex,
+    trip.commute_mode,
+    trip.city,
+    trip.occupation_id,
+    ST_AsGeoJSON(ST_Multi(clipped.geom))
+FROM (
+    SELECT * FROM {table}
+    WHERE the_geom && ANY(ARRAY(SELECT geom FROM clip))
+) AS trip
+JOIN clip ON trip.the_geom && clip.geom AND ST_Intersects(trip.the_geom, clip.geom)
+CROSS JOIN LATERAL
+    ST_CollectionExtract(ST_Intersection(trip.the_geom, clip.geom), 2) AS clipped(geom)
+WHERE NOT ST_IsEmpty(clipped.geom)
+"""
+
+SCHEMA = {
+    "geometry": "LineString",
+    "properties": {
+        "id": "int",
+        "campaign_id": "int",
+        "age_group": "int",
+        "sex": "str",
+        "commute_mode": "str",
+        "city": "str",
+        "occupation_id": "int",
+    },
+}
+CLIPPED_SCHEMA = dict(SCHEMA, geometry="MultiLineString")
+FILE_EXTENSIONS = {
+    "ESRI Shapefile": ".shp",
+    "GPKG": ".gpkg",
+}
+
+
+def set_export_status(city_in_campaign, status, progress=0):
+    """Store state of the export, it is updated directly in DB to not overwrite other fields"""
+    CityInCampaign.objects.filter(pk=city_in_campaign.pk).update(
+        data_export_status=status,
+        data_export_progress=progress,
+    )
+
+
+def line_from_wkb(wkb):
+    # Little-endian WKB of LineString: 9 bytes of header and points
+    return fiona.Geometry(
+        type="LineString",
+        coordinates=np.frombuffer(wkb, dtype="<f8", offset=9).reshape(-1, 2).tolist(),
+    )
+
+
+def geometry_from_geojson(geojson):
+    return fiona.Geometry.from_dict(json.loads(geojson))
+
+
+def iter_features(rows, geometry_from=line_from_wkb):
+    for *properties, geometry in rows:
+        yield fiona.Feature(
+            geometry=geometry_from(geometry),
+            properties=fiona.Properties(**dict(zip(SCHEMA["properties"], properties))),
+        )
+
+
+def write_city_trips(city_slug, path, driver, progress_callback=None):
+    """
+    Write anonymized trips of the city into the GIS file.
+    Return number of written rows.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            TRIPS_COUNT_SQL.format(table=heatmap.ANONYMIZED_TRIPS_TABLE), [city_slug]
+        )
+        total = cursor.fetchone()[0]
+    written = 0
+    with fiona.open(
+        path, "w", driver=driver, crs="EPSG:4326", schema=SCHEMA
+    ) as output, connection.chunked_cursor() as cursor:
+        cursor.execute(
+            TRIPS_SQL.format(table=heatmap.ANONYMIZED_TRIPS_TABLE), [city_slug]
+        )
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            output.writerecords(iter_features(rows))
+            written += len(rows)
+            if progress_callback:
+                progress_callback(written, total)
+    return written
+
+
+def write_clipped_trips(boundaries, buffer, outputs):
+    """
+    Write anonymized trips clipped by buffer (in meters) around the boundaries
+    (shapely or GEOS geometries in WGS 84) into GeoPackages,
+    outputs are (path, layer name) pairs of the boundaries.
+    Return numbers of written rows of the boundaries.
+    """
+    counts = [0] * len(boundaries)
+    with ExitStack() as stack:
+        layers = [
+            stack.enter_context(
+                fiona.open(
+                    path,
+                    "w",
+                    driver="GPKG",
+                    layer=layer,
+                    crs="EPSG:4326",
+                    schema=CLIPPED_SCHEMA,
+                )
+            )
+            for path, layer in outputs
+        ]
+        cursor = stack.enter_context(connection.chunked_cursor())
+        cursor.execute(
+            CLIPPED_TRIPS_SQL.format(table=heatmap.ANONYMIZED_TRIPS_TABLE),
+            [buffer, [boundary.wkb for boundary in boundaries]],
+        )
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            batches = [[] for _ in boundaries]
+            for city_index, *row in rows:
+                batches[city_index].append(row)
+            for city_index, batch in enumerate(batches):
+                if batch:
+                    layers[city_index].writerecords(
+                        iter_features(batch, geometry_from_geojson)
+                    )
+                    counts[city_index] += len(batch)
+    return counts
+
+
+def write_encrypted_zip(archive_path, password, directory):
+    """
+    Write files of the directory into ZIP encrypted by AES-256 (WinZip AE-2)
+    with the password.
+    """
+    with pyzipper.AESZipFile(
+        archive_path,
+        "w",
+        compression=pyzipper.ZIP_DEFLATED,
+        encryption=pyzipper.WZ_AES,
+    ) as archive:
+        archive.setpassword(password.encode())
+        for file_name in sorted(os.listdir(directory)):
+            archive.write(os.path.join(directory, file_name), file_name)
+
+
+def export_city_gis_data(city_in_campaign, progress_callback=None):
+    """
+    Export anonymized trips of the city in campaign into password protected ZIP
+    stored in its data_export, progress is stored in data_export_progress.
+
+    Return number of exported rows.
+    """
+    driver = settings.CITY_DATA_EXPORT_DRIVER
+    city_slug = city_in_campaign.city.slug
+    progress = 0
+
+    def report_progress(done, total):
+        nonlocal progress
+        if progress_callback:
+            progress_callback(done, total)
+        # Store only changes of whole percents, the table can change after counting
+        percent = min(done * 100 // max(total, 1), 99)
+        if percent > progress:
+            progress = percent
+            set_export_status(city_in_campaign, "running", progress)
+
+    set_export_status(city_in_campaign, "running")
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            data_dir = os.path.join(work_dir, "data")
+            os.mkdir(data_dir)
+            row_count = write_city_trips(
+                city_slug,
+                os.path.join(data_dir, city_slug + FILE_EXTENSIONS[driver]),
+                driver,
+                report_progress,
+            )
+            password = str(uuid4())[:30]
+            archive_path = os.path.join(work_dir, city_slug + ".zip")
+            write_encrypted_zip(archive_path, password, data_dir)
+            with open(archive_path, "rb") as archive_file:
+                city_in_campaign.data_export.save(
+                    "%s-%s.zip"
+                    % (city_slug, city_in_campaign.campaign.slug_identifier),
+                    File(archive_file),
+                    save=False,
+                )
+    except Exception:
+        set_export_status(city_in_campaign, "failed")
+        raise
+    city_in_campaign.data_export_password = password
+    city_in_campaign.data_export_status = "done"
+    city_in_campaign.data_export_progress = 100
+    city_in_campaign.save(
+        update_fields=[
+            "data_export",
+            "data_export_password",
+            "data_export_status",
+            "data_export_progress",
+        ],
+    )
+    logger.info("GIS data of %s exported with %s rows", city_in_campaign, row_count)
+    return row_count
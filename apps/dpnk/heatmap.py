@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2026 o.s. Auto*Mat
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Heatmap vector tiles (Mapbox Vector Tile) of anonymized trips.
+
+Tiles are rendered by PostGIS from the dpnk_trip_anonymized table
+(generated by tasks.generate_anonymized_trips_table) and cached
+in HEATMAP_TILES_CACHE. Cache keys contain version of the table,
+that is changed by invalidate_tiles() after every rebuild of the table.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+
+ANONYMIZED_TRIPS_TABLE = "dpnk_trip_anonymized"
+TILE_LAYER_NAME = "trips"
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+TILE_CONTENT_TYPE = "application/vnd.mapbox-vector-tile"
+TILES_VERSION_KEY = "heatmap-tiles-version"
+
+TILE_SQL = """
+WITH bounds AS (
+    SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS geom
+), tile AS (
+    SELECT
+        ST_AsMVTGeom(
+            ST_Transform(trip.the_geom, 3857),
+            bounds.geom,
+            %(extent)s,
+            %(buffer)s,
+            true
+        ) AS geom,
+        trip.commute_mode
+    FROM {table} AS trip, bounds
+    WHERE trip.campaign_id = %(campaign_id)s
+        AND (%(city)s::text IS NULL OR trip.city = %(city)s::text)
+        AND trip.the_geom && ST_Transform(
+            ST_TileEnvelope(
+                %(z)s, %(x)s, %(y)s, margin => %(buffer)s::float / %(extent)s
+            ),
+            4326
+        )
+)
+SELECT ST_AsMVT(tile.*, %(layer)s, %(extent)s, 'geom') FROM tile
+WHERE tile.geom IS NOT NULL
+"""
+
+
+def is_valid_tile(z, x, y):
+    """Return whether the tile exists and has allowed zoom"""
+    return (
+        settings.HEATMAP_TILES_MIN_ZOOM <= z <= settings.HEATMAP_TILES_MAX_ZOOM
+        and 0 <= x < 2**z
+        and 0 <= y < 2**z
+    )
+
+
+def get_tiles_cache():
+    return caches[settings.HEATMAP_TILES_CACHE]
+
+
+def get_tiles_version():
+    """Return version of the anonymized trips table used in tile cache keys"""
+    cache = get_tiles_cache()
+    version = cache.get(TILES_VERSION_KEY)
+    if version is None:
+        version = invalidate_tiles()
+    return version
+
+
+def invalidate_tiles():
+    """
+    Change version of cached tiles, old tiles are not used anymore
+    and expire by HEATMAP_TILES_CACHE_TIMEOUT.
+    Has to be called after the anonymized trips table is rebuilt.
+    """
+    version = str(time.time_ns())
+    get_tiles_cache().set(TILES_VERSION_KEY, version, timeout=None)
+    return version
+
+
+def anonymized_trips_table_exists():
+    with connection.cursor() as cursor:
+        return ANONYMIZED_TRIPS_TABLE in connection.introspection.table_names(cursor)
+
+
+def render_tile(campaign, city_slug, z, x, y):
+    """
+    Render vector tile of anonymized trips of the campaign
+    (and the city if city_slug is given)
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            TILE_SQL.format(table=ANONYMIZED_TRIPS_TABLE),
+            {
+                "z": z,
+                "x": x,
+                "y": y,
+                "extent": TILE_EXTENT,
+                "buffer": TILE_BUFFER,
+                "layer": TILE_LAYER_NAME,
+                "campaign_id": campaign.pk,
+                "city": city_slug,
+            },
+        )
+        tile = cursor.fetchone()[0]
+    return bytes(tile) if tile else b""
+
+
+def get_tile(campaign, city_slug, z, x, y):
+    """
+    Return cached vector tile of anonymized trips,
+    None if the anonymized trips table was not generated yet.
+    """
+    cache = get_tiles_cache()
+    key = "heatmap-tile:%s:%s:%s:%s/%s/%s" % (
+        get_tiles_version(),
+        campaign.pk,
+        city_slug or "",
+        z,
+        x,
+        y,
+    )
+    tile = cache.get(key)
+    if tile is None:
+        if not anonymized_trips_table_exists():
+            return None
+        tile = render_tile(campaign, city_slug, z, x, y)
+        cache.set(key, tile, timeout=settings.HEATMAP_TILES_CACHE_TIMEOUT)
+    return tile
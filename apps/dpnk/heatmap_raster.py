@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2026 o.s. Auto*Mat
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Precomputed raster heatmaps of anonymized trips of a city.
+
+Trips of the city are read from the dpnk_trip_anonymized table as a stream
+and their segments are rasterised into density grids of the zoom levels
+HEATMAP_RASTER_ZOOMS (pixels of 256x256 Web Mercator tiles).
+The grids are periodically stored into HEATMAP_RASTER_WORK_DIR,
+so interrupted job continues from the last stored trip.
+
+Finally the grids are log scaled, colored and written as ZIP of PNG tile
+pyramid ({z}/{x}/{y}.png) into CityInCampaign.heatmap_export.
+"""
+import io
+import json
+import logging
+import os
+import shutil
+import zipfile
+
+from django.conf import settings
+from django.core.files.base import File
+from django.db import connection
+
+import numpy as np
+
+from PIL import Image
+
+from . import heatmap
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+MAX_LATITUDE = 85.05112878
+FETCH_SIZE = 2000
+
+# Colors (RGBA) of log scaled density from 0 to 1
+COLOR_STOPS = (
+    (0, (0, 0, 255, 0)),
+    (0.25, (0, 0, 255, 160)),
+    (0.5, (255, 0, 0, 200)),
+    (0.75, (255, 255, 0, 230)),
+    (1, (255, 255, 255, 255)),
+)
+
+EXTENT_SQL = """
+SELECT ST_XMin(extent), ST_YMin(extent), ST_XMax(extent), ST_YMax(extent)
+FROM (
+    SELECT ST_Extent(the_geom) AS extent FROM {table}
+    WHERE campaign_id = %s AND city = %s
+) AS city_extent
+"""
+
+LINES_WHERE = """
+WHERE campaign_id = %s AND city = %s AND id > %s
+    AND ST_GeometryType(the_geom) = 'ST_LineString'
+"""
+LINES_SQL = (
+    "SELECT id, ST_AsBinary(ST_Force2D(the_geom), 'NDR') FROM {table}"
+    + LINES_WHERE
+    + "ORDER BY id"
+)
+LINES_COUNT_SQL = "SELECT count(*) FROM {table}" + LINES_WHERE
+
+
+def lonlat_to_pixels(lon, lat, zoom):
+    """Return global Web Mercator pixel coordinates of the points at the zoom"""
+    scale = TILE_SIZE * 2**zoom
+    x = (np.asarray(lon) + 180) / 360 * scale
+    lat = np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE))
+    y = (1 - np.arcsinh(np.tan(lat)) / np.pi) / 2 * scale
+    return x, y
+
+
+def get_tile_range(extent, zoom):
+    """Return [min x, min y, max x, max y] of tiles covering the extent"""
+    min_lon, min_lat, max_lon, max_lat = extent
+    (min_x, max_x), (max_y, min_y) = lonlat_to_pixels(
+        [min_lon, max_lon],
+        [min_lat, max_lat],
+        zoom,
+    )
+    last_tile = 2**zoom - 1
+    return [
+        int(min(max(value // TILE_SIZE, 0), last_tile))
+        for value in (min_x, min_y, max_x, max_y)
+    ]
+
+
+def rasterize_segments(grid, x0, y0, x1, y1):
+    """
+    Add segments (arrays of start and end pixel coordinates relative to the
+    grid) into the density grid, every pixel on the segment is incremented.
+    The end point is not drawn, it is the start of the next segment.
+    """
+    steps = np.ceil(np.maximum(np.abs(x1 - x0), np.abs(y1 - y0)))
+    steps = np.maximum(steps, 1).astype(np.int64)
+    # Sample every segment at steps points (one pixel or less apart)
+    segment = np.repeat(np.arange(steps.size), steps)
+    first_sample = np.repeat(np.cumsum(steps) - steps, steps)
+    t = (np.arange(segment.size) - first_sample) / steps[segment]
+    xs = np.floor(x0[segment] + (x1 - x0)[segment] * t).astype(np.int64)
+    ys = np.floor(y0[segment] + (y1 - y0)[segment] * t).astype(np.int64)
+    height, width = grid.shape
+    inside = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+    np.add.at(grid, (ys[inside], xs[inside]), 1)
+
+
+def get_color_table():
+    """Return 256x4 array of RGBA colors of log scaled density levels"""
+    levels = np.linspace(0, 1, 256)
+    positions = [position for position, color in COLOR_STOPS]
+    return np.stack(
+        [
+            np.interp(levels, positions, [color[channel] for _, color in COLOR_STOPS])
+            for channel in range(4)
+        ],
+        axis=1,
+    ).astype(np.uint8)
+
+
+def iter_tiles(grid, tile_range):
+    """Yield (x, y, PNG image) of non-empty tiles of the log scaled density grid"""
+    maximum = grid.max()
+    if not maximum:
+        return
+    color_table = get_color_table()
+    min_x, min_y, max_x, max_y = tile_range
+    for tile_y in range(max_y - min_y + 1):
+        for tile_x in range(max_x - min_x + 1):
+            tile_slice = (
+                slice(tile_y * TILE_SIZE, (tile_y + 1) * TILE_SIZE),
+                slice(tile_x * TILE_SIZE, (tile_x + 1) * TILE_SIZE),
+            )
+            tile = grid[tile_slice]
+            if not tile.any():
+                continue
+            levels = np.log1p(tile) / np.log1p(maximum)
+            colors = color_table[np.rint(levels * 255).astype(np.uint8)]
+            image = io.BytesIO()
+            Image.fromarray(colors, "RGBA").save(image, "PNG")
+            yield min_x + tile_x, min_y + tile_y, image.getvalue()
+
+
+class CityHeatmap:
+    """
+    Density grids of the city in campaign
+    with state of the computation stored in the work directory
+    """
+
+    def __init__(self, city_in_campaign):
+        self.city_in_campaign = city_in_campaign
+        self.work_dir = os.path.join(
+            settings.HEATMAP_RASTER_WORK_DIR,
+            str(city_in_campaign.pk),
+        )
+        self.version = None
+        self.last_id = 0
+        self.tile_ranges = {}
+        self.grids = {}
+
+    @property
+    def state_path(self):
+        return os.path.join(self.work_dir, "state.json")
+
+    def grid_path(self, zoom):
+        return os.path.join(self.work_dir, "grid-%s.npy" % zoom)
+
+    def get_extent(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                EXTENT_SQL.format(table=heatmap.ANONYMIZED_TRIPS_TABLE),
+                [self.city_in_campaign.campaign_id, self.city_in_campaign.city.slug],
+            )
+            extent = cursor.fetchone()
+        if extent[0] is None:
+            return None
+        return extent
+
+    def start(self):
+        """
+        Load stored state of the computation or create empty grids,
+        return False if the city has no anonymized trips.
+        """
+        self.version = heatmap.get_tiles_version()
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as state_file:
+                state = json.load(state_file)
+            # Anonymized trips table wasn't rebuilt since the state was stored
+            if state["version"] == self.version:
+                self.last_id = state["last_id"]
+                for zoom, tile_range in state["tile_ranges"].items():
+                    self.tile_ranges[int(zoom)] = tile_range
+                    self.grids[int(zoom)] = np.load(self.grid_path(zoom))
+                logger.info(
+                    "Heatmap of %s continues from trip %s",
+                    self.city_in_campaign,
+                    self.last_id,
+                )
+                return True
+        extent = self.get_extent()
+        if extent is None:
+            return False
+        for zoom in settings.HEATMAP_RASTER_ZOOMS:
+            min_x, min_y, max_x, max_y = get_tile_range(extent, zoom)
+            shape = (
+                (max_y - min_y + 1) * TILE_SIZE,
+                (max_x - min_x + 1) * TILE_SIZE,
+            )
+            if shape[0] * shape[1] > settings.HEATMAP_RASTER_MAX_PIXELS:
+                logger.warning(
+                    "Heatmap of %s is too large in zoom %s", self.city_in_campaign, zoom
+                )
+                continue
+            self.tile_ranges[zoom] = [min_x, min_y, max_x, max_y]
+            self.grids[zoom] = np.zeros(shape, dtype=np.uint32)
+        return True
+
+    def save_state(self):
+        """Store the grids and the last processed trip id"""
+        os.makedirs(self.work_dir, exist_ok=True)
+        for zoom, grid in self.grids.items():
+            # Files are replaced atomically, so interruption keeps the previous state
+            np.save(self.grid_path(zoom) + ".tmp.npy", grid)
+            os.replace(self.grid_path(zoom) + ".tmp.npy", self.grid_path(zoom))
+        with open(self.state_path + ".tmp", "w") as state_file:
+            json.dump(
+                {
+                    "version": self.version,
+                    "last_id": self.last_id,
+                    "tile_ranges": self.tile_ranges,
+                },
+                state_file,
+            )
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def add_lines(self, lines):
+        """Rasterise lines (arrays of longitudes and latitudes) into the grids"""
+        starts = np.concatenate([line[:-1] for line in lines])
+        ends = np.concatenate([line[1:] for line in lines])
+        for zoom, grid in self.grids.items():
+            min_x, min_y = self.tile_ranges[zoom][:2]
+            origin_x, origin_y = min_x * TILE_SIZE, min_y * TILE_SIZE
+            x0, y0 = lonlat_to_pixels(starts[:, 0], starts[:, 1], zoom)
+            x1, y1 = lonlat_to_pixels(ends[:, 0], ends[:, 1], zoom)
+            rasterize_segments(
+                grid, x0 - origin_x, y0 - origin_y, x1 - origin_x, y1 - origin_y
+            )
+
+    def process_trips(self, progress_callback=None):
+        """
+        Rasterise trips of the city following the last processed trip,
+        the state is stored every HEATMAP_RASTER_CHECKPOINT_ROWS rows.
+        Return number of processed rows.
+        """
+        params = [
+            self.city_in_campaign.campaign_id,
+            self.city_in_campaign.city.slug,
+            self.last_id,
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                LINES_COUNT_SQL.format(table=heatmap.ANONYMIZED_TRIPS_TABLE), params
+            )
+            total = cursor.fetchone()[0]
+        processed = 0
+        since_checkpoint = 0
+        with connection.chunked_cursor() as cursor:
+            cursor.execute(
+                LINES_SQL.format(table=heatmap.ANONYMIZED_TRIPS_TABLE), params
+            )
+            while True:
+                rows = cursor.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                lines = []
+                for trip_id, wkb in rows:
+                    # Trip can have more lines, checkpoint only between trips
+                    if (
+                        trip_id != self.last_id
+                        and since_checkpoint >= settings.HEATMAP_RASTER_CHECKPOINT_ROWS
+                    ):
+                        if lines:
+                            self.add_lines(lines)
+                            lines = []
+                        self.save_state()
+                        since_checkpoint = 0
+                    # Little-endian WKB of LineString: 9 bytes of header and points
+                    lines.append(
+                        np.frombuffer(wkb, dtype="<f8", offset=9).reshape(-1, 2)
+                    )
+                    self.last_id = trip_id
+                    since_checkpoint += 1
+                    processed += 1
+                if lines:
+                    self.add_lines(lines)
+                if progress_callback:
+                    progress_callback(processed, total)
+        return processed
+
+    def write_tiles(self, archive_file):
+        """Write ZIP of PNG tile pyramid to the file, return number of tiles"""
+        tile_count = 0
+        with zipfile.ZipFile(archive_file, "w", zipfile.ZIP_STORED) as archive:
+            for zoom, grid in self.grids.items():
+                for x, y, image in iter_tiles(grid, self.tile_ranges[zoom]):
+                    archive.writestr("%s/%s/%s.png" % (zoom, x, y), image)
+                    tile_count += 1
+        return tile_count
+
+    def finish(self):
+        """Store the tiles into CityInCampaign.heatmap_export and remove the state"""
+        os.makedirs(self.work_dir, exist_ok=True)
+        archive_path = os.path.join(self.work_dir, "heatmap.zip")
+        tile_count = self.write_tiles(archive_path)
+        city_in_campaign = self.city_in_campaign
+        with open(archive_path, "rb") as archive_file:
+            city_in_campaign.heatmap_export.save(
+                "%s-%s-heatmap.zip"
+                % (
+                    city_in_campaign.city.slug,
+                    city_in_campaign.campaign.slug_identifier,
+                ),
+                File(archive_file),
+            )
+        shutil.rmtree(self.work_dir)
+        return tile_count
+
+
+def generate_city_heatmap(city_in_campaign, progress_callback=None):
+    """
+    Compute raster heatmap of anonymized trips of the city in campaign
+    and store it into its heatmap_export.
+    Continue interrupted computation if there is any.
+
+    Return number of tiles.
+    """
+    city_heatmap = CityHeatmap(city_in_campaign)
+    if not city_heatmap.start():
+        logger.info("City %s has no anonymized trips", city_in_campaign)
+        return 0
+    city_heatmap.process_trips(progress_callback)
+    return city_heatmap.finish()
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+
+from denorm.models import DirtyInstance
+
+from django.core.management import BaseCommand
+
+from dpnk import denorm_flush
+
+
+class Command(BaseCommand):
+    help = (
+        "Print backlog of dirty instances and metrics of the last denorm flush"  # noqa
+    )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"backlog: {DirtyInstance.objects.count()}")
+        coordinator = denorm_flush.get_coordinator()
+        if coordinator is None:
+            self.stdout.write("Single-flight denorm flush is disabled")
+            return
+        metrics = coordinator.get_metrics()
+        if not metrics:
+            self.stdout.write("No flush finished yet")
+            return
+        self.stdout.write(
+            f"last flush duration: {metrics['duration']:.1f} s\n"
+            f"last flush rows: {metrics['rows']:.0f}\n"
+            f"rows per second: {metrics['rows_per_second']:.1f}"
+        )
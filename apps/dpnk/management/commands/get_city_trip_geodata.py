@@ -1,16 +1,16 @@
 import argparse
 import os
-import tempfile
 import subprocess
 
-from django.db import connection
-from django.conf import settings
 from django.core.management import BaseCommand, CommandError
 from django.utils import timezone
+from django.utils.text import slugify
 from django.utils.translation import gettext as _
 
 import osmnx as ox
 
+from ... import gis_export
+
 
 def float_range_validator(min_val, max_val):
     """Float range type validator
@@ -48,19 +48,23 @@ def float_range_validator(min_val, max_val):
 
 
 class Command(BaseCommand):
-    """Get city user defined buffer clipped trip geodata as GPKG format"""
+    """Get cities user defined buffer clipped trip geodata as GPKG format"""
 
     help = (
-        "Get city user defined buffer clipped trip line geodata"
+        "Get cities user defined buffer clipped trip line geodata"
         " as GPKG format"  # noqa
     )
 
     def add_arguments(self, parser):
         parser.add_argument(
             "--city",
-            dest="city",
+            dest="cities",
+            action="append",
             required=True,
-            help=_("Czechia city name e.g 'Brandýs nad Labem'"),
+            help=_(
+                "Czechia city name e.g 'Brandýs nad Labem',"
+                " repeat the argument for more cities"
+            ),
         )
         parser.add_argument(
             "--buffer",
@@ -77,140 +81,13 @@ class Command(BaseCommand):
             help=_("AWS S3 Bucket GPKG geodata directory"),
         )
 
-    def _get_clip_trip_sql(
-        self,
-        pg_city_buffer,
-        pg_city,
-        buffer,
-        pg_input_clipped,
-        pg_input,
-    ):
-        """Get SQL for create buffer and clip input table by buffer
-
-        :param str pg_city_buffer: output PG city buffer table name
-        :param str pg_city: PG city table name
-        :param float buffer: buffer around PG city table in meter unit
-        :param str pg_input_clipped: output PG clipped table name
-        :param str pg_input: input PG table name which will be clipped
-
-        :return str: return SQL
-        """
-        # Create buffer
-        sql = (
-            "CREATE TABLE %s AS ("
-            "SELECT ST_Buffer(%s.the_geom::geography, %s) FROM %s);"
-            % (
-                pg_city_buffer,
-                pg_city,
-                buffer,
-                pg_city,
-            )
-        )
-        # Clip input by buffer
-        sql += (
-            "CREATE TABLE %s AS (SELECT ST_Intersection(input.the_geom,"
-            " clip.st_buffer)"
-            " AS clipped FROM %s as clip,"
-            " %s as input"
-            " WHERE ST_Intersects(clip.st_buffer, input.the_geom));"
-            % (
-                pg_input_clipped,
-                pg_city_buffer,
-                pg_input,
-            )
-        )
-        return sql
-
-    def _get_ogr_pg_conn(self, db_settings):
-        """Get ogr2ogr PostGIS connection string
-
-        :param dict db_settings: django DB setings
-
-        :return str: ogr2ogr PG connection string
-        """
-        return (
-            f" PG:\"dbname='{db_settings['NAME']}'"
-            f" host='{db_settings['HOST']}'"
-            f" port='{5432 if not db_settings['PORT'] else db_settings['PORT']}'"
-            f" user='{db_settings['USER']}'"
-            f" password='{db_settings['PASSWORD']}'\""
-        )
-
-    def _upload_shp_to_pg(self, city_shp, db_settings, pg_city, shp_suffix):
-        """Upload city shapefile to PostGIS
+    def _get_city_boundary(self, city):
+        """Get city district boundary from OSM
 
-        :param str city_shp: city shapefile path
-        :param dict db_settings: django DB setings
-        :param str pg_city: PG city table name
-        :param str shp_suffix: shapefile suffix ".shp"
+        :param str city: Czechia city name
 
-        :return None
+        :return shapely.geometry.base.BaseGeometry: city boundary in WGS 84
         """
-
-        # Upload city district shapefile to PostGIS DB
-        subprocess.check_output(
-            "ogr2ogr -f PostgreSQL"
-            f"{self._get_ogr_pg_conn(db_settings)}"
-            f" -nln {pg_city}"  # PG table name
-            " -sql 'SELECT osm_id AS osm_id, geometry AS the_geom FROM"  # rename columns
-            f" {os.path.basename(city_shp).removesuffix(shp_suffix)}'"
-            " -dialect SQLite"
-            f" {city_shp}",
-            shell=True,
-        )
-
-    def _export_pg_table_to_gpkg(
-        self,
-        exported_gpkg,
-        db_settings,
-        pg_city,
-        pg_input_clipped,
-    ):
-        """Upload city shapefile to PostGIS
-
-        :param str exported_gpkg: exported clipped PG trip table to GPKG
-                                  format path
-        :param dict db_settings: django DB setings
-        :param str pg_city: PG city table name
-        :param str pg_input_clipped: PG input clipped trip table name
-
-        :return None
-        """
-        # Export clipped trip to GPKG format
-        subprocess.check_output(
-            "ogr2ogr -f GPKG"
-            f" {exported_gpkg}"
-            f"{self._get_ogr_pg_conn(db_settings)}"
-            f" -nln {pg_city}"  # GPKG table name
-            f" -sql 'SELECT * FROM {pg_input_clipped}'",
-            shell=True,
-        )
-
-    def _drop_pg_tables(
-        self,
-        cursor,
-        tables,
-    ):
-        """Drop PostGIS tables
-
-        :param django.db.backends.utils.CursorDebugWrapper cursor: Django DB connection
-                                                                   cursor
-        :param list tables: list of tables for dropping
-
-        :return None
-        """
-
-        # Drop tables
-        cursor.execute("DROP TABLE IF EXISTS %s" % (", ".join(tables)))
-
-    def handle(self, *args, **options):
-        city = options.get("city")
-        buffer = options.get("buffer")
-        aws_s3_bucket_exported_gpkgs_dir = options.get("aws_s3_gpkg_dir")
-
-        db_settings = settings.DATABASES["default"]
-        shp_suffix = ".shp"
-
         try:
             city_boundary = ox.geocode_to_gdf(f"Czechia, {city}")
         except ValueError:
@@ -220,95 +97,72 @@ class Command(BaseCommand):
                     " Try again with correct name, please.".format(city=city),
                 )
             )
+        return city_boundary.to_crs(epsg=4326).geometry.unary_union
 
-        with tempfile.TemporaryDirectory() as temp_dir:
-            city_shp = os.path.join(temp_dir, "city.shp")
+    def handle(self, *args, **options):
+        cities = options.get("cities")
+        buffer = options.get("buffer")
+        aws_s3_bucket_exported_gpkgs_dir = options.get("aws_s3_gpkg_dir")
 
-            pg_input = "dpnk_trip_anonymized"
-            pg_city = os.path.basename(city_shp).removesuffix(shp_suffix)
-            pg_city_buffer = f"{pg_city}_buffer"
-            pg_input_clipped = "trip"
+        city_boundaries = [self._get_city_boundary(city) for city in cities]
 
-            aws_s3_bucket_mnt_dir = os.path.join(
-                os.path.expanduser("~"),
-                "mnt",
+        aws_s3_bucket_mnt_dir = os.path.join(
+            os.path.expanduser("~"),
+            "mnt",
+        )
+        timestamp = timezone.now().strftime("%Y-%m-%d-%H-%M")
+        exported_gpkgs = [
+            os.path.join(
+                aws_s3_bucket_mnt_dir,
+                aws_s3_bucket_exported_gpkgs_dir,
+                f"trip_{slugify(city)}_{timestamp}.gpkg",
             )
-
-            exported_gpkg = os.path.join(
+            for city in cities
+        ]
+        if not os.path.exists(aws_s3_bucket_mnt_dir):
+            os.mkdir(aws_s3_bucket_mnt_dir)
+
+        # Mount AWS S3 Bucket
+        mnt_s3_sh_script = os.path.join(
+            os.path.dirname(__file__),
+            "mount_aws_s3_bucket.sh",
+        )
+        subprocess.check_output(
+            [
+                mnt_s3_sh_script,
                 aws_s3_bucket_mnt_dir,
                 aws_s3_bucket_exported_gpkgs_dir,
-                f"trip_{timezone.now().strftime('%Y-%m-%d-%H-%M')}.gpkg",
+            ],
+        )
+        try:
+            # Stream clipped trips of all cities to GPKG files
+            row_counts = gis_export.write_clipped_trips(
+                city_boundaries,
+                buffer,
+                [
+                    (exported_gpkg, slugify(city))
+                    for exported_gpkg, city in zip(exported_gpkgs, cities)
+                ],
             )
-            if not os.path.exists(aws_s3_bucket_mnt_dir):
-                os.mkdir(aws_s3_bucket_mnt_dir)
-
-            with connection.cursor() as cursor:
-                self._drop_pg_tables(
-                    cursor,
-                    tables=[pg_city, pg_city_buffer, pg_input_clipped],
-                )
-                # Export city distric to the shapefile
-                city_boundary.to_file(city_shp)
-                # Upload shapefile to PostGIS DB
-                self._upload_shp_to_pg(
-                    city_shp,
-                    db_settings,
-                    pg_city,
-                    shp_suffix,
-                )
-                # Clip trip table by city buffer
-                cursor.execute(
-                    self._get_clip_trip_sql(
-                        pg_city_buffer,
-                        pg_city,
-                        buffer,
-                        pg_input_clipped,
-                        pg_input,
-                    )
-                )
-                # Mount AWS S3 Bucket
-                mnt_s3_sh_script = os.path.join(
-                    os.path.dirname(__file__),
-                    "mount_aws_s3_bucket.sh",
-                )
-                cmd = (
-                    f"{mnt_s3_sh_script}"
-                    f" {aws_s3_bucket_mnt_dir}"
-                    f" {aws_s3_bucket_exported_gpkgs_dir}"
-                )
-                subprocess.check_output(
-                    cmd,
-                    shell=True,
-                )
-                # Export clipped trip table to GPKG format
-                self._export_pg_table_to_gpkg(
-                    exported_gpkg,
-                    db_settings,
-                    pg_city,
-                    pg_input_clipped,
-                )
-                # Umount AWS S3 bucket
-                subprocess.check_output(
-                    f"fusermount -u {aws_s3_bucket_mnt_dir}",
-                    shell=True,
-                )
-                self._drop_pg_tables(
-                    cursor,
-                    tables=[pg_city, pg_city_buffer, pg_input_clipped],
-                )
-                self.stdout.write(
-                    self.style.SUCCESS(
-                        _(
-                            "Result city <{city}> trip geodata GPKG file"
-                            " <{gpkg}> with buffer distance <{buffer} m>"
-                            " was uploaded into AWS S3 Bucket <{s3_bucket}>"
-                            " into destination dir <{dest_dir}/>.".format(
-                                buffer=buffer,
-                                s3_bucket=os.getenv("DPNK_AWS_STORAGE_BUCKET_NAME"),
-                                dest_dir=aws_s3_bucket_exported_gpkgs_dir,
-                                city=city,
-                                gpkg=os.path.basename(exported_gpkg),
-                            )
+        finally:
+            # Umount AWS S3 bucket
+            subprocess.check_output(["fusermount", "-u", aws_s3_bucket_mnt_dir])
+        for city, exported_gpkg, row_count in zip(cities, exported_gpkgs, row_counts):
+            self.stdout.write(
+                self.style.SUCCESS(
+                    _(
+                        "Result city <{city}> trip geodata GPKG file"
+                        " <{gpkg}> with buffer distance <{buffer} m>"
+                        " and <{row_count}> trips"
+                        " was uploaded into AWS S3 Bucket <{s3_bucket}>"
+                        " into destination dir <{dest_dir}/>.".format(
+                            buffer=buffer,
+                            s3_bucket=os.getenv("DPNK_AWS_STORAGE_BUCKET_NAME"),
+                            dest_dir=aws_s3_bucket_exported_gpkgs_dir,
+                            city=city,
+                            gpkg=os.path.basename(exported_gpkg),
+                            row_count=row_count,
                         )
                     )
                 )
+            )
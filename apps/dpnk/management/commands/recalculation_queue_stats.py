@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+
+from django.core.management import BaseCommand
+
+from dpnk import recalculation_queue
+
+
+class Command(BaseCommand):
+    help = "Print depth and lag of the results recalculation queue"  # noqa
+
+    def handle(self, *args, **options):
+        queue = recalculation_queue.get_queue()
+        if queue is None:
+            self.stdout.write("Results recalculation queue is disabled")
+            return
+        stats = queue.stats()
+        self.stdout.write(f"depth: {stats.depth}\nlag: {stats.lag:.1f} s")
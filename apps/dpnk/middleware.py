@@ -21,6 +21,7 @@ import logging
 
 from django.conf import settings
 from django.contrib.sites.models import Site
+from django.db import DatabaseError
 from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import redirect
 from django.template.response import TemplateResponse
@@ -31,8 +32,8 @@ from django.utils.translation import gettext_lazy as _
 
 from sesame.middleware import AuthenticationMiddleware
 
+from . import denorm_flush
 from .models import Campaign, UserAttendance, UserProfile
-from .tasks import flush_denorm
 
 
 logger = logging.getLogger(__name__)
@@ -143,7 +144,7 @@ class CeleryDenormMiddleware(MiddlewareMixin, object):
 
     def process_response(self, request, response):
         try:
-            flush_denorm.delay()
+            denorm_flush.request_flush()
         except DatabaseError as e:
             logger.error(e)
         return response
@@ -0,0 +1,45 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:00
+
+import datetime
+
+from django.db import migrations, models
+
+
+def create_public_holidays(apps, schema_editor):
+    PublicHoliday = apps.get_model("dpnk", "PublicHoliday")
+    PublicHoliday.objects.bulk_create(
+        [
+            PublicHoliday(date=datetime.date(2016, 5, 1), name="Svátek práce", every_year=True),
+            PublicHoliday(date=datetime.date(2016, 5, 8), name="Den vítězství", every_year=True),
+            PublicHoliday(date=datetime.date(2016, 7, 5), name="Den slovanských věrozvěstů Cyrila a Metoděje"),
+            PublicHoliday(date=datetime.date(2016, 7, 6), name="Den upálení mistra Jana Husa"),
+            PublicHoliday(date=datetime.date(2016, 9, 28), name="Den české státnosti"),
+            PublicHoliday(date=datetime.date(2016, 10, 28), name="Den vzniku samostatného československého státu"),
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dpnk', '0193_auto_20260515_1352'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PublicHoliday',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Datum')),
+                ('name', models.CharField(blank=True, max_length=100, verbose_name='Název')),
+                ('every_year', models.BooleanField(default=False, help_text='Svátek se opakuje každý rok ve stejný den a měsíc', verbose_name='Každý rok')),
+            ],
+            options={
+                'verbose_name': 'Státní svátek',
+                'verbose_name_plural': 'Státní svátky',
+                'ordering': ['date'],
+                'unique_together': {('date', 'every_year')},
+            },
+        ),
+        migrations.RunPython(create_public_holidays, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dpnk", "0194_publicholiday"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="competitionresult",
+            name="rank_from",
+            field=models.PositiveIntegerField(
+                blank=True, default=None, null=True, verbose_name="Pořadí od"
+            ),
+        ),
+        migrations.AddField(
+            model_name="competitionresult",
+            name="rank_to",
+            field=models.PositiveIntegerField(
+                blank=True, default=None, null=True, verbose_name="Pořadí do"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="competitionresult",
+            index=models.Index(
+                fields=["competition", "rank_from"],
+                name="dpnk_compet_competi_947085_idx",
+            ),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE dpnk_competitionresult AS competition_result
+            SET rank_from = ranks.rank_from, rank_to = ranks.rank_to
+            FROM (
+                SELECT
+                    id,
+                    RANK() OVER (
+                        PARTITION BY competition_id ORDER BY result DESC
+                    ) AS rank_from,
+                    COUNT(*) OVER (
+                        PARTITION BY competition_id ORDER BY result DESC
+                    ) AS rank_to
+                FROM dpnk_competitionresult
+                WHERE result IS NOT NULL
+            ) AS ranks
+            WHERE competition_result.id = ranks.id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,115 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:00
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dpnk", "0195_competitionresult_rank"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CompetitionRecalculation",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "chunks_total",
+                    models.PositiveIntegerField(default=0, verbose_name="Počet částí"),
+                ),
+                (
+                    "chunks_done",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Hotových částí"
+                    ),
+                ),
+                (
+                    "created",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Datum vytvoření"
+                    ),
+                ),
+                (
+                    "finished",
+                    models.DateTimeField(
+                        blank=True,
+                        default=None,
+                        null=True,
+                        verbose_name="Datum dokončení",
+                    ),
+                ),
+                (
+                    "competition",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="recalculations",
+                        to="dpnk.Competition",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Přepočet výsledků soutěže",
+                "verbose_name_plural": "Přepočty výsledků soutěží",
+                "ordering": ["-created"],
+            },
+        ),
+        migrations.CreateModel(
+            name="CompetitionRecalculationChunk",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("index", models.PositiveIntegerField(verbose_name="Pořadí části")),
+                ("competitor_ids", models.JSONField(verbose_name="ID soutěžících")),
+                (
+                    "results",
+                    models.JSONField(
+                        blank=True,
+                        default=None,
+                        encoder=django.core.serializers.json.DjangoJSONEncoder,
+                        null=True,
+                        verbose_name="Výsledky",
+                    ),
+                ),
+                (
+                    "finished",
+                    models.DateTimeField(
+                        blank=True,
+                        default=None,
+                        null=True,
+                        verbose_name="Datum dokončení",
+                    ),
+                ),
+                (
+                    "recalculation",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="chunks",
+                        to="dpnk.CompetitionRecalculation",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Část přepočtu výsledků soutěže",
+                "verbose_name_plural": "Části přepočtů výsledků soutěží",
+                "unique_together": {("recalculation", "index")},
+            },
+        ),
+    ]
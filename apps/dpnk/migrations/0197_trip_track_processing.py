@@ -0,0 +1,22 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dpnk", "0196_competitionrecalculation"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="trip",
+            name="track_processing",
+            field=models.BooleanField(
+                default=False,
+                help_text="Trasa z GPX souboru ještě nebyla načtena",
+                verbose_name="Trasa se zpracovává",
+            ),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:00
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dpnk", "0197_trip_track_processing"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="trip",
+            name="track_low",
+            field=django.contrib.gis.db.models.fields.MultiLineStringField(
+                blank=True,
+                editable=False,
+                geography=True,
+                help_text="Zjednodušená trasa pro zobrazení",
+                null=True,
+                srid=4326,
+                verbose_name="trasa v nízké kvalitě",
+            ),
+        ),
+        migrations.AddField(
+            model_name="trip",
+            name="track_medium",
+            field=django.contrib.gis.db.models.fields.MultiLineStringField(
+                blank=True,
+                editable=False,
+                geography=True,
+                help_text="Zjednodušená trasa pro zobrazení",
+                null=True,
+                srid=4326,
+                verbose_name="trasa ve střední kvalitě",
+            ),
+        ),
+    ]
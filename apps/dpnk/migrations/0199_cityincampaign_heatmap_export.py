@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dpnk", "0198_trip_simplified_track"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="cityincampaign",
+            name="heatmap_export",
+            field=models.FileField(
+                blank=True,
+                help_text="ZIP s PNG dlaždicemi heatmapy anonymizovaných jízd",
+                max_length=255,
+                upload_to="city_heatmap_exports",
+                verbose_name="Heatmapa jízd",
+            ),
+        ),
+    ]
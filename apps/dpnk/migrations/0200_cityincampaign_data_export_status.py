@@ -0,0 +1,37 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dpnk", "0199_cityincampaign_heatmap_export"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="cityincampaign",
+            name="data_export_status",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("queued", "Čeká na zpracování"),
+                    ("running", "Probíhá"),
+                    ("done", "Dokončen"),
+                    ("failed", "Selhal"),
+                ],
+                default="",
+                max_length=16,
+                verbose_name="Stav exportu GIS dat",
+            ),
+        ),
+        migrations.AddField(
+            model_name="cityincampaign",
+            name="data_export_progress",
+            field=models.PositiveSmallIntegerField(
+                default=0,
+                verbose_name="Průběh exportu GIS dat (%)",
+            ),
+        ),
+    ]
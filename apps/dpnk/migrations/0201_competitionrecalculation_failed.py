@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dpnk", "0200_cityincampaign_data_export_status"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="competitionrecalculation",
+            name="failed",
+            field=models.DateTimeField(
+                blank=True,
+                default=None,
+                null=True,
+                verbose_name="Datum selhání",
+            ),
+        ),
+        migrations.AddField(
+            model_name="competitionrecalculation",
+            name="error",
+            field=models.TextField(
+                blank=True,
+                default="",
+                verbose_name="Chyba",
+            ),
+        ),
+    ]
@@ -38,6 +38,10 @@ from .commute_mode import CommuteMode
 from .company import Company, CompanyType
 from .company_admin import CompanyAdmin
 from .competition import Competition, CompetitionForm
+from .competition_recalculation import (
+    CompetitionRecalculation,
+    CompetitionRecalculationChunk,
+)
 from .competition_result import CompetitionResult
 from .diploma import Diploma, DiplomaField
 from .gpxfile import GpxFile, normalize_gpx_filename
@@ -46,6 +50,7 @@ from .landingpageicon import LandingPageIcon
 from .notification_template import DpnkNotificationTemplate
 from .occupation import Occupation
 from .phase import PHASE_TYPE_DICT, Phase
+from .public_holiday import PublicHoliday
 from .questionnaire import (
     Answer,
     Choice,
@@ -90,6 +95,8 @@ __all__ = (
     CompanyAdmin,
     Competition,
     CompetitionForm,
+    CompetitionRecalculation,
+    CompetitionRecalculationChunk,
     CompetitionResult,
     Diploma,
     DiplomaField,
@@ -99,6 +106,7 @@ __all__ = (
     Occupation,
     Phase,
     PHASE_TYPE_DICT,
+    PublicHoliday,
     PayUOrderedProduct,
     ChoiceType,
     QuestionForm,
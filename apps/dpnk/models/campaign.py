@@ -29,6 +29,8 @@ from django.conf import settings
 from django.contrib.gis.db import models
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db.models import Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils.html import escape
 from django.utils.translation import get_language, gettext_lazy as _
 
@@ -350,19 +352,12 @@ class Campaign(Pricable, models.Model):
 
     def possible_vacation_days(self):
         """Return days, that can be added as vacation"""
-
-        @util.memoize_with_expiry(expiry_time=60)
-        def get_days(pk):
-            competition_phase = self.competition_phase()
-            return [
-                d
-                for d in util.daterange(
-                    competition_phase.date_from, competition_phase.date_to
-                )
-                if self.vacation_day_active(d)
-            ]
-
-        return get_days(self.pk)
+        competition_phase = self.competition_phase()
+        return get_possible_vacation_days(
+            competition_phase.date_from,
+            competition_phase.date_to,
+            util.today(),
+        )
 
     def user_attendances_for_delivery(self):
         from t_shirt_delivery.models import PackageTransaction
@@ -389,14 +384,7 @@ class Campaign(Pricable, models.Model):
         )
 
     def get_complementary_school_campaign(self):
-        @util.memoize_with_expiry(expiry_time=60)
-        def get_campaign(pk):
-            try:
-                return Campaign.objects.get(year=self.year, campaign_type__slug="skoly")
-            except Campaign.DoesNotExist:
-                return None
-
-        return get_campaign(self.pk)
+        return get_school_campaign(self.year)
 
     def get_complementary_main_campaign(self):
         try:
@@ -427,16 +415,9 @@ class Campaign(Pricable, models.Model):
         Return phase of given type from this campaign.
         @phase_type Type of phase.
         """
-
-        @util.memoize_with_expiry(expiry_time=60)
-        def get_phase(pk, phase_type):
-            try:
-                return self.phase_set.get(phase_type=phase_type)
-            except Phase.DoesNotExist:
-                return False
-
         result = get_phase(self.pk, phase_type)
-        if not result:
+        if result is None:
+            # Missing phases are not memoized
             get_phase.invalidate(self.pk, phase_type)
             raise Phase.DoesNotExist
         return result
@@ -540,3 +521,39 @@ class Campaign(Pricable, models.Model):
             registration_phase_start_date,
         )
         return value
+
+
+@util.memoize_with_expiry(expiry_time=60, maxsize=1024)
+def get_phase(campaign_pk, phase_type):
+    try:
+        return Phase.objects.get(campaign_id=campaign_pk, phase_type=phase_type)
+    except Phase.DoesNotExist:
+        return None
+
+
+@util.memoize_with_expiry(expiry_time=60, maxsize=128)
+def get_possible_vacation_days(date_from, date_to, day_today):
+    return [d for d in util.daterange(date_from, date_to) if d > day_today]
+
+
+@util.memoize_with_expiry(expiry_time=60, maxsize=128)
+def get_school_campaign(year):
+    try:
+        return Campaign.objects.get(year=year, campaign_type__slug="skoly")
+    except Campaign.DoesNotExist:
+        return None
+
+
+@receiver([post_save, post_delete], sender=Phase)
+def invalidate_phase(sender, instance, **kwargs):
+    get_phase.invalidate_where(
+        lambda campaign_pk, phase_type: campaign_pk == instance.campaign_id,
+    )
+
+
+@receiver([post_save, post_delete], sender=Campaign)
+def invalidate_campaign(sender, instance, **kwargs):
+    get_phase.invalidate_where(
+        lambda campaign_pk, phase_type: campaign_pk == instance.pk,
+    )
+    get_school_campaign.clear()
@@ -19,7 +19,10 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+from django.conf import settings
 from django.contrib.gis.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
 from django.utils import translation
 
@@ -84,40 +87,49 @@ class CityInCampaign(models.Model):
         max_length=255,
         blank=True,
     )
+    DATA_EXPORT_STATUSES = [
+        ("queued", _("Čeká na zpracování")),
+        ("running", _("Probíhá")),
+        ("done", _("Dokončen")),
+        ("failed", _("Selhal")),
+    ]
+    data_export_status = models.CharField(
+        verbose_name=_("Stav exportu GIS dat"),
+        choices=DATA_EXPORT_STATUSES,
+        max_length=16,
+        default="",
+        blank=True,
+    )
+    data_export_progress = models.PositiveSmallIntegerField(
+        verbose_name=_("Průběh exportu GIS dat (%)"),
+        default=0,
+    )
+    heatmap_export = models.FileField(
+        verbose_name=_("Heatmapa jízd"),
+        help_text=_("ZIP s PNG dlaždicemi heatmapy anonymizovaných jízd"),
+        upload_to="city_heatmap_exports",
+        max_length=255,
+        blank=True,
+    )
 
     @property
     def name(self):
         return self.city.name
 
     def competitors(self):
-        @memoize_with_expiry(expiry_time=60)
-        def actually_get_competitors(pk):
-            return UserAttendance.objects.filter(
-                campaign=self.campaign,
-                team__subsidiary__city=self.city,
-                payment_status__in=("done", "no_admission"),
-            )
-
-        return actually_get_competitors(self.pk)
+        return get_competitors(self.campaign_id, self.city_id)
 
     def competitor_count(self):
-        return len(self.competitors())
+        return get_competitor_count(self.campaign_id, self.city_id)
 
     def distances(self):
-        @memoize_with_expiry(expiry_time=60)
-        def actually_get_distances(pk):
-            competition_phase = self.campaign.competition_phase()
-            return distance_all_modes(
-                Trip.objects.filter(
-                    user_attendance__in=self.competitors(),
-                    date__range=[
-                        competition_phase.date_from,
-                        competition_phase.date_to,
-                    ],
-                ),
-            )
-
-        return actually_get_distances(self.pk)
+        competition_phase = self.campaign.competition_phase()
+        return get_distances(
+            self.campaign_id,
+            self.city_id,
+            competition_phase.date_from,
+            competition_phase.date_to,
+        )
 
     def eco_trip_count(self):
         return self.distances()["count__sum"]
@@ -142,3 +154,53 @@ class CityInCampaign(models.Model):
 
     def get_sandwich_type(self):
         return self.campaign.city_in_campaign_diploma_sandwich_type
+
+
+def get_competitors(campaign_pk, city_pk):
+    return UserAttendance.objects.filter(
+        campaign_id=campaign_pk,
+        team__subsidiary__city_id=city_pk,
+        payment_status__in=("done", "no_admission"),
+    )
+
+
+@memoize_with_expiry(expiry_time=60, maxsize=512)
+def get_competitor_count(campaign_pk, city_pk):
+    return get_competitors(campaign_pk, city_pk).count()
+
+
+@memoize_with_expiry(expiry_time=60, maxsize=512)
+def get_distances(campaign_pk, city_pk, date_from, date_to):
+    return distance_all_modes(
+        Trip.objects.filter(
+            user_attendance__in=get_competitors(campaign_pk, city_pk),
+            date__range=[date_from, date_to],
+        ),
+    )
+
+
+def invalidate_campaign_statistics(campaign_pk):
+    get_competitor_count.invalidate_where(lambda pk, city_pk: pk == campaign_pk)
+    get_distances.invalidate_where(lambda pk, *args: pk == campaign_pk)
+
+
+@receiver([post_save, post_delete], sender=UserAttendance)
+def invalidate_user_attendance(sender, instance, **kwargs):
+    if settings.MEMOIZE_WITH_EXPIRY:
+        invalidate_campaign_statistics(instance.campaign_id)
+
+
+@receiver([post_save, post_delete], sender=Trip)
+def invalidate_trip(sender, instance, **kwargs):
+    if not settings.MEMOIZE_WITH_EXPIRY or instance.user_attendance_id is None:
+        return
+    campaign_pk = (
+        UserAttendance.objects.filter(pk=instance.user_attendance_id)
+        .values_list("campaign_id", flat=True)
+        .first()
+    )
+    if campaign_pk is None:
+        # Trip deleted together with its user attendance
+        get_distances.clear()
+    else:
+        invalidate_campaign_statistics(campaign_pk)
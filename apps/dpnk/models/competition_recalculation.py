@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2026 o.s. Auto*Mat
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from django.contrib.gis.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+
+class CompetitionRecalculation(models.Model):
+    """Přepočet výsledků soutěže rozdělený na části"""
+
+    competition = models.ForeignKey(
+        "Competition",
+        related_name="recalculations",
+        null=False,
+        blank=False,
+        on_delete=models.CASCADE,
+    )
+    chunks_total = models.PositiveIntegerField(
+        verbose_name=_("Počet částí"),
+        default=0,
+    )
+    chunks_done = models.PositiveIntegerField(
+        verbose_name=_("Hotových částí"),
+        default=0,
+    )
+    created = models.DateTimeField(
+        verbose_name=_("Datum vytvoření"),
+        auto_now_add=True,
+    )
+    finished = models.DateTimeField(
+        verbose_name=_("Datum dokončení"),
+        null=True,
+        blank=True,
+        default=None,
+    )
+    failed = models.DateTimeField(
+        verbose_name=_("Datum selhání"),
+        null=True,
+        blank=True,
+        default=None,
+    )
+    error = models.TextField(
+        verbose_name=_("Chyba"),
+        blank=True,
+        default="",
+    )
+
+    class Meta:
+        verbose_name = _("Přepočet výsledků soutěže")
+        verbose_name_plural = _("Přepočty výsledků soutěží")
+        ordering = ["-created"]
+
+    def __str__(self):
+        return "%s %s" % (self.competition, self.get_progress())
+
+    def get_progress(self):
+        return "%s/%s" % (self.chunks_done, self.chunks_total)
+
+    get_progress.short_description = _("Průběh")
+
+    def get_eta(self):
+        """Estimated time of finish extrapolated from the finished chunks"""
+        if self.finished or self.failed or not self.chunks_done:
+            return None
+        elapsed = timezone.now() - self.created
+        return self.created + elapsed * self.chunks_total / self.chunks_done
+
+    get_eta.short_description = _("Odhad dokončení")
+
+
+class CompetitionRecalculationChunk(models.Model):
+    """Část přepočtu výsledků soutěže pro několik soutěžících"""
+
+    recalculation = models.ForeignKey(
+        CompetitionRecalculation,
+        related_name="chunks",
+        null=False,
+        blank=False,
+        on_delete=models.CASCADE,
+    )
+    index = models.PositiveIntegerField(
+        verbose_name=_("Pořadí části"),
+    )
+    competitor_ids = models.JSONField(
+        verbose_name=_("ID soutěžících"),
+    )
+    results = models.JSONField(
+        verbose_name=_("Výsledky"),
+        encoder=DjangoJSONEncoder,
+        null=True,
+        blank=True,
+        default=None,
+    )
+    finished = models.DateTimeField(
+        verbose_name=_("Datum dokončení"),
+        null=True,
+        blank=True,
+        default=None,
+    )
+
+    class Meta:
+        verbose_name = _("Část přepočtu výsledků soutěže")
+        verbose_name_plural = _("Části přepočtů výsledků soutěží")
+        unique_together = (("recalculation", "index"),)
@@ -39,6 +39,9 @@ class CompetitionResult(models.Model):
         verbose_name = _("Výsledek soutěže")
         verbose_name_plural = _("Výsledky soutěží")
         unique_together = (("user_attendance", "competition"), ("team", "competition"))
+        indexes = [
+            models.Index(fields=["competition", "rank_from"]),
+        ]
 
     user_attendance = models.ForeignKey(
         UserAttendance,
@@ -122,12 +125,29 @@ class CompetitionResult(models.Model):
         blank=True,
         default=0,
     )
+    rank_from = models.PositiveIntegerField(
+        verbose_name=_("Pořadí od"),
+        null=True,
+        blank=True,
+        default=None,
+    )
+    rank_to = models.PositiveIntegerField(
+        verbose_name=_("Pořadí do"),
+        null=True,
+        blank=True,
+        default=None,
+    )
 
     def get_sequence_range(self):
         """
         Return range of places of this result.
         Means, that the competitor is placed on one or more places.
+
+        Uses ranks stored by results.update_results_rank,
+        counts them if they were not stored yet.
         """
+        if self.rank_from is not None and self.rank_to is not None:
+            return self.rank_from, self.rank_to
         lower_range = (
             CompetitionResult.objects.filter(
                 competition=self.competition,
@@ -253,7 +273,7 @@ class CompetitionResult(models.Model):
         competition = self.competition
         if (
             competition.competitor_type == "single_user"
-            or competition.competitor_type == "libero"
+            or competition.competitor_type == "liberos"
         ):
             return [self.user_attendance]
         elif competition.competitor_type == "team":
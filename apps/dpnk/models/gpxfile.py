@@ -26,25 +26,22 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 import datetime
-import gzip
 
 from author.decorators import with_author
 
 from django.contrib.gis.db import models
 from django.contrib.gis.db.models.functions import Length
-from django.core.exceptions import ValidationError
 from django.db.models.signals import post_save, pre_save
 from django.dispatch import receiver
 from django.utils.safestring import mark_safe
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 
-from django_gpxpy import gpx_parse
-
 from .commute_mode import CommuteMode
 from .trip import Trip
 from .user_attendance import UserAttendance
 from .util import MAP_DESCRIPTION
+from .. import track_parser
 
 
 def normalize_gpx_filename(instance, filename):
@@ -171,21 +168,7 @@ class GpxFile(models.Model):
 
     def clean(self):
         if self.file:
-            if self.file.name.endswith(".gz"):
-                track_file = gzip.open(self.file)
-            else:
-                track_file = self.file
-            try:
-                track_file = track_file.read().decode("utf-8")
-            except UnicodeDecodeError:
-                raise ValidationError(
-                    {
-                        "file": _(
-                            "Chyba při načítání GPX souboru. Jste si jistí, že jde o GPX soubor?"
-                        )
-                    }
-                )
-            self.track_clean = gpx_parse.parse_gpx(track_file)
+            self.track_clean = track_parser.parse_track_file(self.file, field="file")
 
 
 @receiver(pre_save, sender=GpxFile)
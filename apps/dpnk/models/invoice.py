@@ -23,8 +23,6 @@ import uuid
 
 from author.decorators import with_author
 
-import denorm
-
 from dj_fiobank_payments.models import AbstractOrder
 
 from django.contrib.gis.db import models
@@ -43,7 +41,7 @@ from stale_notifications.model_mixins import StaleSyncMixin
 from .address import InvoiceAddress
 from .company import Company
 from .transactions import Payment, Status
-from .. import util
+from .. import denorm_flush, util
 
 
 def get_invoice_dir(instance, filename):
@@ -313,7 +311,7 @@ class Invoice(StaleSyncMixin, AbstractOrder):
         for payment in payments:
             payment.status = Status.INVOICE_MADE
             payment.save()
-            denorm.flush()
+        denorm_flush.flush()
         return payments
 
     def fill_company_details(self):
@@ -345,7 +343,7 @@ def change_invoice_payments_status(sender, instance, changed_fields=None, **kwar
         for payment in instance.payment_set.all():
             payment.status = Status.INVOICE_PAID
             payment.save()
-            denorm.flush()
+        denorm_flush.flush()
 
 
 def payments_to_invoice(company, campaign, payment_ids=None):
@@ -449,4 +447,4 @@ def user_attendance_pre_delete(sender, instance, *args, **kwargs):
     for payment in instance.payment_set.all():
         payment.status = Status.COMPANY_ACCEPTS
         payment.save()
-        denorm.flush()
+    denorm_flush.flush()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2026 o.s. Auto*Mat
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from django.contrib.gis.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+
+from .. import util
+
+
+class PublicHoliday(models.Model):
+    """Státní svátek (nepracovní den)"""
+
+    date = models.DateField(
+        verbose_name=_("Datum"),
+        null=False,
+        blank=False,
+    )
+    name = models.CharField(
+        verbose_name=_("Název"),
+        max_length=100,
+        blank=True,
+    )
+    every_year = models.BooleanField(
+        verbose_name=_("Každý rok"),
+        help_text=_("Svátek se opakuje každý rok ve stejný den a měsíc"),
+        default=False,
+    )
+
+    class Meta:
+        verbose_name = _("Státní svátek")
+        verbose_name_plural = _("Státní svátky")
+        ordering = ["date"]
+        unique_together = (("date", "every_year"),)
+
+    def __str__(self):
+        return "%s %s" % (self.date, self.name)
+
+
+@receiver(post_save, sender=PublicHoliday)
+@receiver(post_delete, sender=PublicHoliday)
+def public_holiday_changed(sender, instance, **kwargs):
+    util.clear_calendar_cache()
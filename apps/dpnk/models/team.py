@@ -32,6 +32,8 @@ from django import forms
 from django.conf import settings
 from django.contrib.gis.db import models
 from django.core.validators import MinLengthValidator
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
 
 from memoize import mproperty
@@ -115,6 +117,20 @@ class Team(WithGalleryMixin, models.Model):
     def subsidiary_in_campaign(self):
         return SubsidiaryInCampaign(self.subsidiary, self.campaign)
 
+    def get_member_stats(self):
+        """
+        Team statistics computed from the members' denormalized fields
+        by one grouped query, cached until the team is saved
+        (the denormalized fields are computed from fresh statistics).
+        """
+        from .. import results
+
+        if not hasattr(self, "_member_stats"):
+            self._member_stats = results.get_team_stats(
+                Team.objects.filter(pk=self.pk),
+            )[self.pk]
+        return self._member_stats
+
     @denormalized(
         models.IntegerField,
         verbose_name=_("Počet přihlášených členů týmu"),
@@ -128,7 +144,7 @@ class Team(WithGalleryMixin, models.Model):
     def member_count(self):
         if not self.pk:
             return 0
-        member_count = self.members.count()
+        member_count = self.get_member_stats().member_count
         if self.campaign.too_much_members(member_count):
             logger.error("Too many members in team", extra={"team": self})
         return member_count
@@ -146,8 +162,7 @@ class Team(WithGalleryMixin, models.Model):
     def paid_member_count(self):
         if not self.pk:
             return None
-        member_count = self.paid_members().count()
-        return member_count
+        return self.get_member_stats().paid_member_count
 
     def is_full(self):
         if self.member_count is not None:
@@ -166,8 +181,7 @@ class Team(WithGalleryMixin, models.Model):
     def unapproved_member_count(self):
         if not self.pk:
             return None
-        member_count = self.unapproved_members().count()
-        return member_count
+        return self.get_member_stats().unapproved_member_count
 
     def unapproved_members(self):
         return self.users.filter(
@@ -205,15 +219,10 @@ class Team(WithGalleryMixin, models.Model):
     def get_rides_count_denorm(self):
         if not self.pk:
             return None
-        rides_count = 0
-        for member in self.members:
-            rides_count += member.get_rides_count()
-        return rides_count
+        return self.get_member_stats().get_rides_count_denorm
 
     def get_working_trips_count(self):
-        return sum(
-            [member.get_working_rides_base_count() for member in self.paid_members()]
-        )
+        return self.get_member_stats().working_trips_count
 
     def get_remaining_rides_count(self):
         """Return number of rides, that are remaining to the end of competition"""
@@ -252,20 +261,14 @@ class Team(WithGalleryMixin, models.Model):
         )
 
     def get_frequency_(self):
-        members = self.paid_members()
-        count = len(members)
-        if count == 0:
-            return 0, 0
-        mem_freq = [mem.frequency for mem in members]
-        if mem_freq.count(None) == len(mem_freq):
-            return None, count
-        return sum(mem_freq) / count, count
+        stats = self.get_member_stats()
+        return stats.frequency, stats.paid_member_count
 
     def get_frequency(self):
         return self.get_frequency_()[0]
 
     def get_eco_trip_count(self):
-        return sum([member.eco_trip_count() for member in self.paid_members()])
+        return self.get_member_stats().eco_trip_count
 
     def get_emissions(self, distance=None):
         return util.get_emissions(self.get_length())
@@ -281,17 +284,16 @@ class Team(WithGalleryMixin, models.Model):
         return (self.frequency or 0) * 100
 
     def get_length(self):
-        return sum([member.trip_length_total for member in self.paid_members()])
+        return self.get_member_stats().length
 
     @denormalized(models.TextField, null=True, skip={"invitation_token"})
     @depend_on_related("UserAttendance", skip={"created", "updated"})
     def name_with_members(self):
         if not self.pk:
             return None
-        members = self.members
-        if members:
-            names = [u.userprofile.name() for u in members]
-            names.sort()
+        # Use the current name, it could have been changed before this save
+        names = self.get_member_stats().member_names
+        if names:
             return "%s (%s)" % (self.name, ", ".join(names))
         else:
             return self.name
@@ -333,6 +335,11 @@ class Team(WithGalleryMixin, models.Model):
         super().save(force_insert, force_update, *args, **kwargs)
 
 
+@receiver([pre_save, post_save], sender=Team)
+def clear_member_stats(sender, instance, **kwargs):
+    instance.__dict__.pop("_member_stats", None)
+
+
 class TeamName(Team):
     class Meta:
         proxy = True
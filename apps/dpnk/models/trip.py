@@ -19,27 +19,36 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 import datetime
-import gzip
 
 from author.decorators import with_author
 
 from bulk_update.manager import BulkUpdateManager
 
+from django.conf import settings
 from django.contrib.gis.db import models
-from django.core.exceptions import ValidationError
+from django.contrib.gis.geos import MultiLineString
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db.models import Case, Count, F, FloatField, IntegerField, Sum, When
-from django.db.models.functions import Coalesce
-from django.db.models.signals import post_save, pre_save
+from django.db.models import (
+    Case,
+    Count,
+    F,
+    FloatField,
+    Func,
+    IntegerField,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Cast, Coalesce
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.utils.safestring import mark_safe
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 
-from django_gpxpy import gpx_parse
-
 from .util import MAP_DESCRIPTION, disable_for_loaddata
-from .. import util
+from .. import track_parser, util
 from ..model_mixins import WithGalleryMixin
 
 
@@ -53,17 +62,8 @@ def normalize_gpx_filename(instance, filename):
     )
 
 
-def distance_all_modes(trips, campaign=None):
-    if campaign:
-        trips.filter(
-            user_attendance__payment_status__in=("done", "no_admission"),
-            user_attendance__campaign__slug=campaign.slug,
-            date__gte=campaign.competition_phase().date_from,
-            date__lte=campaign.competition_phase().date_to,
-        )
-    return trips.filter(
-        commute_mode__eco=True, commute_mode__does_count=True
-    ).aggregate(
+def distance_all_modes_aggregates():
+    return dict(
         distance__sum=Coalesce(Sum("distance"), 0.0),
         user_count=Coalesce(Count("user_attendance__id", distinct=True), 0),
         count__sum=Coalesce(Count("id"), 0),
@@ -98,6 +98,35 @@ def distance_all_modes(trips, campaign=None):
     )
 
 
+def distance_all_modes(trips, campaign=None):
+    if campaign:
+        trips.filter(
+            user_attendance__payment_status__in=("done", "no_admission"),
+            user_attendance__campaign__slug=campaign.slug,
+            date__gte=campaign.competition_phase().date_from,
+            date__lte=campaign.competition_phase().date_to,
+        )
+    return trips.filter(
+        commute_mode__eco=True, commute_mode__does_count=True
+    ).aggregate(**distance_all_modes_aggregates())
+
+
+def distance_all_modes_grouped(trips, group_by):
+    """
+    Return distance_all_modes of the trips grouped by the group_by lookup
+    by one query as dict {group_by value: distances}
+    """
+    return {
+        distances.pop("group"): distances
+        for distances in trips.filter(
+            commute_mode__eco=True, commute_mode__does_count=True
+        )
+        .values(group=F(group_by))
+        .annotate(**distance_all_modes_aggregates())
+        .order_by()
+    }
+
+
 @with_author
 class Trip(WithGalleryMixin, models.Model):
     """Jízdy"""
@@ -226,6 +255,72 @@ class Trip(WithGalleryMixin, models.Model):
         null=False,
         blank=True,
     )
+    track_medium = models.MultiLineStringField(
+        verbose_name=_("trasa ve střední kvalitě"),
+        help_text=_("Zjednodušená trasa pro zobrazení"),
+        srid=4326,
+        null=True,
+        blank=True,
+        geography=True,
+        editable=False,
+    )
+    track_low = models.MultiLineStringField(
+        verbose_name=_("trasa v nízké kvalitě"),
+        help_text=_("Zjednodušená trasa pro zobrazení"),
+        srid=4326,
+        null=True,
+        blank=True,
+        geography=True,
+        editable=False,
+    )
+    track_processing = models.BooleanField(
+        verbose_name=_("Trasa se zpracovává"),
+        help_text=_("Trasa z GPX souboru ještě nebyla načtena"),
+        default=False,
+        null=False,
+    )
+
+    # Simplified track fields by resolution, their tolerances (in degrees)
+    # are set by TRACK_SIMPLIFY_TOLERANCES setting
+    SIMPLIFIED_TRACK_FIELDS = {
+        "medium": "track_medium",
+        "low": "track_low",
+    }
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_track()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using, fields, **kwargs)
+        if fields is None or "track" in fields:
+            self.remember_track()
+
+    def remember_track(self):
+        """Remember the track as stored in the database (if it is loaded)"""
+        if "track" in self.get_deferred_fields():
+            self.__dict__.pop("_stored_track", None)
+        else:
+            self._stored_track = self.track.clone() if self.track else None
+
+    def track_changed(self):
+        """Whether the track differs from the track stored in the database"""
+        if not hasattr(self, "_stored_track"):
+            return True
+        return self.track != self._stored_track
+
+    def simplify_track(self):
+        """Set simplified tracks (topology preserving) from the track"""
+        for resolution, field in self.SIMPLIFIED_TRACK_FIELDS.items():
+            setattr(
+                self,
+                field,
+                simplify_track(
+                    self.track, settings.TRACK_SIMPLIFY_TOLERANCES[resolution]
+                ),
+            )
 
     def active(self):
         return self.user_attendance.campaign.day_active(self.date)
@@ -261,35 +356,139 @@ class Trip(WithGalleryMixin, models.Model):
         return ""
 
 
+def parse_gpx_file(gpx_file):
+    """Return track parsed from the GPX or TCX file (can be gzipped or zipped)"""
+    return track_parser.parse_track_file(gpx_file)
+
+
+def simplify_track(track, tolerance):
+    """Return topology preserving simplification of the track"""
+    if not track:
+        return None
+    simplified = track.simplify(tolerance, preserve_topology=True)
+    if simplified.geom_type == "LineString":
+        simplified = MultiLineString(simplified, srid=track.srid)
+    return simplified
+
+
+def simplified_track_expression(tolerance):
+    """
+    Database expression of topology preserving simplification of the track
+    (the same as simplify_track)
+    """
+    return Cast(
+        Func(
+            Func(
+                Cast("track", models.GeometryField(srid=4326)),
+                Value(tolerance),
+                function="ST_SimplifyPreserveTopology",
+                output_field=models.GeometryField(srid=4326),
+            ),
+            function="ST_Multi",
+            output_field=models.GeometryField(srid=4326),
+        ),
+        models.MultiLineStringField(srid=4326, geography=True),
+    )
+
+
+def backfill_simplified_tracks(chunk_size=1000, progress_callback=None):
+    """
+    Compute simplified tracks of all trips, that don't have them yet,
+    in the database by chunks of chunk_size trips.
+
+    Return number of updated trips.
+    """
+    trips = Trip.objects.filter(track__isnull=False, track_low__isnull=True)
+    total = trips.count()
+    done = 0
+    last_pk = 0
+    while True:
+        pks = list(
+            trips.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:chunk_size]
+        )
+        if not pks:
+            break
+        Trip.objects.filter(pk__in=pks).update(
+            **{
+                field: simplified_track_expression(
+                    settings.TRACK_SIMPLIFY_TOLERANCES[resolution]
+                )
+                for resolution, field in Trip.SIMPLIFIED_TRACK_FIELDS.items()
+            },
+        )
+        last_pk = pks[-1]
+        done += len(pks)
+        if progress_callback:
+            progress_callback(done, total)
+    return done
+
+
 @receiver(pre_save, sender=Trip)
 def trip_pre_save(sender, instance, **kwargs):
-    if instance.gpx_file and not instance.track:
-        if instance.gpx_file.name.endswith(".gz") or instance.gpx_file.name.endswith(
-            ".gzip"
-        ):
-            track_file = gzip.open(instance.gpx_file)
-        else:
-            track_file = instance.gpx_file
+    if settings.RESULTS_INCREMENTAL_UPDATES and instance.pk:
+        from .. import results
+
         try:
-            track_file = track_file.read().decode("utf-8")
-        except UnicodeDecodeError:
-            raise ValidationError(
-                {
-                    "gpx_file": _(
-                        "Chyba při načítání GPX souboru. Jste si jistí, že jde o GPX soubor?"
-                    )
-                }
+            instance._previous_trip_state = results.get_trip_state(
+                Trip.objects.get(pk=instance.pk),
             )
-        instance.track = gpx_parse.parse_gpx(track_file)
+        except Trip.DoesNotExist:
+            pass
+    if (
+        instance.gpx_file
+        and not instance.track
+        and not getattr(instance, "_track_processed", False)
+    ):
+        if settings.TRIP_TRACK_ASYNC_PROCESSING and not instance.track_processing:
+            # The track is parsed by process_trip_track task after save
+            instance.track_processing = True
+            instance._process_track = True
+        elif not instance.track_processing:
+            instance.track = parse_gpx_file(instance.gpx_file)
     track = instance.track
     if not instance.distance and track:
         instance.distance = round(util.get_multilinestring_length(track), 2)
+    if instance.track_changed() or any(
+        getattr(instance, field) is None
+        for field in Trip.SIMPLIFIED_TRACK_FIELDS.values()
+    ):
+        instance.simplify_track()
 
 
 @receiver(post_save, sender=Trip)
 @disable_for_loaddata
 def trip_post_save(sender, instance, **kwargs):
+    instance.remember_track()
+    if getattr(instance, "_process_track", False):
+        from .. import tasks
+
+        del instance._process_track
+        transaction.on_commit(
+            lambda: tasks.process_trip_track.apply_async([instance.pk]),
+        )
     if instance.user_attendance and not hasattr(instance, "dont_recalculate"):
+        from .. import denorm_flush, results
+
+        if settings.RESULTS_INCREMENTAL_UPDATES:
+            results.update_results_trip_changed(
+                getattr(instance, "_previous_trip_state", None),
+                results.get_trip_state(instance),
+            )
+            denorm_flush.request_flush()
+        else:
+            results.recalculate_result_competitor(instance.user_attendance)
+
+
+@receiver(post_delete, sender=Trip)
+@disable_for_loaddata
+def trip_post_delete(sender, instance, **kwargs):
+    if (
+        settings.RESULTS_INCREMENTAL_UPDATES
+        and instance.user_attendance_id
+        and not hasattr(instance, "dont_recalculate")
+    ):
         from .. import results
 
-        results.recalculate_result_competitor(instance.user_attendance)
+        results.update_results_trip_changed(results.get_trip_state(instance), None)
@@ -31,7 +31,7 @@ from django.contrib.gis.db import models
 from django.contrib.humanize.templatetags.humanize import intcomma
 from django.contrib.sites.models import Site
 from django.core.exceptions import ImproperlyConfigured, ValidationError
-from django.db.models import Q, F, Sum
+from django.db.models import Q, F
 from django.db.models.signals import pre_save, post_save
 from django.dispatch import receiver
 from django.urls import reverse
@@ -471,14 +471,29 @@ class UserAttendance(StaleSyncMixin, models.Model):
         except Phase.DoesNotExist:
             return 0
 
+    def get_denorm_trip_stats(self):
+        """
+        Values of all trip dependent denormalized fields computed by one query,
+        cached until the user attendance is saved.
+        """
+        from .. import results
+
+        if not hasattr(self, "_denorm_trip_stats"):
+            self._denorm_trip_stats = results.get_user_attendance_trip_stats(
+                UserAttendance.objects.filter(pk=self.pk),
+            )[self.pk]
+        return self._denorm_trip_stats
+
     @denormalized(
         models.IntegerField, null=True, skip={"updated", "created", "last_sync_time"}
     )
-    @depend_on_related("Trip", foreign_key="user_attendance")
+    @depend_on_related(
+        "Trip", foreign_key="user_attendance", skip={"track_medium", "track_low"}
+    )
     def get_rides_count_denorm(self):
         if not self.pk:
             return None
-        return self.get_rides_count()
+        return self.get_denorm_trip_stats().get_rides_count_denorm
 
     def get_frequency(self, day=None):
         from .. import results
@@ -493,11 +508,13 @@ class UserAttendance(StaleSyncMixin, models.Model):
     @denormalized(
         models.FloatField, null=True, skip={"updated", "created", "last_sync_time"}
     )
-    @depend_on_related("Trip", foreign_key="user_attendance")
+    @depend_on_related(
+        "Trip", foreign_key="user_attendance", skip={"track_medium", "track_low"}
+    )
     def frequency(self):
         if not self.pk:
             return None
-        return self.get_frequency()
+        return self.get_denorm_trip_stats().frequency
 
     def get_frequency_percentage(self, day=None):
         if day:
@@ -526,21 +543,16 @@ class UserAttendance(StaleSyncMixin, models.Model):
     @denormalized(
         models.FloatField, null=True, skip={"updated", "created", "last_sync_time"}
     )
-    @depend_on_related("Trip", foreign_key="user_attendance")
+    @depend_on_related(
+        "Trip", foreign_key="user_attendance", skip={"track_medium", "track_low"}
+    )
     def trip_length_total(self):
         """
         Total trip length NOT including recreational trips.
         """
-        from .. import results
-
         if not self.pk:
             return None
-        try:
-            return results.get_userprofile_length(
-                [self], self.campaign.phase("competition")
-            )
-        except Phase.DoesNotExist:
-            return 0
+        return self.get_denorm_trip_stats().trip_length_total
 
     def trip_length_total_rounded(self):
         return round(self.trip_length_total or 0, 2)
@@ -548,18 +560,13 @@ class UserAttendance(StaleSyncMixin, models.Model):
     @denormalized(
         models.FloatField, null=True, skip={"updated", "created", "last_sync_time"}
     )
-    @depend_on_related("Trip", foreign_key="user_attendance")
+    @depend_on_related(
+        "Trip", foreign_key="user_attendance", skip={"track_medium", "track_low"}
+    )
     def total_trip_length_including_recreational(self):
-        from .. import results
-
         if not self.pk:
             return None
-        try:
-            return results.get_userprofile_length(
-                [self], self.campaign.phase("competition"), recreational=True
-            )
-        except Phase.DoesNotExist:
-            return 0
+        return self.get_denorm_trip_stats().total_trip_length_including_recreational
 
     def trip_length_total_including_recreational_rounded(self):
         return round(self.total_trip_length_including_recreational, 2)
@@ -567,14 +574,14 @@ class UserAttendance(StaleSyncMixin, models.Model):
     @denormalized(
         models.IntegerField, null=True, skip={"updated", "created", "last_sync_time"}
     )
-    @depend_on_related("Trip", foreign_key="user_attendance")
+    @depend_on_related(
+        "Trip", foreign_key="user_attendance", skip={"track_medium", "track_low"}
+    )
     def working_rides_base_count(self):
         """Return number of rides, that should be acomplished to this date"""
-        from .. import results
-
         if not self.pk:
             return None
-        return results.get_working_trips_count(self, self.campaign.phase("competition"))
+        return self.get_denorm_trip_stats().working_rides_base_count
 
     def get_working_rides_base_count(self):
         """Return number of rides, that should be acomplished to this date"""
@@ -877,19 +884,16 @@ class UserAttendance(StaleSyncMixin, models.Model):
         default=0,
         skip={"updated", "created", "last_sync_time"},
     )
-    @depend_on_related("Trip", foreign_key="user_attendance")
+    @depend_on_related(
+        "Trip", foreign_key="user_attendance", skip={"track_medium", "track_low"}
+    )
     def trip_points_total(self):
         """
         Total trip points. Ignores recreational trips.
         """
         if not self.pk:
             return 0
-        return (
-            Trip.objects.filter(user_attendance=self).aggregate(
-                Sum("commute_mode__points")
-            )["commute_mode__points__sum"]
-            or 0
-        )
+        return self.get_denorm_trip_stats().trip_points_total
 
     @property
     def points(self):
@@ -1080,3 +1084,8 @@ def update_mailing_user_attendance(sender, instance, created, **kwargs):
 def assign_vouchers(sender, instance, created, **kwargs):
     if instance.payment_status == "done" or instance.payment_status == "no_admission":
         instance.assign_vouchers()
+
+
+@receiver(post_save, sender=UserAttendance)
+def clear_denorm_trip_stats(sender, instance, **kwargs):
+    instance.__dict__.pop("_denorm_trip_stats", None)
@@ -47,11 +47,12 @@ Trasa slouží k výpočtu vzdálenosti a pomůže nám lépe určit potřeby li
 def disable_for_loaddata(signal_handler):
     """
     Decorator that turns off signal handlers when loading fixture data.
+    Signals without raw argument (e.g. post_delete) are always handled.
     """
 
     @wraps(signal_handler)
     def wrapper(*args, **kwargs):
-        if kwargs["raw"]:
+        if kwargs.get("raw", False):
             return
         signal_handler(*args, **kwargs)
 
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2026 o.s. Auto*Mat
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Coalescing queue of user attendances waiting for results recalculation.
+
+Every user attendance is stored in the queue only once together with
+the time it was enqueued first, so any number of trip changes within one
+drain window leads to a single recalculation.
+
+Popped user attendances are kept as processing until they are
+acknowledged by ack() or returned to the queue by requeue(),
+processing user attendances of crashed drains are returned to the queue
+by requeue_stale().
+"""
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlparse
+
+import redis
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+QueueStats = namedtuple("QueueStats", ("depth", "lag"))
+
+
+class RedisRecalculationQueue:
+    """Queue stored in Redis sorted set scored by the time of first enqueue"""
+
+    key = "dpnk:recalculation-queue"
+    processing_key = "dpnk:recalculation-queue:processing"
+    scheduled_key = "dpnk:recalculation-queue:scheduled"
+
+    # Move items from the queue to processing set scored by time of pop
+    pop_script = """
+    local items = redis.call('ZPOPMIN', KEYS[1], ARGV[1])
+    local pks = {}
+    for i = 1, #items, 2 do
+        redis.call('ZADD', KEYS[2], ARGV[2], items[i])
+        table.insert(pks, items[i])
+    end
+    return pks
+    """
+
+    def __init__(self, url):
+        parsed_redis_url = urlparse(url)
+        self.redis = redis.StrictRedis(
+            host=parsed_redis_url.hostname,
+            port=parsed_redis_url.port if parsed_redis_url.port else 6379,
+            db=0,
+        )
+
+    def _zadd(self, redis_client, user_attendance_pks):
+        now = time.time()
+        redis_client.zadd(
+            self.key,
+            {str(pk): now for pk in user_attendance_pks},
+            nx=True,
+        )
+
+    def add(self, user_attendance_pks):
+        """Enqueue user attendances, keep the time of first enqueue"""
+        if user_attendance_pks:
+            self._zadd(self.redis, user_attendance_pks)
+
+    def pop(self, count):
+        """Move at most count user attendances enqueued first to processing"""
+        pks = self.redis.eval(
+            self.pop_script, 2, self.key, self.processing_key, count, time.time()
+        )
+        return [int(pk) for pk in pks]
+
+    def ack(self, user_attendance_pks):
+        """Remove processed user attendances"""
+        if user_attendance_pks:
+            self.redis.zrem(self.processing_key, *user_attendance_pks)
+
+    def requeue(self, user_attendance_pks):
+        """Return processing user attendances to the queue"""
+        if user_attendance_pks:
+            pipeline = self.redis.pipeline()
+            self._zadd(pipeline, user_attendance_pks)
+            pipeline.zrem(self.processing_key, *user_attendance_pks)
+            pipeline.execute()
+
+    def requeue_stale(self, timeout):
+        """Return user attendances processed longer than timeout seconds to the queue"""
+        pks = self.redis.zrangebyscore(
+            self.processing_key, "-inf", time.time() - timeout
+        )
+        self.requeue([int(pk) for pk in pks])
+
+    def schedule(self, timeout):
+        """
+        Return True if the drain should be scheduled,
+        False if it was already scheduled within the timeout
+        """
+        return bool(self.redis.set(self.scheduled_key, 1, nx=True, ex=timeout))
+
+    def unschedule(self):
+        self.redis.delete(self.scheduled_key)
+
+    def stats(self):
+        depth = self.redis.zcard(self.key)
+        oldest = self.redis.zrange(self.key, 0, 0, withscores=True)
+        lag = time.time() - oldest[0][1] if oldest else 0
+        return QueueStats(depth, lag)
+
+
+class LocalRecalculationQueue:
+    """In-process stand-in of the Redis queue (development and tests)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.items = {}
+        self.processing = {}
+        self.scheduled_until = 0
+
+    def add(self, user_attendance_pks):
+        now = time.time()
+        with self.lock:
+            for pk in user_attendance_pks:
+                self.items.setdefault(pk, now)
+
+    def pop(self, count):
+        now = time.time()
+        with self.lock:
+            pks = sorted(self.items, key=self.items.get)[:count]
+            for pk in pks:
+                del self.items[pk]
+                self.processing[pk] = now
+        return pks
+
+    def ack(self, user_attendance_pks):
+        with self.lock:
+            for pk in user_attendance_pks:
+                self.processing.pop(pk, None)
+
+    def requeue(self, user_attendance_pks):
+        now = time.time()
+        with self.lock:
+            for pk in user_attendance_pks:
+                self.processing.pop(pk, None)
+                self.items.setdefault(pk, now)
+
+    def requeue_stale(self, timeout):
+        deadline = time.time() - timeout
+        with self.lock:
+            pks = [pk for pk, popped in self.processing.items() if popped <= deadline]
+        self.requeue(pks)
+
+    def schedule(self, timeout):
+        now = time.time()
+        with self.lock:
+            if self.scheduled_until > now:
+                return False
+            self.scheduled_until = now + timeout
+            return True
+
+    def unschedule(self):
+        with self.lock:
+            self.scheduled_until = 0
+
+    def stats(self):
+        with self.lock:
+            oldest = min(self.items.values(), default=None)
+            depth = len(self.items)
+        return QueueStats(depth, time.time() - oldest if oldest else 0)
+
+
+_local_queue = LocalRecalculationQueue()
+
+
+def get_queue():
+    """
+    Return queue according to the RESULTS_RECALCULATION_QUEUE setting
+    or None if the results are recalculated by one task per change
+    """
+    if settings.RESULTS_RECALCULATION_QUEUE == "redis":
+        return RedisRecalculationQueue(
+            settings.RESULTS_RECALCULATION_QUEUE_REDIS_URL or settings.BROKER_URL,
+        )
+    if settings.RESULTS_RECALCULATION_QUEUE == "local":
+        # Web and worker processes would have separate queues
+        if not getattr(settings, "CELERY_TASK_ALWAYS_EAGER", False):
+            raise ImproperlyConfigured(
+                'RESULTS_RECALCULATION_QUEUE = "local" can be used only '
+                "with CELERY_TASK_ALWAYS_EAGER"
+            )
+        return _local_queue
+    return None
+
+
+def enqueue(user_attendance_pks):
+    """
+    Add the user attendances to the queue and schedule its drain
+    after RESULTS_RECALCULATION_QUEUE_DELAY seconds, if not already scheduled.
+    """
+    from . import tasks
+
+    queue = get_queue()
+    queue.add(user_attendance_pks)
+    delay = settings.RESULTS_RECALCULATION_QUEUE_DELAY
+    if queue.schedule(delay):
+        tasks.drain_recalculation_queue.apply_async(countdown=delay)
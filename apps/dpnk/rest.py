@@ -21,8 +21,10 @@ import base64
 import hashlib
 import logging
 import re
+import secrets
 import time
 
+from collections import defaultdict
 from enum import Enum
 
 import stravalib
@@ -40,8 +42,16 @@ from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from django.db.models import ExpressionWrapper, F, CharField, Value, Window
-from django.db.models.functions import Concat, DenseRank
+from django.db.models import (
+    CharField,
+    Count,
+    ExpressionWrapper,
+    F,
+    Prefetch,
+    Value,
+    Window,
+)
+from django.db.models.functions import Coalesce, Concat, DenseRank
 from django.db import IntegrityError
 from django.shortcuts import get_object_or_404
 from django.views.decorators.cache import cache_page
@@ -61,6 +71,7 @@ import photologue
 from rest_framework import (
     mixins,
     permissions,
+    renderers,
     routers,
     serializers,
     status,
@@ -74,6 +85,7 @@ from rest_framework.validators import UniqueValidator
 from rest_framework.views import APIView
 from price_level import models as price_level_models
 
+from . import results
 from .middleware import get_or_create_userattendance
 from .models import (
     Address,
@@ -102,6 +114,12 @@ from .models import (
 )
 from .models.company import CompanyInCampaign
 from .models.subsidiary import SubsidiaryInCampaign
+from .models.trip import (
+    distance_all_modes,
+    distance_all_modes_grouped,
+    parse_gpx_file,
+    simplified_track_expression,
+)
 from t_shirt_delivery.models import TShirtSize
 from coupons.models import DiscountCoupon
 
@@ -114,12 +132,15 @@ from .util import (
     Cache,
     get_all_logged_in_users,
     get_api_version_from_request,
+    get_emissions,
+    get_multilinestring_length,
     is_payment_with_reward,
     rebuild_denorm_models,
     register_challenge_serializer_base_cache_key_name,
     today,
 )
 from .tasks import (
+    process_trip_track,
     team_membership_approval_mail,
     team_membership_denial_mail,
     team_membership_invitation_mail,
@@ -136,6 +157,8 @@ from stravasync import hashtags
 
 import drf_serpy as serpy
 
+from django.contrib.gis.db.models import MultiLineStringField
+from django.contrib.gis.db.models.functions import AsGeoJSON
 from django.contrib.gis.geos import GEOSGeometry
 from django.utils.encoding import smart_str
 
@@ -200,6 +223,86 @@ class GeometryField(serpy.Field):
         return geojson
 
 
+class RawJSON:
+    """JSON fragment, that is rendered by RawJSONRenderer as it is"""
+
+    __slots__ = ("fragment",)
+
+    def __init__(self, fragment):
+        self.fragment = fragment
+
+
+class RawJSONRenderer(renderers.JSONRenderer):
+    """
+    JSON renderer, that inserts RawJSON fragments (e.g. GeoJSON
+    rendered by the database) into the output without parsing them
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        fragments = []
+        placeholder = "raw-json-%s-" % secrets.token_hex(8)
+
+        class RawJSONEncoder(type(self).encoder_class):
+            def default(self, obj):
+                if isinstance(obj, RawJSON):
+                    fragments.append(obj.fragment.encode())
+                    return "%s%s" % (placeholder, len(fragments) - 1)
+                return super().default(obj)
+
+        # Renderers are instantiated for every request
+        self.encoder_class = RawJSONEncoder
+        ret = super().render(data, accepted_media_type, renderer_context)
+        if not fragments:
+            return ret
+        return re.sub(
+            b'"%s([0-9]+)"' % placeholder.encode(),
+            lambda match: fragments[int(match.group(1))],
+            ret,
+        )
+
+
+def annotate_display_track(queryset, request):
+    """
+    Annotate trips by track_geojson rendered by the database
+    with REST_TRACK_GEOJSON_PRECISION decimal digits
+    of resolution requested by "resolution" query parameter
+    (full, medium or low) or simplified by "tolerance" (in degrees)
+    query parameter.
+    Track geometries are not loaded from the database.
+    """
+    resolution = request.query_params.get("resolution", "full")
+    tolerance = request.query_params.get("tolerance")
+    if tolerance is not None:
+        try:
+            tolerance = float(tolerance)
+        except ValueError:
+            tolerance = None
+        if tolerance is None or not 0 < tolerance <= 0.1:
+            raise serializers.ValidationError(
+                {"tolerance": "Tolerance has to be number between 0 and 0.1"}
+            )
+        track = simplified_track_expression(tolerance)
+    elif resolution == "full":
+        track = F("track")
+    elif resolution in Trip.SIMPLIFIED_TRACK_FIELDS:
+        # Simplified tracks of old trips can be not computed yet
+        track = Coalesce(
+            Trip.SIMPLIFIED_TRACK_FIELDS[resolution],
+            "track",
+            output_field=MultiLineStringField(srid=4326, geography=True),
+        )
+    else:
+        raise serializers.ValidationError(
+            {"resolution": "Resolution has to be one of full, medium, low"}
+        )
+    return queryset.defer("track", *Trip.SIMPLIFIED_TRACK_FIELDS.values()).annotate(
+        track_geojson=AsGeoJSON(
+            track,
+            precision=settings.REST_TRACK_GEOJSON_PRECISION,
+        ),
+    )
+
+
 class OptionalImageField(serpy.ImageField):
     getter_takes_serializer = True
 
@@ -551,6 +654,13 @@ class TripDeserializer(TripBaseDeserializer):
         return instance
 
 
+def decode_file_encoded_string(file_encoded_string):
+    """Return file from the base64 data URL string"""
+    format, filestr = file_encoded_string.split(";base64,")
+    ext = format.split("/")[-1]
+    return ContentFile(base64.b64decode(filestr), name=f"temp.{ext}")
+
+
 class TripsDeserializer(serializers.Serializer):
     trips = TripBaseDeserializer(many=True)
 
@@ -580,10 +690,7 @@ class TripsDeserializer(serializers.Serializer):
             for trip in validated_data["trips"]:
                 file_encoded_string = trip.pop("file_encoded_string", None)
                 if file_encoded_string:
-                    format, filestr = file_encoded_string.split(";base64,")
-                    ext = format.split("/")[-1]
-                    data = ContentFile(base64.b64decode(filestr), name=f"temp.{ext}")
-                    trip["gpx_file"] = data
+                    trip["gpx_file"] = decode_file_encoded_string(file_encoded_string)
                 trip["user_attendance"] = self.user_attendance
                 trip["from_application"] = True
                 instance, _ = Trip.objects.update_or_create(
@@ -593,10 +700,10 @@ class TripsDeserializer(serializers.Serializer):
                     defaults=trip,
                 )
                 instances["trips"].append(instance)
-                rebuild_denorm_models(
-                    [self.user_attendance],
-                    async_denorm_flush=True,
-                )
+            rebuild_denorm_models(
+                [self.user_attendance],
+                async_denorm_flush=True,
+            )
         except ValidationError:
             raise GPXParsingFail
         except IntegrityError:
@@ -605,6 +712,180 @@ class TripsDeserializer(serializers.Serializer):
         return instances
 
 
+def trips_changed(user_attendance):
+    """Schedule one denorm flush and one results recalculation for the user"""
+    rebuild_denorm_models([user_attendance], async_denorm_flush=True)
+    results.recalculate_result_competitor(user_attendance)
+
+
+class TripsBulkDeserializer(TripsDeserializer):
+    """
+    Bulk upsert of trips (REST API v3)
+
+    Every trip is validated separately. Valid trips are inserted or updated
+    (trip of the same date and direction) by one statement for every set
+    of supplied fields, fields missing in the request keep their stored values.
+    After that only one denorm flush and one recalculation of results
+    is scheduled for the user.
+    Status of every trip is returned in the order of the request.
+    """
+
+    trips = serializers.ListField(
+        child=serializers.DictField(),
+        allow_empty=False,
+        max_length=settings.REST_TRIPS_BULK_MAX_LENGTH,
+        help_text="List of trips in the same format as trip of API v1",
+    )
+
+    # Fields updated on every existing trip, other fields only if supplied
+    always_update_fields = ("from_application", "updated", "updated_by")
+
+    def _validate_trip(self, item, trip_keys):
+        deserializer = TripBaseDeserializer(data=item, context=self.context)
+        if not deserializer.is_valid():
+            return None, deserializer.errors
+        trip = deserializer.validated_data
+        required_error = serializers.Field.default_error_messages["required"]
+        errors = {
+            field: [required_error]
+            for field, source in (("trip_date", "date"), ("direction", "direction"))
+            if source not in trip
+        }
+        if errors:
+            return None, errors
+        if not self.user_attendance.campaign.day_recent(trip["date"]):
+            return None, InactiveDayGPX().detail
+        if (trip["date"], trip["direction"]) in trip_keys:
+            return None, TripAlreadyExists().detail
+        trip_keys.add((trip["date"], trip["direction"]))
+        return trip, None
+
+    def validate(self, data):
+        trip_keys = set()
+        trips = []
+        for item in data["trips"]:
+            trip, errors = self._validate_trip(item, trip_keys)
+            trips.append({"trip": trip, "errors": errors})
+        data["trips"] = trips
+        return data
+
+    def _build_trip(self, trip_data):
+        """
+        Return unsaved trip with parsed track, computed distance and simplified tracks
+        and names of the fields to update if the trip exists already.
+
+        With TRIP_TRACK_ASYNC_PROCESSING the track is not parsed, the trip
+        is marked as track_processing and its track is parsed
+        by process_trip_track task after the trips are saved.
+        """
+        file_encoded_string = trip_data.pop("file_encoded_string", None)
+        update_fields = set(trip_data) - {"date", "direction"}
+        trip = Trip(
+            user_attendance=self.user_attendance,
+            from_application=True,
+            **trip_data,
+        )
+        user = self.context["request"].user
+        trip.author = trip.updated_by = user
+        try:
+            if file_encoded_string:
+                trip.gpx_file = decode_file_encoded_string(file_encoded_string)
+                update_fields.add("gpx_file")
+            if trip.gpx_file and not trip.track:
+                if settings.TRIP_TRACK_ASYNC_PROCESSING:
+                    trip.track_processing = True
+                    trip._process_track = True
+                    update_fields.update(("track_processing", "track"))
+                    if not trip.distance:
+                        # Computed from the track by process_trip_track
+                        update_fields.add("distance")
+                else:
+                    trip.track = parse_gpx_file(trip.gpx_file)
+                    update_fields.add("track")
+        except (ValidationError, ValueError, OSError):
+            raise GPXParsingFail
+        if not trip.distance and trip.track:
+            trip.distance = round(get_multilinestring_length(trip.track), 2)
+            update_fields.add("distance")
+        if "track" in update_fields:
+            update_fields.update(("track_medium", "track_low"))
+        trip.simplify_track()
+        return trip, self.always_update_fields + tuple(sorted(update_fields))
+
+    @transaction.atomic
+    def create(self, validated_data):
+        items = validated_data["trips"]
+        trips = []
+        trips_by_update_fields = defaultdict(list)
+        for item in items:
+            if item["errors"] is None:
+                try:
+                    item["trip"], update_fields = self._build_trip(item["trip"])
+                    trips.append(item["trip"])
+                    trips_by_update_fields[update_fields].append(item["trip"])
+                except GPXParsingFail as e:
+                    item["trip"], item["errors"] = None, e.detail
+        trip_dates = {trip.date for trip in trips}
+        existing_keys = set(
+            Trip.objects.filter(
+                user_attendance=self.user_attendance,
+                date__in=trip_dates,
+            ).values_list("date", "direction")
+        )
+        for update_fields, update_trips in trips_by_update_fields.items():
+            Trip.objects.bulk_create(
+                update_trips,
+                update_conflicts=True,
+                unique_fields=("user_attendance", "date", "direction"),
+                update_fields=update_fields,
+            )
+        # Return the stored trips including the values, that were not supplied
+        stored_trips = {
+            (trip.date, trip.direction): trip
+            for trip in Trip.objects.filter(
+                user_attendance=self.user_attendance,
+                date__in=trip_dates,
+            )
+        }
+        for item in items:
+            if item["trip"] is not None:
+                trip_key = (item["trip"].date, item["trip"].direction)
+                item["status"] = "updated" if trip_key in existing_keys else "created"
+                if getattr(item["trip"], "_process_track", False):
+                    trip_pk = stored_trips[trip_key].pk
+                    transaction.on_commit(
+                        lambda trip_pk=trip_pk: process_trip_track.apply_async(
+                            [trip_pk]
+                        ),
+                    )
+                item["trip"] = stored_trips[trip_key]
+            else:
+                item["status"] = "error"
+        if trips:
+            user_attendance = self.user_attendance
+            transaction.on_commit(
+                lambda: trips_changed(user_attendance),
+            )
+        return {"trips": items}
+
+    def to_representation(self, instance):
+        return {
+            "trips": [
+                {
+                    "index": index,
+                    "status": item["status"],
+                    "trip": (
+                        TripSerializer(item["trip"], context=self.context).data
+                        if item["trip"] is not None
+                        else None
+                    ),
+                    "errors": item["errors"],
+                }
+                for index, item in enumerate(instance["trips"])
+            ],
+        }
+
+
 class TripSerializer(MinimalTripSerializer):
     sourceId = serpy.StrField(
         required=False,
@@ -628,7 +909,16 @@ class TripSerializer(MinimalTripSerializer):
 
     id = serpy.IntField()
     direction = serpy.StrField(required=False)
-    track = GeometryField(required=False)
+    track = serpy.MethodField(required=False)
+
+    def get_track(self, trip):
+        # track_geojson is annotated by annotate_display_track
+        # and rendered by RawJSONRenderer
+        if hasattr(trip, "track_geojson"):
+            if trip.track_geojson is None:
+                return None
+            return RawJSON(trip.track_geojson)
+        return GeometryField().to_value(trip.track)
 
 
 class ColleagueTripSeralizer(MinimalTripSerializer):
@@ -682,7 +972,17 @@ class TripUpdateDeserializer(TripDeserializer):
         return instance
 
 
-class TripSet(UserAttendanceMixin, viewsets.ModelViewSet):
+class TripsBulkCreateMixin:
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        if get_api_version_from_request(request=request) == "v3" and any(
+            trip["status"] == "error" for trip in response.data["trips"]
+        ):
+            response.status_code = status.HTTP_207_MULTI_STATUS
+        return response
+
+
+class TripSet(TripsBulkCreateMixin, UserAttendanceMixin, viewsets.ModelViewSet):
     """
     Documentation: https://www.dopracenakole.cz/rest-docs/
 
@@ -694,12 +994,21 @@ class TripSet(UserAttendanceMixin, viewsets.ModelViewSet):
 
     post:
     Create a new track instance. Track can be sent ether by GPX file (file parameter) or in GeoJSON format (track parameter).
+
+    post (API v3):
+    Create or update a list of trips at once, return status of every trip.
     """
 
+    # Tracks are rendered to GeoJSON by the database
+    renderer_classes = [RawJSONRenderer, renderers.BrowsableAPIRenderer]
+
     def get_queryset(self):
-        return Trip.objects.filter(
+        qs = Trip.objects.filter(
             user_attendance=self.ua(),
         )
+        if self.action in ["list", "retrieve"]:
+            qs = annotate_display_track(qs, self.request)
+        return qs
 
     def get_serializer_class(self):
         api_version = get_api_version_from_request(request=self.request)
@@ -712,11 +1021,13 @@ class TripSet(UserAttendanceMixin, viewsets.ModelViewSet):
                 return TripDeserializer
             elif api_version == "v2":
                 return TripsDeserializer
+            elif api_version == "v3":
+                return TripsBulkDeserializer
 
     permission_classes = [permissions.IsAuthenticated]
 
 
-class TripRangeSet(UserAttendanceMixin, viewsets.ModelViewSet):
+class TripRangeSet(TripsBulkCreateMixin, UserAttendanceMixin, viewsets.ModelViewSet):
     """
     Documentation: https://www.dopracenakole.cz/rest-docs/
 
@@ -727,6 +1038,9 @@ class TripRangeSet(UserAttendanceMixin, viewsets.ModelViewSet):
     Return track detail including a track geometry.
     """
 
+    # Tracks are rendered to GeoJSON by the database
+    renderer_classes = [RawJSONRenderer, renderers.BrowsableAPIRenderer]
+
     def get_queryset(self):
         subsidiaries = RequestSpecificField(
             lambda company, req: [
@@ -745,6 +1059,8 @@ class TripRangeSet(UserAttendanceMixin, viewsets.ModelViewSet):
             qs = qs.filter(
                 date__range=[start_date, end_date],
             )
+        if self.action in ["list", "retrieve"]:
+            qs = annotate_display_track(qs, self.request)
         return qs
 
     def get_serializer_class(self):
@@ -758,6 +1074,8 @@ class TripRangeSet(UserAttendanceMixin, viewsets.ModelViewSet):
                 return TripDeserializer
             elif api_version == "v2":
                 return TripsDeserializer
+            elif api_version == "v3":
+                return TripsBulkDeserializer
 
     permission_classes = [permissions.IsAuthenticated]
 
@@ -929,6 +1247,43 @@ class CompetitionSet(UserAttendanceMixin, viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
 
+class MyCompetitionSerializer(CompetitionSerializer):
+    competitor_count = serpy.IntField()
+    my_result = serpy.MethodField()
+
+    def get_my_result(self, obj):
+        if obj.my_result_id is None:
+            return None
+        return {
+            "id": obj.my_result_id,
+            "result": str(obj.my_result),
+            "divident": obj.my_result_divident,
+            "divisor": obj.my_result_divisor,
+            "place": obj.better_results_count + 1,
+        }
+
+
+class MyCompetitionSet(UserAttendanceMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Competitions of the user with competitor count and the result
+    and place of the user's competitor.
+    """
+
+    def get_queryset(self):
+        user_attendance = self.ua()
+        return (
+            results.annotate_my_results(
+                results.get_competitions(user_attendance),
+                user_attendance,
+            )
+            .prefetch_related("commute_modes")
+            .order_by("-priority", "pk")
+        )
+
+    serializer_class = MyCompetitionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+
 class CompetitionFieldsValues(APIView):
     """Get competition fields choices values"""
 
@@ -1541,72 +1896,127 @@ class CityInCampaignSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [permissions.AllowAny]
 
 
+def get_cities_in_campaign(cities, campaign):
+    """
+    Return CityInCampaign of the cities in the campaign as dict {city id: city in campaign}
+    with competitor count, trip statistics, active subsidiaries and public competitions
+    loaded for all the cities by fixed number of queries
+    """
+    city_ids = [city.id for city in cities]
+    cities_in_campaign = {
+        city_in_campaign.city_id: city_in_campaign
+        for city_in_campaign in CityInCampaign.objects.filter(
+            campaign=campaign,
+            city_id__in=city_ids,
+        )
+        .select_related("city")
+        .prefetch_related(
+            Prefetch(
+                "city__subsidiary_set",
+                queryset=Subsidiary.objects.filter(
+                    id__in=Team.objects.filter(
+                        subsidiary__city_id__in=city_ids,
+                        campaign=campaign,
+                    ).values_list("subsidiary", flat=True),
+                    active=True,
+                ),
+                to_attr="campaign_subsidiaries",
+            ),
+            Prefetch(
+                "city__competition_set",
+                queryset=Competition.objects.filter(
+                    campaign=campaign,
+                    company=None,
+                    is_public=True,
+                ).prefetch_related("commute_modes"),
+                to_attr="public_competitions",
+            ),
+        )
+    }
+    if not cities_in_campaign:
+        return cities_in_campaign
+    competitors = UserAttendance.objects.filter(
+        campaign=campaign,
+        team__subsidiary__city_id__in=city_ids,
+        payment_status__in=("done", "no_admission"),
+    )
+    competitor_counts = dict(
+        competitors.values_list("team__subsidiary__city")
+        .annotate(Count("id"))
+        .order_by()
+    )
+    competition_phase = campaign.competition_phase()
+    distances = distance_all_modes_grouped(
+        Trip.objects.filter(
+            user_attendance__in=competitors,
+            date__range=[
+                competition_phase.date_from,
+                competition_phase.date_to,
+            ],
+        ),
+        "user_attendance__team__subsidiary__city",
+    )
+    no_distances = distance_all_modes(Trip.objects.none())
+    for city_id, city_in_campaign in cities_in_campaign.items():
+        city_in_campaign.loaded_competitor_count = competitor_counts.get(city_id, 0)
+        city_in_campaign.loaded_distances = distances.get(city_id, no_distances)
+    return cities_in_campaign
+
+
+class CityInCampaignField(RequestSpecificField):
+    """Field of CityInCampaign of the city loaded by CitySerializer"""
+
+    def to_value(self, value):
+        city, context = value
+        try:
+            city_in_campaign = context["cities_in_campaign"][city.id]
+        except KeyError:
+            raise CityInCampaign.DoesNotExist
+        return self.method(city_in_campaign, context["request"])
+
+
 class CitySerializer(serpy.Serializer):
-    competitor_count = RequestSpecificField(
-        lambda city, req: CityInCampaign.objects.get(
-            city=city, campaign=req.campaign
-        ).competitor_count(),
+    competitor_count = CityInCampaignField(
+        lambda cic, req: cic.loaded_competitor_count,
     )
-    trip_stats = RequestSpecificField(
-        lambda city, req: CityInCampaign.objects.get(
-            city=city, campaign=req.campaign
-        ).distances(),
+    trip_stats = CityInCampaignField(
+        lambda cic, req: cic.loaded_distances,
     )
     # frequency = RequestSpecificField(  TODO
     #     lambda city, req: CityInCampaign.objects.get(city=city, campaign=req.campaign).distances()
     # )
-    emissions = RequestSpecificField(
-        lambda city, req: CityInCampaign.objects.get(
-            city=city, campaign=req.campaign
-        ).emissions(),
+    emissions = CityInCampaignField(
+        lambda cic, req: get_emissions(cic.loaded_distances["distance__sum"]),
     )
-    distance = RequestSpecificField(
-        lambda city, req: CityInCampaign.objects.get(
-            city=city, campaign=req.campaign
-        ).distance(),
+    distance = CityInCampaignField(
+        lambda cic, req: cic.loaded_distances["distance__sum"],
     )
-    eco_trip_count = RequestSpecificField(
-        lambda city, req: CityInCampaign.objects.get(
-            city=city, campaign=req.campaign
-        ).eco_trip_count(),
+    eco_trip_count = CityInCampaignField(
+        lambda cic, req: cic.loaded_distances["count__sum"],
     )
-    description = RequestSpecificField(
-        lambda city, req: CityInCampaign.objects.get(
-            city=city, campaign=req.campaign
-        ).description(language=req.query_params.get("lang", "cs")),
+    description = CityInCampaignField(
+        lambda cic, req: cic.description(language=req.query_params.get("lang", "cs")),
     )
-    organizer = RequestSpecificField(
-        lambda city, req: (
-            CityInCampaign.objects.get(city=city, campaign=req.campaign).organizer
-        ),
+    organizer = CityInCampaignField(
+        lambda cic, req: cic.organizer,
     )
-
-    organizer_url = RequestSpecificField(
-        lambda city, req: (
-            CityInCampaign.objects.get(city=city, campaign=req.campaign).organizer_url
-        ),
+    organizer_url = CityInCampaignField(
+        lambda cic, req: cic.organizer_url,
     )
-    subsidiaries = RequestSpecificField(
-        lambda city, req: [
+    subsidiaries = CityInCampaignField(
+        lambda cic, req: [
             HyperlinkedField(  # noqa
                 "subsidiary-detail",
             ).get_url(subsidiary, req)
-            for subsidiary in Subsidiary.objects.filter(  # noqa  # noqa
-                id__in=Team.objects.filter(
-                    subsidiary__city=city,
-                    campaign=req.campaign,
-                ).values_list("subsidiary", flat=True),
-                active=True,
-            )
+            for subsidiary in cic.city.campaign_subsidiaries
         ]
     )
-    competitions = RequestSpecificField(
-        lambda city, req: [
-            CompetitionSerializer(competition, context={"request": req}).data
-            for competition in Competition.objects.filter(  # noqa
-                city__id=city.id, campaign=req.campaign, company=None, is_public=True
-            )
-        ]
+    competitions = CityInCampaignField(
+        lambda cic, req: CompetitionSerializer(
+            cic.city.public_competitions,
+            context={"request": req},
+            many=True,
+        ).data
     )
     wp_url = serpy.StrField(
         attr="get_wp_url",
@@ -1620,6 +2030,14 @@ class CitySerializer(serpy.Serializer):
     location = PointField(format="coords")
     # 'frequency', TODO
 
+    def to_value(self, instance):
+        cities = list(instance) if self.many else [instance]
+        self.context["cities_in_campaign"] = get_cities_in_campaign(
+            cities,
+            self.context["request"].campaign,
+        )
+        return super().to_value(cities if self.many else instance)
+
 
 class CitySet(viewsets.ReadOnlyModelViewSet):
     def get_queryset(self):
@@ -1644,24 +2062,24 @@ class MyCitySet(UserAttendanceMixin, viewsets.ReadOnlyModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
 
-def get_data_export_url(city, campaign):
+def get_file_url(file):
     try:
-        return CityInCampaign.objects.get(city=city, campaign=campaign).data_export.url
+        return file.url
     except ValueError:
         return None
 
 
 class CoordinatedCitySerializer(CitySerializer):
-    data_export_password = RequestSpecificField(
-        lambda city, req: (
-            CityInCampaign.objects.get(
-                city=city, campaign=req.campaign
-            ).data_export_password
-        ),
+    data_export_password = CityInCampaignField(
+        lambda cic, req: cic.data_export_password,
+    )
+
+    data_export_url = CityInCampaignField(
+        lambda cic, req: get_file_url(cic.data_export),
     )
 
-    data_export_url = RequestSpecificField(
-        lambda city, req: get_data_export_url(city, req.campaign),
+    heatmap_export_url = CityInCampaignField(
+        lambda cic, req: get_file_url(cic.heatmap_export),
     )
 
 
@@ -4417,6 +4835,7 @@ router.register(r"this_campaign", ThisCampaignSet, basename="this-campaign")
 router.register(r"campaign_type", CampaignTypeSet, basename="campaigntype")
 router.registry.extend(organization_router.registry)
 router.register(r"competition", CompetitionSet, basename="competition")
+router.register(r"my_competition", MyCompetitionSet, basename="my-competition")
 router.register(r"subsidiary", SubsidiarySet, basename="subsidiary")
 router.register(r"my_subsidiary", MySubsidiarySet, basename="my-subsidiary")
 router.register(r"company", CompanySet, basename="company")
@@ -203,7 +203,10 @@ class ApprovePaymentsView(APIView, CompanyAdminMixin):
                     user_attendances,
                     ["t_shirt_size"],
                 )
-                rebuild_denorm_models(models=user_attendances)
+                rebuild_denorm_models(
+                    models=user_attendances,
+                    async_denorm_flush=True,
+                )
             return Response(
                 {
                     "message": _("Úspěšně schváleno {payments} plateb.").format(
@@ -274,7 +277,10 @@ class DisapprovePaymentsView(APIView, CompanyAdminMixin):
                     user_attendances,
                     ["t_shirt_size"],
                 )
-                rebuild_denorm_models(models=user_attendances)
+                rebuild_denorm_models(
+                    models=user_attendances,
+                    async_denorm_flush=True,
+                )
             return Response(
                 {
                     "message": _("Úspěšně zamítnuto {payments} plateb.").format(
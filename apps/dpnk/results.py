@@ -19,10 +19,27 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 import logging
+from collections import defaultdict, namedtuple
+
+from celery import group
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import (
+    Count,
+    FloatField,
+    IntegerField,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
-from django.db.models import Q, Sum
-
-from . import models, tasks, util
+from . import bulk_stats, models, recalculation_queue, tasks, util
 from .models import (
     Answer,
     Choice,
@@ -30,6 +47,8 @@ from .models import (
     Company,
     CommuteMode,
     Competition,
+    CompetitionRecalculation,
+    CompetitionRecalculationChunk,
     CompetitionResult,
     Subsidiary,
     Team,
@@ -184,38 +203,81 @@ def get_unanswered_questionnaires(user_attendance):
     return competitions
 
 
+def _count_subquery(queryset):
+    """Count rows of the queryset (filtered by OuterRef) in subquery."""
+    return Coalesce(
+        Subquery(
+            queryset.order_by()
+            .values("competition")
+            .annotate(count=Count("pk"))
+            .values("count"),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def annotate_my_results(competitions, user_attendance):
+    """
+    Annotate competitions with competitor_count and with id, result,
+    result_divident, result_divisor and better_results_count (number of
+    competitors with better result) of the competitor of the user attendance.
+    Everything is computed by one query for all competitions.
+    """
+    my_competitor = Q(user_attendance=user_attendance)
+    if user_attendance.team:
+        my_competitor |= Q(team=user_attendance.team_id)
+        my_competitor |= Q(subsidiary=user_attendance.team.subsidiary_id)
+    company = user_attendance.company()
+    if company:
+        my_competitor |= Q(company=company)
+    results = CompetitionResult.objects.filter(
+        competition=OuterRef("pk"),
+        result__isnull=False,
+    )
+    my_results = results.filter(my_competitor).order_by()
+    return competitions.annotate(
+        competitor_count=_count_subquery(results),
+        my_result_id=Subquery(my_results.values("pk")[:1], output_field=IntegerField()),
+        my_result=Subquery(
+            my_results.values("result")[:1],
+            output_field=CompetitionResult._meta.get_field("result"),
+        ),
+        my_result_divident=Subquery(
+            my_results.values("result_divident")[:1], output_field=FloatField()
+        ),
+        my_result_divisor=Subquery(
+            my_results.values("result_divisor")[:1], output_field=FloatField()
+        ),
+    ).annotate(
+        better_results_count=_count_subquery(
+            results.filter(result__gt=OuterRef("my_result"))
+        ),
+    )
+
+
 def get_competitions_with_info(user_attendance, competition_types=None):
     competitions = get_competitions(user_attendance).select_related(
         "campaign", "company"
     )
     if competition_types:
         competitions = competitions.filter(competition_type__in=competition_types)
+    competitions = annotate_my_results(competitions, user_attendance)
 
     for competition in competitions:
-        results = competition.get_results()
-
-        if not results:
+        if not competition.competitor_count:
             continue
 
-        competition.competitor_count = results.exclude(result=None).count()
-
-        try:
-            if (
-                competition.competitor_type == "single_user"
-                or competition.competitor_type == "liberos"
-            ):
-                my_results = results.get(user_attendance=user_attendance)
-            elif competition.competitor_type == "team":
-                my_results = results.get(team=user_attendance.team)
-            elif competition.competitor_type == "company":
-                my_results = results.get(company=user_attendance.company())
-        except CompetitionResult.DoesNotExist:
-            my_results = CompetitionResult()
+        my_results = CompetitionResult(
+            id=competition.my_result_id,
+            competition=competition,
+            result=competition.my_result,
+            result_divident=competition.my_result_divident,
+            result_divisor=competition.my_result_divisor,
+        )
 
         if my_results.result:
-            my_results.position = (
-                results.filter(result__gt=my_results.result).count() + 1
-            )
+            my_results.position = competition.better_results_count + 1
         else:
             my_results.position = "-"
 
@@ -302,7 +364,7 @@ def get_working_trips_count_without_minimum(
     non_working_rides_in_working_day = Trip.objects.filter(
         **non_working_rides_in_working_day_query
     ).count()
-    working_days_count = len(util.working_days(competition))
+    working_days_count = util.working_days_count(competition)
     working_trips_count = (
         working_days_count * 2
         + trips_in_non_working_day
@@ -380,30 +442,1131 @@ def get_team_avg_length(team, competition):
     return distance, member_count, float(distance) / float(member_count)
 
 
+TripStats = namedtuple(
+    "TripStats",
+    (
+        "rides_count",
+        "length",
+        "working_trips_count",
+        "working_trips_count_without_minimum",
+    ),
+)
+
+
+def _filtered_aggregate(aggregate, field, filter_q, *lookup_values):
+    """Aggregate user trips matching filter_q, 0 if any of the __in lookup values is empty."""
+    if not all(lookup_values):
+        return Value(0)
+    return aggregate(field, filter=filter_q)
+
+
+def get_trip_stats(user_attendances, competition, day=None):
+    """
+    Compute rides count, length and working trips count of all given user attendances
+    with one grouped query.
+
+    Gives the same numbers as calling get_rides_count, get_userprofile_length
+    and get_working_trips_count for every user attendance separately.
+
+    @return dict {user_attendance_id: TripStats}
+    """
+    if not day:
+        day = util.today()
+    start_day, end_day = util.dates(competition, day)
+    working_days = util.working_days(competition, day)
+    non_working_days = util.non_working_days(competition, day)
+    commute_modes = list(competition.commute_modes.values_list("pk", flat=True))
+    other_commute_modes = list(
+        CommuteMode.objects.exclude(pk__in=commute_modes).values_list("pk", flat=True)
+    )
+
+    counted_trips = Q(
+        user_trips__commute_mode__in=commute_modes,
+        user_trips__date__range=(start_day, end_day),
+    )
+    if not competition.recreational:
+        counted_trips &= Q(user_trips__direction__in=("trip_to", "trip_from"))
+
+    stats = (
+        user_attendances.order_by()
+        .annotate(
+            stats_rides_count=_filtered_aggregate(
+                Count, "user_trips", counted_trips, commute_modes
+            ),
+            stats_length=_filtered_aggregate(
+                Sum, "user_trips__distance", counted_trips, commute_modes
+            ),
+            stats_trips_in_non_working_day=_filtered_aggregate(
+                Count,
+                "user_trips",
+                Q(
+                    user_trips__commute_mode__in=commute_modes,
+                    user_trips__date__in=non_working_days,
+                ),
+                commute_modes,
+                non_working_days,
+            ),
+            stats_non_working_rides_in_working_day=_filtered_aggregate(
+                Count,
+                "user_trips",
+                Q(
+                    user_trips__commute_mode__in=other_commute_modes,
+                    user_trips__date__in=working_days,
+                    user_trips__direction__in=("trip_to", "trip_from"),
+                ),
+                other_commute_modes,
+                working_days,
+            ),
+        )
+        .values_list(
+            "pk",
+            "stats_rides_count",
+            "stats_length",
+            "stats_trips_in_non_working_day",
+            "stats_non_working_rides_in_working_day",
+        )
+    )
+
+    working_days_count = util.working_days_count(competition)
+    minimum_rides_base = get_minimum_rides_base_proportional(competition, day)
+    trip_stats = {}
+    for (
+        pk,
+        rides_count,
+        length,
+        trips_in_non_working_day,
+        non_working_rides_in_working_day,
+    ) in stats:
+        working_trips_count = (
+            working_days_count * 2
+            + trips_in_non_working_day
+            - non_working_rides_in_working_day
+        )
+        trip_stats[pk] = TripStats(
+            rides_count,
+            length or 0,
+            max(working_trips_count, minimum_rides_base),
+            working_trips_count,
+        )
+    return trip_stats
+
+
+UserAttendanceTripStats = namedtuple(
+    "UserAttendanceTripStats",
+    (
+        "get_rides_count_denorm",
+        "frequency",
+        "trip_length_total",
+        "total_trip_length_including_recreational",
+        "working_rides_base_count",
+        "trip_points_total",
+    ),
+)
+
+USER_ATTENDANCE_TRIP_STATS_FIELDS = UserAttendanceTripStats._fields
+
+
+def get_user_attendance_trip_stats(user_attendances, day=None):
+    """
+    Compute all trip dependent denormalized fields of the user attendances
+    by one grouped query with conditional aggregates per campaign.
+
+    Gives the same numbers as the UserAttendance denormalized fields
+    computed one by one.
+
+    @return dict {user_attendance_id: UserAttendanceTripStats}
+    """
+    if not day:
+        day = util.today()
+    user_attendances = user_attendances.order_by()
+    trip_stats = {}
+    campaigns = models.Campaign.objects.filter(
+        pk__in=user_attendances.values("campaign_id"),
+    )
+    for campaign in campaigns:
+        campaign_user_attendances = user_attendances.filter(campaign=campaign)
+        try:
+            phase = campaign.phase("competition")
+        except models.Phase.DoesNotExist:
+            for pk, points in campaign_user_attendances.annotate(
+                stats_points=Sum("user_trips__commute_mode__points"),
+            ).values_list("pk", "stats_points"):
+                trip_stats[pk] = UserAttendanceTripStats(0, 0, 0, 0, 0, points or 0)
+            continue
+        start_day, end_day = util.dates(phase, day)
+        working_days = util.working_days(phase, day)
+        non_working_days = util.non_working_days(phase, day)
+        eco_trips = Q(
+            user_trips__commute_mode__eco=True,
+            user_trips__commute_mode__does_count=True,
+            user_trips__date__range=(start_day, end_day),
+        )
+        commute_trips = eco_trips & Q(
+            user_trips__direction__in=("trip_to", "trip_from"),
+        )
+        stats = campaign_user_attendances.annotate(
+            stats_rides_count=Count("user_trips", filter=commute_trips),
+            stats_length=Sum("user_trips__distance", filter=commute_trips),
+            stats_length_including_recreational=Sum(
+                "user_trips__distance", filter=eco_trips
+            ),
+            stats_trips_in_non_working_day=_filtered_aggregate(
+                Count,
+                "user_trips",
+                Q(
+                    user_trips__commute_mode__does_count=True,
+                    user_trips__date__in=non_working_days,
+                ),
+                non_working_days,
+            ),
+            stats_non_working_rides_in_working_day=_filtered_aggregate(
+                Count,
+                "user_trips",
+                Q(
+                    user_trips__commute_mode__does_count=False,
+                    user_trips__date__in=working_days,
+                    user_trips__direction__in=("trip_to", "trip_from"),
+                ),
+                working_days,
+            ),
+            stats_points=Sum("user_trips__commute_mode__points"),
+        ).values_list(
+            "pk",
+            "stats_rides_count",
+            "stats_length",
+            "stats_length_including_recreational",
+            "stats_trips_in_non_working_day",
+            "stats_non_working_rides_in_working_day",
+            "stats_points",
+        )
+        working_days_count = util.working_days_count(phase)
+        minimum_rides_base = get_minimum_rides_base_proportional(phase, day)
+        for (
+            pk,
+            rides_count,
+            length,
+            length_including_recreational,
+            trips_in_non_working_day,
+            non_working_rides_in_working_day,
+            points,
+        ) in stats:
+            working_trips_count = max(
+                working_days_count * 2
+                + trips_in_non_working_day
+                - non_working_rides_in_working_day,
+                minimum_rides_base,
+            )
+            trip_stats[pk] = UserAttendanceTripStats(
+                rides_count,
+                float(rides_count) / working_trips_count if working_trips_count else 0,
+                length or 0,
+                length_including_recreational or 0,
+                working_trips_count,
+                points or 0,
+            )
+    return trip_stats
+
+
+def update_user_attendance_trip_stats(user_attendances, day=None):
+    """
+    Set-based variant of the denorm flush of the trip dependent fields:
+    compute them for all the user attendances by get_user_attendance_trip_stats
+    and write them by bulk_update.
+    Return number of updated user attendances.
+    """
+    trip_stats = get_user_attendance_trip_stats(user_attendances, day)
+    UserAttendance.objects.bulk_update(
+        [UserAttendance(pk=pk, **stats._asdict()) for pk, stats in trip_stats.items()],
+        USER_ATTENDANCE_TRIP_STATS_FIELDS,
+        batch_size=1000,
+    )
+    return len(trip_stats)
+
+
+TeamStats = namedtuple(
+    "TeamStats",
+    (
+        "member_count",
+        "paid_member_count",
+        "unapproved_member_count",
+        "get_rides_count_denorm",
+        "frequency",
+        "name_with_members",
+        "member_names",
+        "working_trips_count",
+        "eco_trip_count",
+        "length",
+    ),
+)
+
+TEAM_STATS_FIELDS = (
+    "member_count",
+    "paid_member_count",
+    "unapproved_member_count",
+    "get_rides_count_denorm",
+    "frequency",
+    "name_with_members",
+)
+
+
+def _profile_name(nickname, first_name, last_name, email, username):
+    """The same as UserProfile.name() computed from the values"""
+    return nickname or f"{first_name} {last_name}".strip() or email or username
+
+
+def get_team_stats(teams):
+    """
+    Compute team statistics of the teams by one grouped query over
+    the denormalized columns of their members (and one query for member names).
+
+    Gives the same numbers as the Team denormalized fields computed one by one,
+    provided the members' denormalized fields are up to date.
+
+    @return dict {team_id: TeamStats}
+    """
+    members = Q(
+        users__approved_for_team="approved",
+        users__userprofile__user__is_active=True,
+    )
+    paid_members = members & Q(users__payment_status__in=("done", "no_admission"))
+    stats = (
+        teams.order_by()
+        .annotate(
+            stats_member_count=Count("users", filter=members),
+            stats_paid_member_count=Count("users", filter=paid_members),
+            stats_unapproved_member_count=Count(
+                "users",
+                filter=Q(
+                    users__approved_for_team="undecided",
+                    users__userprofile__user__is_active=True,
+                ),
+            ),
+            stats_rides_count=Sum("users__get_rides_count_denorm", filter=members),
+            stats_frequency=Sum("users__frequency", filter=paid_members),
+            stats_working_trips_count=Sum(
+                "users__working_rides_base_count", filter=paid_members
+            ),
+            stats_eco_trip_count=Sum(
+                "users__get_rides_count_denorm", filter=paid_members
+            ),
+            stats_length=Sum("users__trip_length_total", filter=paid_members),
+        )
+        .values_list(
+            "pk",
+            "name",
+            "stats_member_count",
+            "stats_paid_member_count",
+            "stats_unapproved_member_count",
+            "stats_rides_count",
+            "stats_frequency",
+            "stats_working_trips_count",
+            "stats_eco_trip_count",
+            "stats_length",
+        )
+    )
+    member_names = defaultdict(list)
+    for team_id, *name_values in (
+        UserAttendance.objects.filter(
+            team__in=teams.order_by().values("pk"),
+            approved_for_team="approved",
+            userprofile__user__is_active=True,
+        )
+        .order_by()
+        .values_list(
+            "team_id",
+            "userprofile__nickname",
+            "userprofile__user__first_name",
+            "userprofile__user__last_name",
+            "userprofile__user__email",
+            "userprofile__user__username",
+        )
+    ):
+        member_names[team_id].append(_profile_name(*name_values))
+
+    team_stats = {}
+    for (
+        pk,
+        name,
+        member_count,
+        paid_member_count,
+        unapproved_member_count,
+        rides_count,
+        frequency,
+        working_trips_count,
+        eco_trip_count,
+        length,
+    ) in stats:
+        names = sorted(member_names[pk])
+        # Average frequency of paid members, None if no paid member has one
+        if paid_member_count and frequency is not None:
+            frequency /= paid_member_count
+        elif not paid_member_count:
+            frequency = 0
+        team_stats[pk] = TeamStats(
+            member_count,
+            paid_member_count,
+            unapproved_member_count,
+            rides_count or 0,
+            frequency,
+            "%s (%s)" % (name, ", ".join(names)) if names else name,
+            names,
+            working_trips_count or 0,
+            eco_trip_count or 0,
+            length or 0,
+        )
+    return team_stats
+
+
+def update_team_stats(teams):
+    """
+    Set-based variant of the denorm flush of the member dependent team fields:
+    compute them for all the teams by get_team_stats
+    and write them by bulk_update.
+    Return number of updated teams.
+    """
+    team_stats = get_team_stats(teams)
+    Team.objects.bulk_update(
+        [
+            Team(pk=pk, **{field: getattr(stats, field) for field in TEAM_STATS_FIELDS})
+            for pk, stats in team_stats.items()
+        ],
+        TEAM_STATS_FIELDS,
+        batch_size=1000,
+    )
+    return len(team_stats)
+
+
+def get_questionnaire_points(competition):
+    """
+    Return questionnaire points of all user attendances answering the competition.
+
+    @return dict {user_attendance_id: points}
+    """
+    answers = Answer.objects.filter(question__competition=competition).order_by()
+    points = defaultdict(int)
+    # Choice points and given points have to be summed by separate queries,
+    # otherwise the points_given would be multiplied by the choices join.
+    for user_attendance_id, choice_points in answers.values_list(
+        "user_attendance"
+    ).annotate(Sum("choices__points")):
+        points[user_attendance_id] += choice_points or 0
+    for user_attendance_id, points_given in answers.values_list(
+        "user_attendance"
+    ).annotate(Sum("points_given")):
+        points[user_attendance_id] += points_given or 0
+    return points
+
+
+def _stats_frequency(trip_stats, user_attendance_ids):
+    """Same as get_team_frequency, but computed from precomputed trip stats."""
+    rides_count = 0
+    working_trips_count = 0
+    for user_attendance_id in user_attendance_ids:
+        rides_count += trip_stats[user_attendance_id].rides_count
+        working_trips_count += trip_stats[user_attendance_id].working_trips_count
+    if working_trips_count == 0:
+        return 0, 0, 0
+    return rides_count, working_trips_count, float(rides_count) / working_trips_count
+
+
+def _stats_length(trip_stats, user_attendance_ids):
+    return sum(trip_stats[pk].length for pk in user_attendance_ids)
+
+
+def _unique(competitors):
+    """Remove duplicate competitors (caused by joins in filters) keeping the order."""
+    seen = set()
+    for competitor in competitors:
+        if competitor.pk not in seen:
+            seen.add(competitor.pk)
+            yield competitor
+
+
+def _has_admission(competition, user_attendance, city_ids):
+    """
+    Same as Competition.has_admission, but doesn't query competition cities
+    for every user attendance.
+    """
+    if not user_attendance.entered_competition():
+        return False
+    if competition.competitor_type == "liberos" and not user_attendance.is_libero():
+        return False
+    team = user_attendance.team
+    if team:
+        if (
+            competition.company_id
+            and competition.company_id != team.subsidiary.company_id
+        ):
+            return False
+        if city_ids and team.subsidiary.city_id not in city_ids:
+            return False
+    return True
+
+
+def _make_result(competition, trip_stats, participant_ids, result_user_ids, points):
+    """
+    Make CompetitionResult with result computed from result_user_ids
+    and general results (frequency, distance) computed from participant_ids
+    the same way as calculate_general_results signal does it.
+    If result_user_ids is None, the result is left empty.
+    """
+    competition_result = CompetitionResult(competition=competition)
+    if result_user_ids is None:
+        pass
+    elif competition.competition_type == "questionnaire":
+        competition_result.result = sum(points.get(pk, 0) for pk in result_user_ids)
+    elif competition.competition_type == "length":
+        competition_result.result = _stats_length(trip_stats, result_user_ids)
+    elif competition.competition_type == "frequency":
+        (
+            competition_result.result_divident,
+            competition_result.result_divisor,
+            competition_result.result,
+        ) = _stats_frequency(trip_stats, result_user_ids)
+
+    frequency_result = _stats_frequency(trip_stats, participant_ids)
+    competition_result.frequency = frequency_result[2]
+    competition_result.distance = _stats_length(trip_stats, participant_ids)
+    if competition_result.result_divident is None:
+        competition_result.result_divident = frequency_result[0]
+    if competition_result.result_divisor is None:
+        competition_result.result_divisor = frequency_result[1]
+    return competition_result
+
+
+def _single_user_results(competition, competitors, points):
+    trip_stats = bulk_stats.get_trip_stats(competitors, competition)
+    competitors = competitors.select_related(
+        "campaign",
+        "t_shirt_size",
+        "team__subsidiary",
+        "userprofile__user",
+    )
+    city_ids = set(competition.city.values_list("pk", flat=True))
+    for user_attendance in _unique(competitors):
+        if (
+            competition.competition_type == "questionnaire"
+            and user_attendance.pk not in points
+        ):
+            continue
+        if not _has_admission(competition, user_attendance, city_ids):
+            continue
+        competition_result = _make_result(
+            competition,
+            trip_stats,
+            [user_attendance.pk],
+            [user_attendance.pk],
+            points,
+        )
+        competition_result.user_attendance = user_attendance
+        yield competition_result
+
+
+def _team_results(competition, competitors, points):
+    teams = list(_unique(competitors))
+    members = UserAttendance.objects.filter(
+        team__in=[team.pk for team in teams],
+        approved_for_team="approved",
+        userprofile__user__is_active=True,
+    )
+    trip_stats = bulk_stats.get_trip_stats(members, competition)
+    team_members = defaultdict(list)
+    team_paid_members = defaultdict(list)
+    for pk, team_id, payment_status in members.order_by("id").values_list(
+        "pk", "team_id", "payment_status"
+    ):
+        team_members[team_id].append(pk)
+        if payment_status in ("done", "no_admission"):
+            team_paid_members[team_id].append(pk)
+
+    for team in teams:
+        paid_members = team_paid_members[team.pk]
+        member_count = team.paid_member_count
+        if member_count == 0:
+            competition_result = _make_result(
+                competition, trip_stats, team_members[team.pk], None, points
+            )
+        elif competition.competition_type == "length":
+            distance = _stats_length(trip_stats, paid_members)
+            competition_result = _make_result(
+                competition, trip_stats, team_members[team.pk], None, points
+            )
+            competition_result.result_divident = distance
+            competition_result.result_divisor = member_count
+            competition_result.result = float(distance) / float(member_count)
+        else:
+            competition_result = _make_result(
+                competition, trip_stats, team_members[team.pk], paid_members, points
+            )
+            if competition.competition_type == "questionnaire":
+                competition_result.result = float(competition_result.result)
+        competition_result.team = team
+        yield competition_result
+
+
+def _organization_results(competition, competitors, points, organization_field, lookup):
+    """
+    Results of company or subsidiary competition.
+    @organization_field CompetitionResult field with the competitor
+    @lookup UserAttendance lookup to the competitor
+    """
+    organizations = list(_unique(competitors))
+    user_attendances = UserAttendance.objects.filter(
+        **{lookup + "__in": [organization.pk for organization in organizations]}
+    )
+    trip_stats = bulk_stats.get_trip_stats(user_attendances, competition)
+    participants = defaultdict(list)
+    campaign_user_attendances = defaultdict(list)
+    for pk, organization_id, campaign_id in user_attendances.order_by("id").values_list(
+        "pk",
+        lookup,
+        "campaign",
+    ):
+        participants[organization_id].append(pk)
+        if campaign_id == competition.campaign_id:
+            campaign_user_attendances[organization_id].append(pk)
+
+    for organization in organizations:
+        result_user_ids = campaign_user_attendances[organization.pk]
+        if not result_user_ids:
+            continue
+        competition_result = _make_result(
+            competition,
+            trip_stats,
+            participants[organization.pk],
+            result_user_ids,
+            points,
+        )
+        setattr(competition_result, organization_field, organization)
+        yield competition_result
+
+
+def get_competition_results(competition, competitor_pks=None):
+    """
+    Compute (unsaved) results of all competitors of the competition
+    or only of the competitors with competitor_pks.
+    """
+    competitors = get_competitors(competition)
+    if competitor_pks is not None:
+        competitors = competitors.filter(pk__in=competitor_pks)
+
+    if competition.competition_type == "questionnaire":
+        points = get_questionnaire_points(competition)
+    else:
+        points = {}
+
+    if competition.competitor_type in ("single_user", "liberos"):
+        competition_results = _single_user_results(competition, competitors, points)
+    elif competition.competitor_type == "team":
+        competition_results = _team_results(competition, competitors, points)
+    elif competition.competitor_type == "company":
+        competition_results = _organization_results(
+            competition, competitors, points, "company", "team__subsidiary__company"
+        )
+    elif competition.competitor_type == "subsidiary":
+        competition_results = _organization_results(
+            competition, competitors, points, "subsidiary", "team__subsidiary"
+        )
+    return list(competition_results)
+
+
+def replace_competition_results(competition, competition_results):
+    """
+    Replace all results of the competition by competition_results
+    in one transaction, so the results are never seen half-deleted.
+    """
+    with transaction.atomic():
+        CompetitionResult.objects.filter(competition=competition).delete()
+        CompetitionResult.objects.bulk_create(competition_results, batch_size=1000)
+        update_results_rank(competition)
+
+
 def recalculate_result_competition(competition):
-    CompetitionResult.objects.filter(competition=competition).delete()
-    for competitor in competition.get_competitors():
-        recalculate_result(competition, competitor)
+    """
+    Recalculate results of all competitors of the competition at once.
+
+    Trip statistics are computed by bulk_stats from trips streamed by one query
+    instead of several queries per competitor and the results are written
+    by bulk_create.
+    The results are the same as if recalculate_result was called
+    for every competitor.
+    """
+    replace_competition_results(competition, get_competition_results(competition))
+
+
+COMPETITION_RESULT_FIELDS = (
+    "user_attendance_id",
+    "team_id",
+    "subsidiary_id",
+    "company_id",
+    "result",
+    "result_divident",
+    "result_divisor",
+    "frequency",
+    "distance",
+)
+
+
+def recalculate_result_competition_parallel(competition):
+    """
+    Recalculate results of the competition by tasks.recalculate_competition_chunk
+    tasks running in parallel, every one of them for
+    RESULTS_RECALCULATION_CHUNK_SIZE competitors.
+
+    The chunk results are stored in CompetitionRecalculationChunk
+    and the last finished chunk replaces the competition results by all of them.
+    Return the CompetitionRecalculation tracking the progress.
+    """
+    competitor_pks = list(
+        dict.fromkeys(get_competitors(competition).values_list("pk", flat=True))
+    )
+    chunk_size = settings.RESULTS_RECALCULATION_CHUNK_SIZE
+    chunks = [
+        competitor_pks[i : i + chunk_size]
+        for i in range(0, len(competitor_pks), chunk_size)
+    ]
+    recalculation = CompetitionRecalculation.objects.create(
+        competition=competition,
+        chunks_total=len(chunks),
+    )
+    if not chunks:
+        _finish_recalculation(recalculation)
+        return recalculation
+    chunks = CompetitionRecalculationChunk.objects.bulk_create(
+        CompetitionRecalculationChunk(
+            recalculation=recalculation,
+            index=index,
+            competitor_ids=chunk_competitor_pks,
+        )
+        for index, chunk_competitor_pks in enumerate(chunks)
+    )
+    group(tasks.recalculate_competition_chunk.si(chunk.pk) for chunk in chunks)()
+    return recalculation
+
+
+def recalculate_competition_chunk(chunk_pk):
+    """
+    Compute results of competitors in the chunk and store them in the chunk.
+    Finish the recalculation if it was the last unfinished chunk.
+
+    Repeated calls for the same chunk (task retries) are counted only once.
+    """
+    chunk = (
+        CompetitionRecalculationChunk.objects.select_related(
+            "recalculation__competition",
+        )
+        .filter(pk=chunk_pk)
+        .first()
+    )
+    # The chunks are deleted when the recalculation is finished
+    if (
+        chunk is None
+        or chunk.finished is not None
+        or chunk.recalculation.failed is not None
+    ):
+        return
+    competition_results = get_competition_results(
+        chunk.recalculation.competition,
+        chunk.competitor_ids,
+    )
+    chunk_results = [
+        {
+            field: getattr(competition_result, field)
+            for field in COMPETITION_RESULT_FIELDS
+        }
+        for competition_result in competition_results
+    ]
+    with transaction.atomic():
+        recalculation = CompetitionRecalculation.objects.select_for_update().get(
+            pk=chunk.recalculation_id,
+        )
+        if recalculation.finished is not None or recalculation.failed is not None:
+            return
+        if not CompetitionRecalculationChunk.objects.filter(
+            pk=chunk.pk,
+            finished=None,
+        ).update(results=chunk_results, finished=timezone.now()):
+            return
+        recalculation.chunks_done += 1
+        recalculation.save(update_fields=("chunks_done",))
+        if recalculation.chunks_done == recalculation.chunks_total:
+            _finish_recalculation(recalculation)
+
+
+def fail_competition_chunk(chunk_pk, error):
+    """
+    Mark the recalculation of the chunk failed, so that it isn't left running.
+    The remaining chunks are skipped, the competition results are kept.
+    """
+    chunk = CompetitionRecalculationChunk.objects.filter(pk=chunk_pk).first()
+    if chunk is None:
+        return
+    CompetitionRecalculation.objects.filter(
+        pk=chunk.recalculation_id,
+        finished=None,
+        failed=None,
+    ).update(
+        failed=timezone.now(),
+        error="%s. část: %r" % (chunk.index + 1, error),
+    )
+
+
+def _finish_recalculation(recalculation):
+    """
+    Replace the competition results by the results of all chunks,
+    unless newer recalculation of the competition was finished already.
+    """
+    competition = recalculation.competition
+    newer_finished = CompetitionRecalculation.objects.filter(
+        competition=competition,
+        created__gt=recalculation.created,
+        finished__isnull=False,
+    ).exists()
+    if not newer_finished:
+        replace_competition_results(
+            competition,
+            [
+                CompetitionResult(competition=competition, **values)
+                for chunk_results in recalculation.chunks.order_by("index").values_list(
+                    "results", flat=True
+                )
+                for values in chunk_results
+            ],
+        )
+    recalculation.finished = timezone.now()
+    recalculation.save(update_fields=("finished",))
+    recalculation.chunks.all().delete()
+
+
+UPDATE_RESULTS_RANK_SQL = """
+UPDATE {table} AS competition_result
+SET rank_from = ranks.rank_from, rank_to = ranks.rank_to
+FROM (
+    SELECT
+        id,
+        RANK() OVER (ORDER BY result DESC) AS rank_from,
+        COUNT(*) OVER (ORDER BY result DESC) AS rank_to
+    FROM {table}
+    WHERE competition_id = %s AND result IS NOT NULL
+) AS ranks
+WHERE competition_result.id = ranks.id AND (
+    competition_result.rank_from IS DISTINCT FROM ranks.rank_from
+    OR competition_result.rank_to IS DISTINCT FROM ranks.rank_to
+)
+"""
+
+
+def update_results_rank(competition):
+    """
+    Store lower and upper rank of all results of the competition
+    (the same as Competition.annotate_results_rank computes).
+
+    The ranks are computed by one UPDATE with window functions,
+    only the results with changed rank are written.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            UPDATE_RESULTS_RANK_SQL.format(table=CompetitionResult._meta.db_table),
+            [competition.pk],
+        )
+    CompetitionResult.objects.filter(
+        Q(rank_from__isnull=False) | Q(rank_to__isnull=False),
+        competition=competition,
+        result=None,
+    ).update(rank_from=None, rank_to=None)
+
+
+def clear_results_rank(competition, competition_result_pk, old_result, new_result):
+    """
+    Clear stored ranks of the changed result and of the results,
+    whose places are changed by the result change from old_result
+    to new_result (None if there is no result), so that
+    CompetitionResult.get_sequence_range counts them until the ranks
+    are updated.
+    """
+    if old_result == new_result:
+        return
+    results = [result for result in (old_result, new_result) if result is not None]
+    if len(results) == 2:
+        # Results between the old and new result are moved by one place
+        moved = Q(result__gte=min(results), result__lte=max(results))
+    else:
+        # All results worse than added/removed result are moved by one place
+        moved = Q(result__lte=results[0])
+    CompetitionResult.objects.filter(
+        moved | Q(pk=competition_result_pk),
+        competition=competition,
+        rank_from__isnull=False,
+    ).update(rank_from=None, rank_to=None)
+
+
+RESULTS_RANK_UPDATE_KEY = "dpnk:results-rank-update:%s"
+
+
+def schedule_results_rank_update(competition):
+    """
+    Update ranks of the competition by tasks.update_results_rank
+    after RESULTS_RANK_UPDATE_DELAY seconds.
+
+    Result changes of more competitors within the delay are ranked
+    by one update, so single trip or answer changes don't rewrite
+    ranks of the whole competition every time.
+    """
+    delay = settings.RESULTS_RANK_UPDATE_DELAY
+    if cache.add(RESULTS_RANK_UPDATE_KEY % competition.pk, True, delay):
+        tasks.update_results_rank.apply_async([competition.pk], countdown=delay)
+
+
+def get_competitor(competition, user_attendance):
+    """Return competitor of the competition, that the user attendance is part of."""
+    if competition.competitor_type == "team":
+        return user_attendance.team
+    elif (
+        competition.competitor_type == "single_user"
+        or competition.competitor_type == "liberos"
+    ):
+        return user_attendance
+    elif competition.competitor_type == "company":
+        return user_attendance.company()
+    elif competition.competitor_type == "subsidiary":
+        if user_attendance.team:
+            return user_attendance.team.subsidiary
+
 
+def recalculate_result_competitor_nothread(user_attendance, update_rank=False):
+    """
+    Recalculate results of the user attendance in all its competitions.
 
-def recalculate_result_competitor_nothread(user_attendance):
+    Return the competitions, ranks are updated by schedule_results_rank_update
+    unless update_rank is True.
+    """
+    competitions = []
     for competition in get_competitions(user_attendance):
-        if competition.competitor_type == "team" and user_attendance.team:
-            recalculate_result(competition, user_attendance.team)
+        competitor = get_competitor(competition, user_attendance)
+        if competitor is not None:
+            recalculate_result(competition, competitor, update_rank=update_rank)
+            competitions.append(competition)
+    return competitions
+
+
+def recalculate_result_competitor(user_attendance):
+    if recalculation_queue.get_queue() is None:
+        tasks.recalculate_competitor_task.apply_async([user_attendance.pk])
+    else:
+        recalculation_queue.enqueue([user_attendance.pk])
+
+
+TripState = namedtuple(
+    "TripState",
+    ("user_attendance_id", "date", "direction", "commute_mode_id", "distance"),
+)
+
+
+def get_trip_state(trip):
+    """Return values of the trip, that affect the results."""
+    return TripState(
+        trip.user_attendance_id,
+        Trip._meta.get_field("date").to_python(trip.date),
+        trip.direction,
+        trip.commute_mode_id,
+        Trip._meta.get_field("distance").to_python(trip.distance) or 0,
+    )
+
+
+def get_trip_contribution(competition, trip_state, commute_modes, day):
+    """
+    Return contribution of one trip to the rides count, length
+    and working trips count (without minimum) of the competition.
+    """
+    if trip_state is None:
+        return 0, 0, 0
+    start_day, end_day = util.dates(competition, day)
+    if not start_day <= trip_state.date <= end_day:
+        return 0, 0, 0
+    counted_mode = trip_state.commute_mode_id in commute_modes
+    working_direction = trip_state.direction in ("trip_to", "trip_from")
+    if counted_mode and (competition.recreational or working_direction):
+        rides_count, length = 1, trip_state.distance
+    else:
+        rides_count, length = 0, 0
+    if not util.working_day(trip_state.date):
+        working_trips_count = 1 if counted_mode else 0
+    else:
+        working_trips_count = -1 if not counted_mode and working_direction else 0
+    return rides_count, length, working_trips_count
+
+
+def update_results_trip_changed(old_trip_state, new_trip_state):
+    """
+    Update competition results after the trip was changed by applying only
+    the difference between the old and the new trip to the existing results.
+
+    old_trip_state is None for created trip, new_trip_state is None for deleted trip.
+    Results that can't be updated this way are recalculated from scratch
+    by recalculate_result_competitor (outside of the request).
+
+    The results are updated with current working days and minimal rides base,
+    they should be periodically fully recalculated
+    (see tasks.recalculate_active_competitions_results).
+    """
+    user_attendance_ids = {
+        trip_state.user_attendance_id
+        for trip_state in (old_trip_state, new_trip_state)
+        if trip_state is not None and trip_state.user_attendance_id
+    }
+    for user_attendance_id in user_attendance_ids:
+        user_attendance = (
+            UserAttendance.objects.select_related(
+                "campaign",
+                "team__subsidiary",
+                "userprofile__user",
+            )
+            .filter(pk=user_attendance_id)
+            .first()
+        )
+        if user_attendance is None:
+            continue
+        updated = [
+            _update_result_trip_changed(
+                competition,
+                user_attendance,
+                old_trip_state
+                if old_trip_state
+                and old_trip_state.user_attendance_id == user_attendance_id
+                else None,
+                new_trip_state
+                if new_trip_state
+                and new_trip_state.user_attendance_id == user_attendance_id
+                else None,
+            )
+            for competition in get_competitions(user_attendance)
+        ]
+        if not all(updated):
+            recalculate_result_competitor(user_attendance)
+
+
+def _update_result_trip_changed(  # noqa
+    competition, user_attendance, old_trip_state, new_trip_state
+):
+    """Return False if the result has to be recalculated from scratch"""
+    day = util.today()
+    commute_modes = set(competition.commute_modes.values_list("pk", flat=True))
+    old_contribution = get_trip_contribution(
+        competition, old_trip_state, commute_modes, day
+    )
+    new_contribution = get_trip_contribution(
+        competition, new_trip_state, commute_modes, day
+    )
+    if old_contribution == new_contribution:
+        return True
+
+    competitor = get_competitor(competition, user_attendance)
+    if competitor is None:
+        return True
+    if competition.competitor_type in ("single_user", "liberos"):
+        general_member = result_member = True
+    else:
+        if not user_attendance.team:
+            return True
+        general_member = True
+        result_member = True
+        if competition.competitor_type == "team":
+            general_member = (
+                user_attendance.approved_for_team == "approved"
+                and user_attendance.userprofile.user.is_active
+            )
+            result_member = general_member and user_attendance.payment_status in (
+                "done",
+                "no_admission",
+            )
+
+    rides_count_delta = new_contribution[0] - old_contribution[0]
+    length_delta = new_contribution[1] - old_contribution[1]
+    # The minimal rides base makes the working trips count nonlinear,
+    # so we have to count the difference from the actual user stats.
+    trip_stats = get_trip_stats(
+        UserAttendance.objects.filter(pk=user_attendance.pk), competition, day
+    )[user_attendance.pk]
+    old_working_trips_count = max(
+        trip_stats.working_trips_count_without_minimum
+        - (new_contribution[2] - old_contribution[2]),
+        get_minimum_rides_base_proportional(competition, day),
+    )
+    working_trips_count_delta = trip_stats.working_trips_count - old_working_trips_count
+
+    with transaction.atomic():
+        try:
+            competition_result = competition.results.select_for_update().get(
+                **{_competitor_field(competition): competitor},
+            )
+        except CompetitionResult.DoesNotExist:
+            return False
+
+        values = {}
+        divident = competition_result.result_divident or 0
+        divisor = competition_result.result_divisor or 0
+        if general_member:
+            values["distance"] = (competition_result.distance or 0) + length_delta
+        if competition.competition_type == "frequency":
+            if result_member:
+                divident += rides_count_delta
+                divisor += working_trips_count_delta
+                if divisor <= 0:
+                    return False
+                values["result_divident"] = divident
+                values["result_divisor"] = divisor
+                values["result"] = float(divident) / divisor
+                if competition.competitor_type in ("single_user", "liberos"):
+                    values["frequency"] = values["result"]
         elif (
-            competition.competitor_type == "single_user"
-            or competition.competitor_type == "liberos"
+            competition.competition_type == "length"
+            and competition.competitor_type == "team"
         ):
-            recalculate_result(competition, user_attendance)
-        elif competition.competitor_type == "company":
-            recalculate_result(competition, user_attendance.company())
-        elif competition.competitor_type == "subsidiary":
-            if user_attendance.team:
-                recalculate_result(competition, user_attendance.team.subsidiary)
+            if result_member:
+                if not divisor:
+                    return False
+                divident += length_delta
+                values["result_divident"] = divident
+                values["result"] = float(divident) / divisor
+        else:
+            # result_divident and result_divisor contain
+            # the general frequency of all participants
+            if competition.competition_type == "length" and result_member:
+                values["result"] = float(competition_result.result or 0) + length_delta
+            if general_member:
+                divident += rides_count_delta
+                divisor += working_trips_count_delta
+                if divisor <= 0:
+                    return False
+                values["result_divident"] = divident
+                values["result_divisor"] = divisor
+                values["frequency"] = float(divident) / divisor
+
+        if values:
+            CompetitionResult.objects.filter(pk=competition_result.pk).update(
+                updated=timezone.now(),
+                **values,
+            )
+            if "result" in values:
+                clear_results_rank(
+                    competition,
+                    competition_result.pk,
+                    competition_result.result,
+                    values["result"],
+                )
+                schedule_results_rank_update(competition)
+    return True
 
 
-def recalculate_result_competitor(user_attendance):
-    tasks.recalculate_competitor_task.apply_async([user_attendance.pk])
+def _competitor_field(competition):
+    """Return CompetitionResult field with the competitor of given competition."""
+    return {
+        "single_user": "user_attendance",
+        "liberos": "user_attendance",
+        "team": "team",
+        "company": "company",
+        "subsidiary": "subsidiary",
+    }[competition.competitor_type]
 
 
 def recalculate_results_team(team):
@@ -430,7 +1593,30 @@ def points_questionnaire(user_attendances, competition):
     return points + points_given
 
 
-def recalculate_result(competition, competitor):  # noqa
+def recalculate_result(competition, competitor, update_rank=False):
+    """
+    Recalculate result of the competitor in the competition.
+
+    Unless update_rank is True, the ranks are updated later
+    by schedule_results_rank_update and until then the ranks changed
+    by the new result are cleared.
+    """
+    if competitor is None:
+        return
+    competitor_results = competition.results.filter(
+        **{_competitor_field(competition): competitor},
+    ).values_list("pk", "result")
+    old_results = dict(competitor_results)
+    _recalculate_result(competition, competitor)
+    if update_rank:
+        update_results_rank(competition)
+    else:
+        for pk, result in competitor_results.all():
+            clear_results_rank(competition, pk, old_results.get(pk), result)
+        schedule_results_rank_update(competition)
+
+
+def _recalculate_result(competition, competitor):  # noqa
     if (
         competition.competition_type == "questionnaire"
         and type(competitor) == UserAttendance
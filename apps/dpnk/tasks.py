@@ -23,15 +23,17 @@ from urllib.parse import urlparse
 from urllib.request import urlopen
 
 import redis
-from celery import shared_task
-
-import denorm
+from celery import group, shared_task
 
 from dj_fiobank_payments.statement import parse
 
+from django.apps import apps
 from django.conf import settings
 from django.contrib import contenttypes
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError
 from django.urls import reverse
 from django.utils import timezone, translation
 from django.utils.translation import gettext as _
@@ -43,14 +45,16 @@ from celery.utils.log import get_task_logger
 import smmapdfs.email
 import smmapdfs.tasks
 
-from . import email, fakturoid_invoice_gen, mailing, util
+from . import email, fakturoid_invoice_gen, heatmap, mailing, util
 from .models import (
     Campaign,
     CityInCampaign,
     Company,
     Competition,
     Invoice,
+    Phase,
     Team,
+    Trip,
     UserAttendance,
     Voucher,
     payments_to_invoice,
@@ -61,21 +65,116 @@ logger = get_task_logger(__name__)
 
 @shared_task(bind=True)
 def recalculate_competitor_task(self, user_attendance_pk):
-    from . import results
+    from . import denorm_flush, results
 
     user_attendance = UserAttendance.objects.get(pk=user_attendance_pk)
     if user_attendance.team is not None:
-        util.rebuild_denorm_models([user_attendance.team])
-    denorm.flush()
+        util.mark_denorm_dirty([user_attendance.team])
+    denorm_flush.flush(blocking=True)
     results.recalculate_result_competitor_nothread(user_attendance)
 
 
+@shared_task(bind=True)
+def drain_recalculation_queue(self):
+    """
+    Recalculate results of user attendances waiting in the recalculation
+    queue (RESULTS_RECALCULATION_QUEUE setting) in batches,
+    every user attendance at most once per drain.
+    User attendances of failed batch are returned to the queue.
+    """
+    from . import denorm_flush, recalculation_queue, results
+
+    queue = recalculation_queue.get_queue()
+    if queue is None:
+        return 0
+    queue.unschedule()
+    queue.requeue_stale(settings.RESULTS_RECALCULATION_QUEUE_PROCESSING_TIMEOUT)
+    stats = queue.stats()
+    logger.info(
+        "Recalculation queue depth: %s, lag: %.1f s",
+        stats.depth,
+        stats.lag,
+    )
+    recalculated = 0
+    while True:
+        pks = queue.pop(settings.RESULTS_RECALCULATION_QUEUE_BATCH_SIZE)
+        if not pks:
+            break
+        try:
+            user_attendances = UserAttendance.objects.filter(pk__in=pks).select_related(
+                "team"
+            )
+            util.mark_denorm_dirty({ua.team for ua in user_attendances if ua.team_id})
+            denorm_flush.flush(blocking=True)
+            for user_attendance in user_attendances:
+                results.recalculate_result_competitor_nothread(user_attendance)
+        except Exception:
+            queue.requeue(pks)
+            raise
+        queue.ack(pks)
+        recalculated += len(pks)
+    return recalculated
+
+
+@shared_task(bind=True)
+def update_results_rank(self, competition_pk):
+    """Update ranks of the competition scheduled by results.schedule_results_rank_update"""
+    from . import results
+
+    cache.delete(results.RESULTS_RANK_UPDATE_KEY % competition_pk)
+    competition = Competition.objects.filter(pk=competition_pk).first()
+    if competition is not None:
+        results.update_results_rank(competition)
+
+
 @shared_task(bind=True)
 def recalculate_competitions_results(self, pks=None, campaign_slug=""):
     if not pks:
         queryset = Competition.objects.filter(campaign__slug=campaign_slug)
     else:
         queryset = Competition.objects.filter(pk__in=pks)
+    from . import results
+
+    for competition in queryset:
+        results.recalculate_result_competition_parallel(competition)
+    return len(queryset)
+
+
+@shared_task(
+    bind=True,
+    autoretry_for=(DatabaseError,),
+    retry_backoff=True,
+    max_retries=5,
+)
+def recalculate_competition_chunk(self, chunk_pk):
+    """Recalculate results of one chunk of competitors, see CompetitionRecalculation"""
+    from . import results
+
+    try:
+        results.recalculate_competition_chunk(chunk_pk)
+    except Exception as e:
+        # DatabaseError is retried, the recalculation fails after the last retry
+        if not isinstance(e, DatabaseError) or self.request.retries >= self.max_retries:
+            results.fail_competition_chunk(chunk_pk, e)
+        raise
+
+
+@shared_task(bind=True)
+def recalculate_active_competitions_results(self):
+    """
+    Recalculate trip statistics and results of competitions in campaigns
+    with active competition phase.
+    Reconciles results updated incrementally on trip change
+    (RESULTS_INCREMENTAL_UPDATES setting).
+    """
+    from . import bulk_stats
+
+    competition_phases = Phase.get_active().filter(phase_type="competition")
+    for campaign in Campaign.objects.filter(phase__in=competition_phases).distinct():
+        bulk_stats.recalculate_campaign_trip_stats(campaign)
+    queryset = Competition.objects.filter(
+        campaign__phase__in=competition_phases,
+    ).distinct()
     for competition in queryset:
         competition.recalculate_results()
     return len(queryset)
@@ -88,32 +187,61 @@ def update_mailing(self, user_attendance_pks):
         mailing.add_or_update_user_synchronous(user_attendance, ignore_hash=True)
 
 
+def _report_progress(task):
+    """Return progress_callback (e.g. of util.rebuild_denorm_models) reporting to the task state"""
+
+    def progress_callback(done, total):
+        logger.info("%s: processed %s/%s items", task.name, done, total)
+        if task.request.id:
+            task.update_state(state="PROGRESS", meta={"done": done, "total": total})
+
+    return progress_callback
+
+
 @shared_task(bind=True)
 def touch_items(self, pks, object_app_label, object_model_name):
-    for pk in pks:
-        content_type = contenttypes.models.ContentType.objects.get(
-            app_label=object_app_label, model=object_model_name
-        )
-        denorm.models.DirtyInstance.objects.create(
-            content_type=content_type,
-            object_id=pk,
-        )
-        denorm.flush()
+    model = apps.get_model(object_app_label, object_model_name)
+    util.rebuild_denorm_models(
+        model.objects.filter(pk__in=pks),
+        progress_callback=_report_progress(self),
+    )
     return len(pks)
 
 
 @shared_task(bind=True)
 def touch_user_attendances(self, campaign_slug=""):
     queryset = UserAttendance.objects.filter(campaign__slug=campaign_slug)
-    util.rebuild_denorm_models(queryset)
+    util.rebuild_denorm_models(queryset, progress_callback=_report_progress(self))
     return len(queryset)
 
 
 @shared_task(bind=True)
 def touch_teams(self, campaign_slug=""):
-    queryset = Team.objects.filter(campaign__slug=campaign_slug)
-    util.rebuild_denorm_models(queryset)
-    return len(queryset)
+    """
+    Recalculate denormalized fields of all teams of the campaign
+    by one grouped query over the members' denormalized fields.
+    """
+    from . import denorm_flush, results
+
+    # Members' fields have to be up to date
+    denorm_flush.flush(blocking=True)
+    return results.update_team_stats(
+        Team.objects.filter(campaign__slug=campaign_slug),
+    )
+
+
+@shared_task(bind=True)
+def recalculate_campaign_trip_stats(self, campaign_slug=""):
+    """
+    Recalculate denormalized trip statistics of all user attendances and teams
+    of the campaign at once (vectorised alternative of touch_user_attendances
+    and touch_teams)
+    """
+    from . import bulk_stats
+
+    return bulk_stats.recalculate_campaign_trip_stats(
+        Campaign.objects.get(slug=campaign_slug)
+    )
 
 
 @shared_task(bind=True)
@@ -247,107 +375,136 @@ def assign_voucher(self, voucher_pk, userattendance_pk):
     translation.activate(current_language)
 
 
+@shared_task(bind=True)
+def process_trip_track(self, trip_pk):
+    """
+    Parse track of the trip from its GPX/TCX file and compute its length
+    (trips uploaded with TRIP_TRACK_ASYNC_PROCESSING)
+    """
+    from .models.trip import parse_gpx_file
+
+    try:
+        trip = Trip.objects.get(pk=trip_pk, track_processing=True)
+    except Trip.DoesNotExist:
+        return
+    try:
+        track = parse_gpx_file(trip.gpx_file)
+    except ValidationError as e:
+        logger.warning("Track of trip %s can't be parsed: %s", trip_pk, e)
+        Trip.objects.filter(pk=trip_pk).update(track_processing=False)
+        return
+    # File without usable points (e.g. only waypoints) gives empty track
+    trip.track = track or None
+    trip.track_processing = False
+    # The file is processed, don't schedule processing again in trip_pre_save
+    trip._track_processed = True
+    trip.save()
+
+
+@shared_task(bind=True)
+def backfill_simplified_tracks(self, chunk_size=1000):
+    """Compute simplified tracks of trips stored before they were introduced"""
+    from .models.trip import backfill_simplified_tracks
+
+    return backfill_simplified_tracks(
+        chunk_size,
+        progress_callback=_report_progress(self),
+    )
+
+
+@shared_task(bind=True)
+def update_trips_distance(self, chunk_size=1000):
+    """Compute missing distances of trips from their tracks by chunks of chunk_size trips"""
+    trips = Trip.objects.filter(distance=None, track__isnull=False)
+    total = trips.count()
+    progress_callback = _report_progress(self)
+    done = 0
+    last_pk = 0
+    while True:
+        pks = list(
+            trips.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:chunk_size]
+        )
+        if not pks:
+            break
+        done += util.update_trips_distance(Trip.objects.filter(pk__in=pks))
+        last_pk = pks[-1]
+        progress_callback(done, total)
+    return done
+
+
 @shared_task
 def flush_denorm():
-    denorm.flush()
+    from . import denorm_flush
 
+    denorm_flush.flush()
 
-@shared_task
-def generate_anonymized_trips_table(cities_to_export=None, rebuild_anon_table=False):
-    from django.db import connection
 
-    sql = """
-CREATE OR REPLACE FUNCTION has_longer_section_than(line geometry, max_length integer) RETURNS boolean as $$
-    DECLARE
-       cur_length integer;
-    BEGIN
-    FOR i IN 1..ST_NPoints(line)-1
-    LOOP
-       cur_length := ST_distance(ST_PointN(line, i)::geography, ST_PointN(line, i+1)::geography);
-       IF cur_length>max_length THEN
-           RETURN True;
-       END IF;
-    END LOOP;
-    RETURN False;
-END;
-$$ LANGUAGE plpgsql;
-
-drop table if exists dpnk_trip_anonymized;
-CREATE TABLE dpnk_trip_anonymized as select * from (
-   select a.id, a.campaign_id, age_group, sex, commute_mode, city, occupation_id, ST_LineSubstring(a.track, 100/st_length(a.track::geography), 1 - 100/st_length(a.track::geography)) as the_geom from (
-   SELECT dpnk_trip.id, dpnk_userattendance.campaign_id, dpnk_userprofile.age_group, dpnk_userprofile.sex, dpnk_commutemode.slug as commute_mode, dpnk_city.slug as city, dpnk_userprofile.occupation_id, (ST_Dump(dpnk_trip.track::geometry)).geom AS track from dpnk_trip
-      join dpnk_userattendance on (dpnk_trip.user_attendance_id = dpnk_userattendance.id)
-      join dpnk_userprofile on (dpnk_userattendance.userprofile_id = dpnk_userprofile.id)
-      join dpnk_team on (dpnk_userattendance.team_id = dpnk_team.id)
-      join dpnk_subsidiary on (dpnk_team.subsidiary_id = dpnk_subsidiary.id)
-      join dpnk_city on (dpnk_subsidiary.city_id = dpnk_city.id)
-      join dpnk_commutemode on (dpnk_trip.commute_mode_id = dpnk_commutemode.id)
-   ) as a
-      where a.track is not null and st_numpoints(a.track::geometry) > 15 and st_length(a.track::geography)<100000 and st_length(a.track::geography)>200 and not has_longer_section_than(a.track::geometry, 1000)
-) as b where st_numpoints(b.the_geom)>15;
-GRANT ALL PRIVILEGES ON TABLE dpnk_trip_anonymized TO dpnk;
-CREATE INDEX dpnk_trip_anonymized_idx ON dpnk_trip_anonymized USING GIST (the_geom);
+@shared_task
+def generate_anonymized_trips_table(
+    cities_to_export=None, rebuild_anon_table=False, update_anon_table=False
+):
     """
+    Rebuild or incrementally update the table of anonymized trips
+    and export GIS data of the cities in campaign in parallel tasks
+    """
+    from . import anonymized_trips
 
     if rebuild_anon_table:
-        with connection.cursor() as cursor:
-            cursor.execute(sql)
+        anonymized_trips.rebuild_anonymized_trips_table()
+        heatmap.invalidate_tiles()
+    elif update_anon_table:
+        anonymized_trips.update_anonymized_trips_table()
+        heatmap.invalidate_tiles()
 
     if cities_to_export:
-        from uuid import uuid4
-        from subprocess import check_output, STDOUT, CalledProcessError
-        from django.conf import settings
-        from django.core.files.base import File
-        import tempfile
-        import os
-
-        for city_pk in cities_to_export:
-            city = CityInCampaign.objects.get(pk=city_pk)
-            city.data_export_password = str(uuid4())[:30]
-            db_settings = settings.DATABASES["default"]
-
-            with tempfile.TemporaryDirectory() as tmpdirname:
-                os.chdir(tmpdirname)
-                try:
-                    check_output(
-                        [
-                            "pgsql2shp",
-                            "-f",
-                            city.city.slug + ".shp",
-                            "-h",
-                            db_settings["HOST"],
-                            "-p",
-                            db_settings["PORT"],
-                            "-u",
-                            db_settings["USER"],
-                            "-P",
-                            db_settings["PASSWORD"],
-                            db_settings["NAME"],
-                            "SELECT * FROM dpnk_trip_anonymized WHERE city = '"
-                            + city.city.slug
-                            + "'",
-                        ],
-                        stderr=STDOUT,
-                    )
-                except CalledProcessError:
-                    pass
-                check_output(
-                    [
-                        "zip",
-                        city.city.slug + ".zip",
-                        "-e",
-                        "-P",
-                        city.data_export_password,
-                    ]
-                    + [f for f in os.listdir(tmpdirname)],
-                    stderr=STDOUT,
-                )
-                with open(city.city.slug + ".zip", "rb") as fd:
-                    city.data_export.save(
-                        city.city.slug + "-" + city.campaign.slug_identifier + ".zip",
-                        File(fd),
-                    )
-            city.save()
+        CityInCampaign.objects.filter(pk__in=cities_to_export).update(
+            data_export_status="queued",
+            data_export_progress=0,
+        )
+        group(export_city_gis_data.si(pk) for pk in cities_to_export)()
+
+
+@shared_task(
+    bind=True,
+    autoretry_for=(DatabaseError,),
+    retry_backoff=True,
+    max_retries=5,
+)
+def export_city_gis_data(self, city_in_campaign_pk):
+    """Export GIS data of the city in campaign into password protected ZIP"""
+    from . import gis_export
+
+    return gis_export.export_city_gis_data(
+        CityInCampaign.objects.get(pk=city_in_campaign_pk),
+        progress_callback=_report_progress(self),
+    )
+
+
+@shared_task(
+    bind=True,
+    autoretry_for=(DatabaseError,),
+    retry_backoff=True,
+    max_retries=5,
+)
+def generate_city_heatmap(self, city_in_campaign_pk):
+    """
+    Generate raster heatmap of the city in campaign,
+    retries continue from the stored state of the computation
+    """
+    from . import heatmap_raster
+
+    return heatmap_raster.generate_city_heatmap(
+        CityInCampaign.objects.get(pk=city_in_campaign_pk),
+        progress_callback=_report_progress(self),
+    )
+
+
+@shared_task
+def generate_heatmaps(city_in_campaign_pks):
+    """Generate raster heatmaps of the cities in campaign in parallel"""
+    group(generate_city_heatmap.si(pk) for pk in city_in_campaign_pks)()
 
 
 @shared_task(bind=True)
@@ -43,6 +43,32 @@ class TestCampaignMethods(ClearCacheMixin, TestCase):
         )
         self.assertEqual(campaign1.phase("competition"), phase1)
 
+    @override_settings(MEMOIZE_WITH_EXPIRY=True)
+    def test_phase_memoized(self):
+        """
+        Test that memoized phase is reused and invalidated after change
+        """
+        campaign = models.Campaign.objects.create(name="Campaign", slug="campaign")
+        phase = models.Phase.objects.create(
+            campaign=campaign,
+            phase_type="competition",
+            date_to=datetime.date(year=2010, month=11, day=20),
+        )
+        self.assertEqual(campaign.phase("competition"), phase)
+        with self.assertNumQueries(0):
+            self.assertEqual(campaign.phase("competition"), phase)
+
+        phase.date_to = datetime.date(year=2010, month=11, day=30)
+        phase.save()
+        self.assertEqual(
+            campaign.phase("competition").date_to,
+            datetime.date(year=2010, month=11, day=30),
+        )
+
+        phase.delete()
+        with self.assertRaises(models.Phase.DoesNotExist):
+            campaign.phase("competition")
+
     @override_settings(
         FAKE_DATE=datetime.date(year=2010, month=11, day=20),
     )
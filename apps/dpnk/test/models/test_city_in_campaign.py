@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2026 o.s. Auto*Mat
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from dpnk.models import Trip, city_in_campaign
+from dpnk.test.util import ClearCacheMixin
+
+from model_mommy import mommy
+
+from ..mommy_recipes import UserAttendanceRecipe
+
+
+class TestCityInCampaign(ClearCacheMixin, TestCase):
+    def setUp(self):
+        self.user_attendance = UserAttendanceRecipe.make(payment_status="no_admission")
+        self.city_in_campaign = mommy.make(
+            "CityInCampaign",
+            city=self.user_attendance.team.subsidiary.city,
+            campaign=self.user_attendance.campaign,
+        )
+
+    @override_settings(MEMOIZE_WITH_EXPIRY=True)
+    def test_competitor_count_memoized(self):
+        """
+        Test that competitor count is reused and invalidated after change of competitor
+        """
+        self.assertEqual(self.city_in_campaign.competitor_count(), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.city_in_campaign.competitor_count(), 1)
+
+        UserAttendanceRecipe.make(
+            payment_status="done",
+            team=self.user_attendance.team,
+        )
+        self.assertEqual(self.city_in_campaign.competitor_count(), 2)
+
+    def test_invalidate_trip_not_memoized(self):
+        """Test that trip change doesn't look up the campaign without memoization"""
+        trip = mommy.make("Trip", user_attendance=self.user_attendance)
+        trip = Trip.objects.get(pk=trip.pk)
+        with self.assertNumQueries(0):
+            city_in_campaign.invalidate_trip(Trip, trip)
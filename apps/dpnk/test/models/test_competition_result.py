@@ -17,7 +17,12 @@
 # You should have received a copy of the GNU General Public License
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+from unittest.mock import patch
+
 from django.test import TestCase
+from django.test.utils import override_settings
+
+from dpnk import results, tasks
 
 from model_mommy import mommy
 
@@ -272,6 +277,115 @@ class TestCompetitionResult(TestCase):
         )
         self.assertEqual(competition_result.get_sequence_range(), (1, 1))
 
+    def test_update_results_rank(self):
+        """
+        Test that update_results_rank stores the same ranks
+        as get_sequence_range counts
+        """
+        competition = mommy.make(
+            "dpnk.Competition",
+            campaign=self.campaign,
+        )
+        competition_results = [
+            mommy.make(
+                "dpnk.CompetitionResult",
+                competition=competition,
+                result=result,
+            )
+            for result in (3, 2, 2, 1, None)
+        ]
+        expected_ranks = [
+            competition_result.get_sequence_range()
+            for competition_result in competition_results[:4]
+        ]
+        results.update_results_rank(competition)
+        for competition_result in competition_results:
+            competition_result.refresh_from_db()
+        self.assertEqual(
+            [(cr.rank_from, cr.rank_to) for cr in competition_results],
+            [(1, 1), (2, 3), (2, 3), (4, 4), (None, None)],
+        )
+        self.assertEqual(
+            [cr.get_sequence_range() for cr in competition_results[:4]],
+            expected_ranks,
+        )
+
+    def test_clear_results_rank(self):
+        """
+        Test that places of results changed by the result change
+        are counted until the ranks are updated
+        """
+        competition = mommy.make(
+            "dpnk.Competition",
+            campaign=self.campaign,
+        )
+        competition_results = [
+            mommy.make(
+                "dpnk.CompetitionResult",
+                competition=competition,
+                result=result,
+            )
+            for result in (5, 4, 3, 2, 1)
+        ]
+        results.update_results_rank(competition)
+        changed = competition_results[3]
+        competition.results.filter(pk=changed.pk).update(result=4.5)
+        results.clear_results_rank(competition, changed.pk, 2, 4.5)
+        for competition_result in competition_results:
+            competition_result.refresh_from_db()
+        self.assertEqual(
+            [cr.rank_from for cr in competition_results],
+            [1, None, None, None, 5],
+        )
+        self.assertEqual(
+            [cr.get_sequence_range() for cr in competition_results],
+            [(1, 1), (3, 3), (4, 4), (2, 2), (5, 5)],
+        )
+
+        competition.results.filter(pk=changed.pk).update(result=None)
+        results.clear_results_rank(competition, changed.pk, 4.5, None)
+        self.assertEqual(
+            list(
+                competition.results.filter(rank_from__isnull=False).values_list(
+                    "result", flat=True
+                )
+            ),
+            [5],
+        )
+
+    @override_settings(
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        },
+    )
+    def test_schedule_results_rank_update(self):
+        """
+        Test that rank update of the competition is scheduled only once
+        until the scheduled task runs
+        """
+        competition = mommy.make(
+            "dpnk.Competition",
+            campaign=self.campaign,
+        )
+        competition_result = mommy.make(
+            "dpnk.CompetitionResult",
+            competition=competition,
+            result=1,
+        )
+        with patch.object(tasks.update_results_rank, "apply_async") as apply_async:
+            results.schedule_results_rank_update(competition)
+            results.schedule_results_rank_update(competition)
+        apply_async.assert_called_once_with([competition.pk], countdown=60)
+
+        tasks.update_results_rank(competition.pk)
+        competition_result.refresh_from_db()
+        self.assertEqual(
+            (competition_result.rank_from, competition_result.rank_to), (1, 1)
+        )
+        with patch.object(tasks.update_results_rank, "apply_async") as apply_async:
+            results.schedule_results_rank_update(competition)
+        apply_async.assert_called_once_with([competition.pk], countdown=60)
+
     def test_user_attendances_single_user(self):
         """
         Test that user_attendances function works correctly for single_user competition.
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2026 o.s. Auto*Mat
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+from unittest.mock import patch
+
+from django.contrib.gis.geos import LineString, MultiLineString
+from django.test import TestCase
+
+from dpnk import models
+from dpnk.models.trip import backfill_simplified_tracks, simplify_track
+
+from model_mommy import mommy
+
+from ..mommy_recipes import UserAttendanceRecipe
+
+
+class TestSimplifiedTrack(TestCase):
+    def setUp(self):
+        # Zigzag with deviations of 0.0001 degree, that are kept
+        # in medium resolution and dropped in low resolution
+        self.track = MultiLineString(
+            LineString(
+                [(14.4 + i * 0.001, 50.0 + (i % 2) * 0.0001) for i in range(100)]
+            ),
+            srid=4326,
+        )
+        self.trip = mommy.make(
+            "Trip",
+            user_attendance=UserAttendanceRecipe.make(),
+            track=self.track,
+        )
+
+    def test_simplify_track(self):
+        simplified = simplify_track(self.track, 0.001)
+        self.assertEqual(simplified.geom_type, "MultiLineString")
+        self.assertEqual(simplified.num_points, 2)
+        self.assertEqual(simplify_track(self.track, 0.00001).num_points, 100)
+        self.assertIsNone(simplify_track(None, 0.001))
+
+    def test_save(self):
+        """Test, that simplified tracks are computed on save"""
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.track_medium.num_points, 100)
+        self.assertEqual(self.trip.track_low.num_points, 2)
+
+    def test_save_unchanged_track(self):
+        """Test, that simplified tracks are computed only if the track changes"""
+        trip = models.Trip.objects.get(pk=self.trip.pk)
+        with patch.object(
+            models.Trip, "simplify_track", autospec=True
+        ) as simplify_track_mock:
+            trip.save()
+            simplify_track_mock.assert_not_called()
+            trip.track = MultiLineString(
+                LineString((14.4, 50.0), (14.5, 50.1)), srid=4326
+            )
+            trip.save()
+            simplify_track_mock.assert_called_once_with(trip)
+            simplify_track_mock.reset_mock()
+            trip.save()
+            simplify_track_mock.assert_not_called()
+
+    def test_save_missing_simplified_tracks(self):
+        """Test, that missing simplified tracks are computed on save"""
+        models.Trip.objects.update(track_medium=None, track_low=None)
+        trip = models.Trip.objects.get(pk=self.trip.pk)
+        trip.save()
+        trip.refresh_from_db()
+        self.assertEqual(trip.track_medium.num_points, 100)
+        self.assertEqual(trip.track_low.num_points, 2)
+
+    def test_backfill_simplified_tracks(self):
+        models.Trip.objects.update(track_medium=None, track_low=None)
+        progress = []
+        self.assertEqual(
+            backfill_simplified_tracks(
+                chunk_size=1,
+                progress_callback=lambda done, total: progress.append(done),
+            ),
+            1,
+        )
+        self.assertEqual(progress, [1])
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.track_medium.num_points, 100)
+        self.assertEqual(self.trip.track_low.num_points, 2)
+        self.assertEqual(backfill_simplified_tracks(), 0)
@@ -0,0 +1,99 @@
+"""
+Synthetic campaign of configurable size for the results benchmarks.
+
+The size is read from environment variables:
+DPNK_BENCHMARK_USERS, DPNK_BENCHMARK_TEAMS, DPNK_BENCHMARK_SUBSIDIARIES,
+DPNK_BENCHMARK_DAYS and DPNK_BENCHMARK_TRIPS_PER_DAY (0 to 2).
+"""
+import datetime
+import os
+from collections import namedtuple
+from itertools import cycle
+
+import denorm
+
+from django.contrib.auth.models import User
+
+from model_mommy import mommy
+
+from dpnk import models
+
+SyntheticCampaignSize = namedtuple(
+    "SyntheticCampaignSize",
+    ("users", "teams", "subsidiaries", "days", "trips_per_day"),
+)
+
+SyntheticCampaign = namedtuple(
+    "SyntheticCampaign",
+    ("campaign", "phase", "size", "user_attendances", "teams"),
+)
+
+START_DATE = datetime.date(2021, 5, 3)
+
+
+def get_size():
+    return SyntheticCampaignSize(
+        users=int(os.environ.get("DPNK_BENCHMARK_USERS", 40)),
+        teams=int(os.environ.get("DPNK_BENCHMARK_TEAMS", 8)),
+        subsidiaries=int(os.environ.get("DPNK_BENCHMARK_SUBSIDIARIES", 4)),
+        days=int(os.environ.get("DPNK_BENCHMARK_DAYS", 10)),
+        trips_per_day=int(os.environ.get("DPNK_BENCHMARK_TRIPS_PER_DAY", 2)),
+    )
+
+
+def build_synthetic_campaign(campaign, commute_modes, size=None):
+    """
+    Fill the campaign with subsidiaries (of two companies), teams and paid
+    user attendances with trips on every day of the competition phase.
+    Trips are inserted by bulk_create and the denormalized fields are flushed.
+    """
+    size = size or get_size()
+    phase = mommy.make(
+        "dpnk.Phase",
+        campaign=campaign,
+        phase_type="competition",
+        date_from=START_DATE,
+        date_to=START_DATE + datetime.timedelta(days=size.days - 1),
+    )
+    city = mommy.make("dpnk.City", name="Benchmark city")
+    companies = mommy.make("dpnk.Company", _quantity=2)
+    subsidiaries = [
+        mommy.make("dpnk.Subsidiary", company=company, city=city)
+        for company, i in zip(cycle(companies), range(size.subsidiaries))
+    ]
+    teams = [
+        mommy.make("dpnk.Team", campaign=campaign, subsidiary=subsidiary)
+        for subsidiary, i in zip(cycle(subsidiaries), range(size.teams))
+    ]
+    user_attendances = [
+        mommy.make(
+            "dpnk.UserAttendance",
+            campaign=campaign,
+            team=team,
+            approved_for_team="approved",
+            personal_data_opt_in=True,
+            userprofile__sex="female",
+            transactions=[mommy.make("dpnk.Payment", status=99)],
+        )
+        for team, i in zip(cycle(teams), range(size.users))
+    ]
+    User.objects.filter(
+        userprofile__userattendance_set__in=user_attendances,
+    ).update(first_name="Foo", last_name="Bar", email="foo@bar.cz")
+
+    directions = ("trip_to", "trip_from")[: size.trips_per_day]
+    commute_modes = cycle(commute_modes)
+    models.Trip.objects.bulk_create(
+        models.Trip(
+            user_attendance=user_attendance,
+            date=START_DATE + datetime.timedelta(days=day),
+            direction=direction,
+            commute_mode=next(commute_modes),
+            distance=(user_attendance.pk + day) % 20 + 1,
+        )
+        for user_attendance in user_attendances
+        for day in range(size.days)
+        for direction in directions
+    )
+    denorm.flush()
+    return SyntheticCampaign(campaign, phase, size, user_attendances, teams)
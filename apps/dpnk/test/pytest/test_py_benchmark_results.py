@@ -0,0 +1,148 @@
+"""
+Benchmarks of the results engine on a synthetic campaign.
+
+Run them against local PostGIS by ./benchmark.sh, the size of the campaign
+is configured by environment variables (see dpnk.test.pytest.synthetic).
+The time and the number of queries (extra_info) of every benchmark
+are saved as JSON, so they can be compared between commits.
+"""
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+import denorm
+from denorm.models import DirtyInstance
+import pytest
+
+from model_mommy import mommy
+
+from dpnk import models, results
+from dpnk.test.pytest.synthetic import build_synthetic_campaign
+
+COMPETITOR_TYPES = ("single_user", "team", "company", "subsidiary")
+COMPETITION_TYPES = ("length", "frequency")
+
+
+@pytest.fixture()
+def denorm_triggers(db):
+    call_command("denorm_init")
+    yield
+    call_command("denorm_drop")
+
+
+@pytest.fixture()
+def synthetic_campaign(
+    campaign, bicycle, by_foot, by_other_vehicle, denorm_triggers, settings
+):
+    synthetic_campaign = build_synthetic_campaign(
+        campaign,
+        [bicycle, by_foot, bicycle, by_other_vehicle],
+    )
+    settings.FAKE_DATE = synthetic_campaign.phase.date_to
+    return synthetic_campaign
+
+
+def make_competition(synthetic_campaign, competitor_type, competition_type):
+    competition = mommy.make(
+        "dpnk.Competition",
+        campaign=synthetic_campaign.campaign,
+        competitor_type=competitor_type,
+        competition_type=competition_type,
+        date_from=synthetic_campaign.phase.date_from,
+        date_to=synthetic_campaign.phase.date_to,
+        is_public=True,
+        commute_modes=models.CommuteMode.objects.filter(
+            slug__in=("bicycle", "by_foot")
+        ),
+    )
+    results.recalculate_result_competition(competition)
+    return competition
+
+
+def run_benchmark(benchmark, synthetic_campaign, function, *args):
+    """
+    Count queries of one function call, store them together with the campaign size
+    to the benchmark extra_info and benchmark the function.
+    """
+    with CaptureQueriesContext(connection) as context:
+        function(*args)
+    benchmark.extra_info["queries"] = len(context.captured_queries)
+    benchmark.extra_info["size"] = synthetic_campaign.size._asdict()
+    return benchmark(function, *args)
+
+
+@pytest.mark.parametrize("competition_type", COMPETITION_TYPES)
+@pytest.mark.parametrize("competitor_type", COMPETITOR_TYPES)
+def test_recalculate_result_competition(
+    benchmark, synthetic_campaign, competitor_type, competition_type
+):
+    benchmark.group = "recalculate_result_competition"
+    competition = make_competition(
+        synthetic_campaign, competitor_type, competition_type
+    )
+    run_benchmark(
+        benchmark,
+        synthetic_campaign,
+        results.recalculate_result_competition,
+        competition,
+    )
+    assert competition.results.exists()
+
+
+@pytest.mark.parametrize("competitor_type", COMPETITOR_TYPES)
+def test_recalculate_result_competitor_nothread(
+    benchmark, synthetic_campaign, competitor_type
+):
+    benchmark.group = "recalculate_result_competitor_nothread"
+    for competition_type in COMPETITION_TYPES:
+        make_competition(synthetic_campaign, competitor_type, competition_type)
+    user_attendance = synthetic_campaign.user_attendances[0]
+    run_benchmark(
+        benchmark,
+        synthetic_campaign,
+        results.recalculate_result_competitor_nothread,
+        user_attendance,
+    )
+
+
+def test_get_competitions_with_info(benchmark, synthetic_campaign):
+    benchmark.group = "get_competitions_with_info"
+    for competitor_type in COMPETITOR_TYPES:
+        for competition_type in COMPETITION_TYPES:
+            make_competition(synthetic_campaign, competitor_type, competition_type)
+    user_attendance = synthetic_campaign.user_attendances[0]
+    competitions = run_benchmark(
+        benchmark,
+        synthetic_campaign,
+        lambda: list(results.get_competitions_with_info(user_attendance)),
+    )
+    assert competitions
+
+
+@pytest.mark.parametrize("model", (models.UserAttendance, models.Team))
+def test_denorm_flush(benchmark, synthetic_campaign, model):
+    benchmark.group = "denorm_flush"
+    content_type = ContentType.objects.get_for_model(model)
+    pks = [
+        obj.pk
+        for obj in (
+            synthetic_campaign.user_attendances
+            if model is models.UserAttendance
+            else synthetic_campaign.teams
+        )
+    ]
+
+    def mark_dirty():
+        DirtyInstance.objects.bulk_create(
+            DirtyInstance(content_type=content_type, object_id=pk) for pk in pks
+        )
+        return (), {}
+
+    with CaptureQueriesContext(connection) as context:
+        mark_dirty()
+        denorm.flush()
+    benchmark.extra_info["queries"] = len(context.captured_queries)
+    benchmark.extra_info["size"] = synthetic_campaign.size._asdict()
+    benchmark.pedantic(denorm.flush, setup=mark_dirty, rounds=5)
+    assert not DirtyInstance.objects.exists()
@@ -0,0 +1,41 @@
+"""
+Micro-benchmark of track length computation: per-segment geopy calls
+(the former implementation of util.get_multilinestring_length)
+against the vectorised Vincenty's formula.
+
+Run by ./benchmark.sh together with the results engine benchmarks.
+"""
+import geopy.distance
+import numpy as np
+import pytest
+
+from dpnk import util
+
+TRACK_POINTS = 10000
+
+
+@pytest.fixture()
+def track():
+    """Random walk of TRACK_POINTS points around Prague"""
+    random = np.random.default_rng(0)
+    points = np.cumsum(random.normal(0, 0.0005, (TRACK_POINTS, 2)), axis=0)
+    return [[tuple(point) for point in points + (14.4, 50.0)]]
+
+
+def geopy_length(track):
+    return sum(
+        geopy.distance.vincenty((lat1, lon1), (lat2, lon2)).km
+        for linestring in track
+        for (lon1, lat1), (lon2, lat2) in util.pairwise(linestring)
+    )
+
+
+def test_geopy_length(benchmark, track):
+    benchmark.group = "track_length"
+    benchmark(geopy_length, track)
+
+
+def test_vectorised_length(benchmark, track):
+    benchmark.group = "track_length"
+    length = benchmark(util.get_multilinestring_length, track)
+    assert length == pytest.approx(geopy_length(track), abs=0.001)
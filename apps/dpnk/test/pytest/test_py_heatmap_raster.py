@@ -0,0 +1,69 @@
+import io
+
+import numpy as np
+
+from PIL import Image
+
+from dpnk import heatmap_raster
+
+
+def test_lonlat_to_pixels():
+    x, y = heatmap_raster.lonlat_to_pixels(
+        [-180, 0, 180], [85.05112878, 0, -85.05112878], 0
+    )
+    np.testing.assert_allclose(x, [0, 128, 256])
+    np.testing.assert_allclose(y, [0, 128, 256], atol=1e-6)
+
+
+def test_get_tile_range():
+    """Test, that tiles of Prague at zoom 12 are returned"""
+    extent = (14.42, 50.08, 14.43, 50.085)
+    assert heatmap_raster.get_tile_range(extent, 12) == [2212, 1387, 2212, 1387]
+    assert heatmap_raster.get_tile_range((-180, -90, 180, 90), 1) == [0, 0, 1, 1]
+
+
+def test_rasterize_segments():
+    grid = np.zeros((4, 6), dtype=np.uint32)
+    heatmap_raster.rasterize_segments(
+        grid,
+        np.array([0.5, 0.5, 5.5]),
+        np.array([0.5, 3.5, 0.5]),
+        np.array([4.5, 0.5, 5.5]),
+        np.array([0.5, 3.5, 0.5]),
+    )
+    np.testing.assert_array_equal(
+        grid,
+        [
+            [1, 1, 1, 1, 0, 1],
+            [0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0],
+            [1, 0, 0, 0, 0, 0],
+        ],
+    )
+
+
+def test_rasterize_segments_outside():
+    """Test, that parts of segments outside of the grid are dropped"""
+    grid = np.zeros((2, 2), dtype=np.uint32)
+    heatmap_raster.rasterize_segments(
+        grid,
+        np.array([-2.5]),
+        np.array([1.5]),
+        np.array([3.5]),
+        np.array([1.5]),
+    )
+    np.testing.assert_array_equal(grid, [[0, 0], [1, 1]])
+
+
+def test_iter_tiles():
+    grid = np.zeros((256, 512), dtype=np.uint32)
+    grid[10, 300] = 5
+    grid[10, 301] = 1
+    tiles = list(heatmap_raster.iter_tiles(grid, [10, 20, 11, 20]))
+    assert [(x, y) for x, y, image in tiles] == [(11, 20)]
+    image = np.asarray(Image.open(io.BytesIO(tiles[0][2])))
+    assert image.shape == (256, 256, 4)
+    assert image[10, 44].tolist() == [255, 255, 255, 255]
+    assert 0 < image[10, 45, 3] < 255
+    assert image[0, 0, 3] == 0
+    assert list(heatmap_raster.iter_tiles(np.zeros((256, 256)), [0, 0, 0, 0])) == []
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2026 o.s. Auto*Mat
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+import datetime
+
+from django.contrib.gis.geos import LineString, MultiLineString
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from dpnk import anonymized_trips, models
+
+from model_mommy import mommy
+
+from .mommy_recipes import UserAttendanceRecipe
+
+
+def make_track(section_length=0.0014, points=20):
+    """Track with sections of section_length degrees of longitude (0.0014 is about 100 m)"""
+    return MultiLineString(
+        LineString([(14.4 + i * section_length, 50.0) for i in range(points)]),
+        srid=4326,
+    )
+
+
+def get_anonymized_trip_ids():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT id FROM dpnk_trip_anonymized ORDER BY id")
+        return [row[0] for row in cursor.fetchall()]
+
+
+@override_settings(ANONYMIZED_TRIPS_TABLE_GRANT_ROLE="")
+class AnonymizedTripsTests(TestCase):
+    fixtures = ["commute_mode"]
+
+    def setUp(self):
+        self.user_attendance = UserAttendanceRecipe.make()
+        self.trip = self.make_trip(datetime.date(2019, 5, 1), make_track())
+
+    def make_trip(self, date, track):
+        return mommy.make(
+            "Trip",
+            user_attendance=self.user_attendance,
+            date=date,
+            direction="trip_to",
+            track=track,
+        )
+
+    def test_rebuild(self):
+        # Trips with a GPS jump, too short or without track are left out
+        self.make_trip(
+            datetime.date(2019, 5, 2),
+            MultiLineString(
+                LineString(
+                    [(14.4 + i * 0.0014, 50.0) for i in range(10)]
+                    + [(14.5 + i * 0.0014, 50.0) for i in range(10)]
+                ),
+                srid=4326,
+            ),
+        )
+        self.make_trip(datetime.date(2019, 5, 3), make_track(section_length=0.0001))
+        self.make_trip(datetime.date(2019, 5, 4), None)
+
+        self.assertEqual(anonymized_trips.rebuild_anonymized_trips_table(), 1)
+        self.assertEqual(get_anonymized_trip_ids(), [self.trip.pk])
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT city, ST_Length(the_geom::geography) FROM dpnk_trip_anonymized",
+            )
+            city, length = cursor.fetchone()
+        self.assertEqual(city, self.user_attendance.team.subsidiary.city.slug)
+        # Track is shortened by 100 m on both ends
+        self.assertAlmostEqual(
+            length, self.trip.track.transform(3035, clone=True).length - 200, delta=5
+        )
+
+        # Repeated rebuild replaces the table
+        self.make_trip(datetime.date(2019, 5, 5), make_track())
+        self.assertEqual(anonymized_trips.rebuild_anonymized_trips_table(), 2)
+        self.assertEqual(
+            anonymized_trips.get_table_columns("dpnk_trip_anonymized_new"), None
+        )
+        self.assertEqual(
+            anonymized_trips.get_table_columns("dpnk_trip_anonymized_old"), None
+        )
+
+    def test_update(self):
+        """Test, that only changed and deleted trips are updated"""
+        anonymized_trips.rebuild_anonymized_trips_table()
+        new_trip = self.make_trip(datetime.date(2019, 5, 2), make_track())
+        self.trip.delete()
+        self.assertEqual(anonymized_trips.update_anonymized_trips_table(), 1)
+        self.assertEqual(get_anonymized_trip_ids(), [new_trip.pk])
+
+        # Changed trip is replaced
+        new_trip.track = make_track(points=30)
+        new_trip.save()
+        self.assertEqual(anonymized_trips.update_anonymized_trips_table(), 1)
+        self.assertEqual(get_anonymized_trip_ids(), [new_trip.pk])
+
+    @override_settings(ANONYMIZED_TRIPS_UPDATE_MARGIN=600)
+    def test_update_since_last_run(self):
+        """
+        Test, that trips saved before the start of the last update
+        (but committed after it) are updated within the margin
+        """
+        anonymized_trips.rebuild_anonymized_trips_table()
+        late_trip = self.make_trip(datetime.date(2019, 5, 2), make_track())
+        old_trip = self.make_trip(datetime.date(2019, 5, 3), make_track())
+        models.Trip.objects.filter(pk=late_trip.pk).update(
+            updated=timezone.now() - datetime.timedelta(minutes=5),
+        )
+        models.Trip.objects.filter(pk=old_trip.pk).update(
+            updated=timezone.now() - datetime.timedelta(days=1),
+        )
+        self.assertEqual(anonymized_trips.update_anonymized_trips_table(), 2)
+        self.assertEqual(get_anonymized_trip_ids(), [self.trip.pk, late_trip.pk])
+
+    def test_update_without_table(self):
+        """Test, that the table is built if it doesn't exist"""
+        self.assertEqual(anonymized_trips.update_anonymized_trips_table(), 1)
+        self.assertEqual(get_anonymized_trip_ids(), [self.trip.pk])
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2026 o.s. Auto*Mat
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+import datetime
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from django.contrib.gis.geos import Point
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from dpnk import gis_export, tasks
+
+import fiona
+
+import pyzipper
+
+from model_mommy import mommy
+
+from .mommy_recipes import UserAttendanceRecipe
+from .test_anonymized_trips import make_track
+
+
+@override_settings(ANONYMIZED_TRIPS_TABLE_GRANT_ROLE="")
+class GisExportTests(TestCase):
+    fixtures = ["commute_mode"]
+
+    def setUp(self):
+        user_attendance = UserAttendanceRecipe.make()
+        self.trip = mommy.make(
+            "Trip",
+            user_attendance=user_attendance,
+            date=datetime.date(2019, 5, 1),
+            direction="trip_to",
+            track=make_track(),
+        )
+        self.city = user_attendance.team.subsidiary.city
+        self.city_in_campaign = mommy.make(
+            "CityInCampaign",
+            city=self.city,
+            campaign=user_attendance.campaign,
+        )
+
+    def get_exported_files(self):
+        self.city_in_campaign.refresh_from_db()
+        self.assertEqual(self.city_in_campaign.data_export_status, "done")
+        self.assertEqual(self.city_in_campaign.data_export_progress, 100)
+        self.assertEqual(len(self.city_in_campaign.data_export_password), 30)
+        with pyzipper.AESZipFile(self.city_in_campaign.data_export) as archive:
+            self.assertTrue(all(info.flag_bits & 0x1 for info in archive.infolist()))
+            with self.assertRaises(RuntimeError):
+                archive.read(archive.namelist()[0])
+            for name in archive.namelist():
+                archive.read(
+                    name, pwd=self.city_in_campaign.data_export_password.encode()
+                )
+            return archive.namelist()
+
+    def test_export(self):
+        tasks.generate_anonymized_trips_table(
+            cities_to_export=[self.city_in_campaign.pk],
+            rebuild_anon_table=True,
+        )
+        self.assertEqual(
+            self.get_exported_files(),
+            [
+                self.city.slug + extension
+                for extension in (".cpg", ".dbf", ".prj", ".shp", ".shx")
+            ],
+        )
+
+    @override_settings(CITY_DATA_EXPORT_DRIVER="GPKG")
+    def test_export_gpkg(self):
+        tasks.generate_anonymized_trips_table(rebuild_anon_table=True)
+        self.assertEqual(gis_export.export_city_gis_data(self.city_in_campaign), 1)
+        self.assertEqual(self.get_exported_files(), [self.city.slug + ".gpkg"])
+
+    def test_export_failed(self):
+        tasks.generate_anonymized_trips_table(rebuild_anon_table=True)
+        with patch.object(
+            gis_export, "write_city_trips", side_effect=Exception("Export failed")
+        ):
+            with self.assertRaises(Exception):
+                gis_export.export_city_gis_data(self.city_in_campaign)
+        self.city_in_campaign.refresh_from_db()
+        self.assertEqual(self.city_in_campaign.data_export_status, "failed")
+        self.assertFalse(self.city_in_campaign.data_export)
+
+    def test_write_clipped_trips(self):
+        tasks.generate_anonymized_trips_table(rebuild_anon_table=True)
+        with tempfile.TemporaryDirectory() as work_dir:
+            outputs = [
+                (os.path.join(work_dir, "praha.gpkg"), "praha"),
+                (os.path.join(work_dir, "brno.gpkg"), "brno"),
+            ]
+            self.assertEqual(
+                gis_export.write_clipped_trips(
+                    [Point(14.41, 50.0, srid=4326), Point(16.6, 49.2, srid=4326)],
+                    200,
+                    outputs,
+                ),
+                [1, 0],
+            )
+            with fiona.open(outputs[0][0], layer="praha") as layer:
+                (feature,) = list(layer)
+            self.assertEqual(feature.properties["id"], self.trip.pk)
+            (line,) = feature.geometry.coordinates
+            # Track is clipped by 200 m buffer around the point (0.0028 degrees)
+            self.assertAlmostEqual(line[0][0], 14.4072, places=3)
+            self.assertAlmostEqual(line[-1][0], 14.4128, places=3)
+            with fiona.open(outputs[1][0], layer="brno") as layer:
+                self.assertEqual(len(layer), 0)
+
+    def test_write_encrypted_zip(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            data_dir = os.path.join(work_dir, "data")
+            os.mkdir(data_dir)
+            with open(os.path.join(data_dir, "praha.csv"), "w") as data_file:
+                data_file.write("id,distance\n1,2.5\n")
+            archive_path = os.path.join(work_dir, "praha.zip")
+            gis_export.write_encrypted_zip(archive_path, "secret", data_dir)
+            with pyzipper.AESZipFile(archive_path) as archive:
+                (info,) = archive.infolist()
+                self.assertEqual(info.filename, "praha.csv")
+                # AES-256
+                self.assertEqual(info.wz_aes_strength, 3)
+                with self.assertRaises(RuntimeError):
+                    archive.read("praha.csv")
+                self.assertEqual(
+                    archive.read("praha.csv", pwd=b"secret"),
+                    b"id,distance\n1,2.5\n",
+                )
+
+    @unittest.skipUnless(shutil.which("7z"), "7-Zip is not installed")
+    def test_write_encrypted_zip_7zip(self):
+        """Test that the archive can be extracted by 7-Zip"""
+        with tempfile.TemporaryDirectory() as work_dir:
+            data_dir = os.path.join(work_dir, "data")
+            os.mkdir(data_dir)
+            with open(os.path.join(data_dir, "praha.csv"), "w") as data_file:
+                data_file.write("id,distance\n1,2.5\n")
+            archive_path = os.path.join(work_dir, "praha.zip")
+            gis_export.write_encrypted_zip(archive_path, "secret", data_dir)
+            output_dir = os.path.join(work_dir, "output")
+            subprocess.run(
+                ["7z", "x", "-psecret", "-o" + output_dir, archive_path],
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+            with open(os.path.join(output_dir, "praha.csv")) as data_file:
+                self.assertEqual(data_file.read(), "id,distance\n1,2.5\n")
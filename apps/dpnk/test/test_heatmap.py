@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2026 o.s. Auto*Mat
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+import os
+import tempfile
+import zipfile
+from unittest.mock import patch
+
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import override_settings
+
+from dpnk import heatmap, heatmap_raster
+
+from model_mommy import mommy
+
+LOCMEM_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+}
+# Tile of Prague center at zoom 12
+TILE_URL = "/heatmap/testing-campaign/praha/12/2212/1387.mvt"
+
+
+def create_anonymized_trips_table():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TABLE dpnk_trip_anonymized "
+            "(id integer, campaign_id integer, commute_mode varchar, "
+            "city varchar, the_geom geometry)",
+        )
+        cursor.execute(
+            "INSERT INTO dpnk_trip_anonymized VALUES "
+            "(1, 339, 'bicycle', 'praha', "
+            "ST_GeomFromText('LINESTRING(14.42 50.08, 14.43 50.085)', 4326)), "
+            "(2, 339, 'bicycle', 'praha', "
+            "ST_GeomFromText('LINESTRING(14.43 50.085, 14.42 50.08)', 4326)), "
+            "(2, 339, 'bicycle', 'praha', "
+            "ST_GeomFromText('LINESTRING(14.42 50.07, 14.42 50.08)', 4326))",
+        )
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class HeatmapTileViewTests(TestCase):
+    fixtures = ["sites", "campaign"]
+
+    def setUp(self):
+        self.client = Client(HTTP_HOST="testing-campaign.testserver")
+        heatmap.get_tiles_cache().clear()
+
+    def create_anonymized_trips_table(self):
+        create_anonymized_trips_table()
+
+    def test_no_table(self):
+        response = self.client.get(TILE_URL)
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalid_tile(self):
+        self.create_anonymized_trips_table()
+        response = self.client.get("/heatmap/testing-campaign/12/5000/1387.mvt")
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get("/heatmap/testing-campaign/1/0/0.mvt")
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get("/heatmap/nonexistent/12/2212/1387.mvt")
+        self.assertEqual(response.status_code, 404)
+
+    def test_tile(self):
+        self.create_anonymized_trips_table()
+        response = self.client.get(TILE_URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], heatmap.TILE_CONTENT_TYPE)
+        self.assertIn(b"trips", response.content)
+        self.assertIn(b"bicycle", response.content)
+        self.assertIn("max-age", response["Cache-Control"])
+
+        # Other city and other tile are empty
+        response = self.client.get("/heatmap/testing-campaign/brno/12/2212/1387.mvt")
+        self.assertEqual(response.content, b"")
+        response = self.client.get("/heatmap/testing-campaign/12/2213/1387.mvt")
+        self.assertEqual(response.content, b"")
+
+    def test_tile_cache(self):
+        """Test, that tiles are cached until the tiles are invalidated"""
+        self.create_anonymized_trips_table()
+        tile = self.client.get(TILE_URL).content
+        with patch("dpnk.heatmap.render_tile") as render_tile:
+            self.assertEqual(self.client.get(TILE_URL).content, tile)
+            render_tile.assert_not_called()
+            render_tile.return_value = b"new tile"
+            heatmap.invalidate_tiles()
+            self.assertEqual(self.client.get(TILE_URL).content, b"new tile")
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES,
+    HEATMAP_RASTER_ZOOMS=[12, 13],
+    HEATMAP_RASTER_CHECKPOINT_ROWS=1,
+)
+class CityHeatmapTests(TestCase):
+    fixtures = ["sites", "campaign"]
+
+    def setUp(self):
+        heatmap.get_tiles_cache().clear()
+        work_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(work_dir.cleanup)
+        override = override_settings(HEATMAP_RASTER_WORK_DIR=work_dir.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        create_anonymized_trips_table()
+        self.city_in_campaign = mommy.make(
+            "CityInCampaign",
+            city=mommy.make("City", slug="praha"),
+            campaign_id=339,
+        )
+
+    def test_generate_city_heatmap(self):
+        self.assertEqual(heatmap_raster.generate_city_heatmap(self.city_in_campaign), 2)
+        with zipfile.ZipFile(self.city_in_campaign.heatmap_export) as archive:
+            self.assertEqual(
+                sorted(archive.namelist()),
+                ["12/2212/1387.png", "13/4424/2775.png"],
+            )
+        self.assertFalse(
+            os.path.exists(heatmap_raster.CityHeatmap(self.city_in_campaign).work_dir)
+        )
+
+    def test_resume(self):
+        """Test, that interrupted computation continues from the stored state"""
+        city_heatmap = heatmap_raster.CityHeatmap(self.city_in_campaign)
+        self.assertTrue(city_heatmap.start())
+        with patch.object(
+            heatmap_raster.CityHeatmap,
+            "add_lines",
+            side_effect=[None, Exception("Interrupted")],
+        ):
+            with self.assertRaises(Exception):
+                city_heatmap.process_trips()
+
+        city_heatmap = heatmap_raster.CityHeatmap(self.city_in_campaign)
+        self.assertTrue(city_heatmap.start())
+        self.assertEqual(city_heatmap.last_id, 1)
+        self.assertEqual(city_heatmap.process_trips(), 2)
+
+        # Stored state is not used after the anonymized trips table is rebuilt
+        city_heatmap.save_state()
+        heatmap.invalidate_tiles()
+        city_heatmap = heatmap_raster.CityHeatmap(self.city_in_campaign)
+        self.assertTrue(city_heatmap.start())
+        self.assertEqual(city_heatmap.last_id, 0)
+
+    def test_no_trips(self):
+        self.city_in_campaign.city.slug = "brno"
+        self.assertEqual(heatmap_raster.generate_city_heatmap(self.city_in_campaign), 0)
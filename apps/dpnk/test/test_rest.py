@@ -17,15 +17,20 @@
 # You should have received a copy of the GNU General Public License
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+import base64
 import datetime, time
+from unittest.mock import patch
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.contrib.gis.geos import LineString, MultiLineString
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.test.utils import override_settings
 from django.urls import reverse
 
-from dpnk import models, util
+from dpnk import models, tasks, util
 from dpnk.models import Team, UserAttendance, UserProfile, CompanyAdmin, Competition
 from dpnk.test.util import print_response  # noqa
 
@@ -252,6 +257,265 @@ class GPXTests(TestCase):
         trip.refresh_from_db()
         self.assertEqual(trip.distance, 13.32)
 
+    @override_settings(TRIP_TRACK_ASYNC_PROCESSING=True)
+    def test_gpx_post_async_processing(self):
+        with open("apps/dpnk/test_files/modranska-rokle.gpx", "rb") as gpxfile:
+            post_data = {
+                "trip_date": "2010-11-19",
+                "direction": "trip_to",
+                "sourceApplication": "test_app",
+                "file": gpxfile,
+            }
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = self.client.post(reverse("gpxfile-list"), post_data)
+        self.assertEqual(response.status_code, 201)
+        trip = models.Trip.objects.get(date=datetime.date(2010, 11, 19))
+        self.assertTrue(trip.track_processing)
+        self.assertIsNone(trip.track)
+        for callback in callbacks:
+            callback()
+        trip.refresh_from_db()
+        self.assertFalse(trip.track_processing)
+        self.assertEqual(trip.distance, 13.32)
+
+    @override_settings(TRIP_TRACK_ASYNC_PROCESSING=True)
+    def test_gpx_post_async_processing_no_track(self):
+        """Test, that file without track points is processed only once"""
+        gpxfile = SimpleUploadedFile(
+            "waypoints.gpx",
+            b'<?xml version="1.0"?>'
+            b'<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">'
+            b'<wpt lat="50.0" lon="14.4"/>'
+            b"</gpx>",
+        )
+        post_data = {
+            "trip_date": "2010-11-19",
+            "direction": "trip_to",
+            "sourceApplication": "test_app",
+            "file": gpxfile,
+        }
+        response = self.client.post(reverse("gpxfile-list"), post_data)
+        self.assertEqual(response.status_code, 201)
+        trip = models.Trip.objects.get(date=datetime.date(2010, 11, 19))
+        self.assertTrue(trip.track_processing)
+        with patch.object(tasks.process_trip_track, "apply_async") as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                tasks.process_trip_track(trip.pk)
+        apply_async.assert_not_called()
+        trip.refresh_from_db()
+        self.assertFalse(trip.track_processing)
+        self.assertIsNone(trip.track)
+
+    @override_settings(REST_TRACK_GEOJSON_PRECISION=7)
+    def test_gpx_post_simplified_track(self):
+        """Test, that simplified tracks are stored and returned by resolution"""
+        with open("apps/dpnk/test_files/modranska-rokle.gpx", "rb") as gpxfile:
+            post_data = {
+                "trip_date": "2010-11-19",
+                "direction": "trip_to",
+                "sourceApplication": "test_app",
+                "file": gpxfile,
+            }
+            response = self.client.post(reverse("gpxfile-list"), post_data)
+        self.assertEqual(response.status_code, 201)
+        trip = models.Trip.objects.get(date=datetime.date(2010, 11, 19))
+        self.assertEqual(trip.track.num_points, 455)
+        self.assertLess(trip.track_low.num_points, trip.track_medium.num_points)
+        self.assertLess(trip.track_medium.num_points, trip.track.num_points)
+
+        address = reverse("gpxfile-detail", kwargs={"pk": trip.pk})
+        response = self.client.get(address, {"resolution": "low"})
+        self.assertEqual(
+            response.json()["track"]["coordinates"],
+            [[list(point) for point in line] for line in trip.track_low.coords],
+        )
+        response = self.client.get(address, {"tolerance": "0.001"})
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(
+            len(response.json()["track"]["coordinates"][0]),
+            trip.track.num_points,
+        )
+
+    def test_gpx_get_resolution_not_computed(self):
+        """Test, that full track is returned if simplified tracks are missing"""
+        address = reverse("gpxfile-detail", kwargs={"pk": 1})
+        response = self.client.get(address, {"resolution": "medium"})
+        self.assertEqual(
+            response.json()["track"]["coordinates"],
+            [[[15.567627, 50.680797], [14.710693, 50.212064]]],
+        )
+
+    @override_settings(REST_TRACK_GEOJSON_PRECISION=1)
+    def test_gpx_get_precision(self):
+        """Test, that track is rendered with configured precision"""
+        address = reverse("gpxfile-detail", kwargs={"pk": 1})
+        response = self.client.get(address)
+        self.assertEqual(
+            response.json()["track"],
+            {
+                "type": "MultiLineString",
+                "coordinates": [[[15.6, 50.7], [14.7, 50.2]]],
+            },
+        )
+
+    def test_gpx_get_resolution_invalid(self):
+        address = reverse("gpxfile-detail", kwargs={"pk": 1})
+        response = self.client.get(address, {"resolution": "huge"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(address, {"tolerance": "1"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_gpx_post_bulk(self):
+        """Test, that trips are upserted at once with status of every trip"""
+        trip = mommy.make(
+            "Trip",
+            date=datetime.date(2010, 11, 19),
+            direction="trip_from",
+            user_attendance=UserAttendance.objects.get(pk=1),
+        )
+        with open("apps/dpnk/test_files/modranska-rokle.gpx", "rb") as gpxfile:
+            file_encoded_string = "data:application/gpx;base64,%s" % (
+                base64.b64encode(gpxfile.read()).decode()
+            )
+        post_data = {
+            "trips": [
+                {
+                    "trip_date": "2010-11-19",
+                    "direction": "trip_to",
+                    "sourceApplication": "test_app",
+                    "file_encoded_string": file_encoded_string,
+                },
+                {
+                    "trip_date": "2010-11-19",
+                    "direction": "trip_from",
+                    "sourceApplication": "test_app",
+                    "distanceMeters": 5000,
+                },
+                {
+                    "trip_date": "2010-11-10",
+                    "direction": "trip_to",
+                    "sourceApplication": "test_app",
+                },
+                {
+                    "trip_date": "2010-11-19",
+                    "sourceApplication": "test_app",
+                },
+            ],
+        }
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.client.post(
+                reverse("gpxfile-list"),
+                post_data,
+                format="json",
+                HTTP_ACCEPT="application/json; version=v3",
+            )
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(len(callbacks), 1)
+        statuses = response.json()["trips"]
+        self.assertEqual(
+            [status["status"] for status in statuses],
+            ["created", "updated", "error", "error"],
+        )
+        self.assertEqual(statuses[0]["trip"]["distanceMeters"], 13320)
+        self.assertEqual(
+            statuses[2]["errors"],
+            {
+                "date": [
+                    "Trip for this day cannot be created/updated. This day is not active for edition"
+                ]
+            },
+        )
+        self.assertIn("direction", statuses[3]["errors"])
+        trip.refresh_from_db()
+        self.assertEqual(trip.distance, 5)
+        self.assertEqual(statuses[1]["trip"]["id"], trip.id)
+        self.assertEqual(
+            models.Trip.objects.get(
+                date=datetime.date(2010, 11, 19), direction="trip_to"
+            ).distance,
+            13.32,
+        )
+
+    @override_settings(TRIP_TRACK_ASYNC_PROCESSING=True)
+    def test_gpx_post_bulk_async_processing(self):
+        """Test, that tracks of trips posted in bulk are parsed by task"""
+        with open("apps/dpnk/test_files/modranska-rokle.gpx", "rb") as gpxfile:
+            file_encoded_string = "data:application/gpx;base64,%s" % (
+                base64.b64encode(gpxfile.read()).decode()
+            )
+        post_data = {
+            "trips": [
+                {
+                    "trip_date": "2010-11-19",
+                    "direction": "trip_to",
+                    "sourceApplication": "test_app",
+                    "file_encoded_string": file_encoded_string,
+                },
+            ],
+        }
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(
+                reverse("gpxfile-list"),
+                post_data,
+                format="json",
+                HTTP_ACCEPT="application/json; version=v3",
+            )
+        self.assertEqual(response.status_code, 201)
+        trip = models.Trip.objects.get(date=datetime.date(2010, 11, 19))
+        self.assertTrue(trip.track_processing)
+        self.assertIsNone(trip.track)
+        for callback in callbacks:
+            callback()
+        trip.refresh_from_db()
+        self.assertFalse(trip.track_processing)
+        self.assertEqual(trip.distance, 13.32)
+        self.assertIsNotNone(trip.track_low)
+
+    def test_gpx_post_bulk_keep_missing_fields(self):
+        """Test, that fields missing in re-posted trip keep their stored values"""
+        track = MultiLineString(LineString((14.0, 50.0), (14.0, 51.0)))
+        trip = mommy.make(
+            "Trip",
+            date=datetime.date(2010, 11, 19),
+            direction="trip_to",
+            user_attendance=UserAttendance.objects.get(pk=1),
+            track=track,
+            distance=111.24,
+            duration=3600,
+            description="Přes park",
+            source_id="123",
+        )
+        post_data = {
+            "trips": [
+                {
+                    "trip_date": "2010-11-19",
+                    "direction": "trip_to",
+                    "sourceApplication": "test_app",
+                    "commuteMode": "by_foot",
+                },
+            ],
+        }
+        response = self.client.post(
+            reverse("gpxfile-list"),
+            post_data,
+            format="json",
+            HTTP_ACCEPT="application/json; version=v3",
+        )
+        self.assertEqual(response.status_code, 201)
+        (status,) = response.json()["trips"]
+        self.assertEqual(status["status"], "updated")
+        self.assertIsNone(status["errors"])
+        self.assertEqual(status["trip"]["distanceMeters"], 111240)
+        trip.refresh_from_db()
+        self.assertEqual(trip.commute_mode.slug, "by_foot")
+        self.assertEqual(trip.source_application, "test_app")
+        self.assertTrue(trip.track.equals(track))
+        self.assertIsNotNone(trip.track_low)
+        self.assertEqual(trip.distance, 111.24)
+        self.assertEqual(trip.duration, 3600)
+        self.assertEqual(trip.description, "Přes park")
+        self.assertEqual(trip.source_id, "123")
+
     def test_gpx_inactive(self):
         with open("apps/dpnk/test_files/modranska-rokle.gpx", "rb") as gpxfile:
             post_data = {
@@ -621,6 +885,69 @@ class CompetitionTest(TestCase):
         self.assertEqual(results["results"][0]["competition_type"], "length")
 
 
+@override_settings(
+    SITE_ID=2,
+    FAKE_DATE=datetime.date(year=2010, month=11, day=20),
+)
+class MyCompetitionTest(TestCase):
+    fixtures = [
+        "dump",
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient(
+            HTTP_HOST="testing-campaign.testserver", HTTP_REFERER="test-referer"
+        )
+        self.client.force_login(
+            User.objects.get(pk=1), settings.AUTHENTICATION_BACKENDS[0]
+        )
+        self.maxDiff = None
+
+    def test_get_my_competition(self):
+        competition = Competition.objects.get(slug="vyzva1")
+        my_result = mommy.make(
+            "CompetitionResult",
+            competition=competition,
+            user_attendance=UserAttendance.objects.get(pk=1),
+            result=5,
+            result_divident=5,
+            result_divisor=1,
+        )
+        mommy.make(
+            "CompetitionResult",
+            competition=competition,
+            user_attendance=UserAttendance.objects.get(pk=2),
+            result=10,
+            result_divident=10,
+            result_divisor=1,
+        )
+        mommy.make(
+            "CompetitionResult",
+            competition=competition,
+            user_attendance=UserAttendance.objects.get(pk=3),
+            result=None,
+        )
+        address = reverse("my-competition-list")
+        response = self.client.get(address)
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.content.decode())
+        self.assertEqual(results["count"], 1)
+        competition = results["results"][0]
+        self.assertEqual(competition["slug"], "vyzva1")
+        self.assertEqual(competition["competitor_count"], 2)
+        self.assertEqual(
+            competition["my_result"],
+            {
+                "id": my_result.pk,
+                "result": "5.000000",
+                "divident": 5.0,
+                "divisor": 1.0,
+                "place": 2,
+            },
+        )
+
+
 @override_settings(
     SITE_ID=2,
     FAKE_DATE=datetime.date(year=2010, month=11, day=20),
@@ -2003,11 +2330,30 @@ class CoordinatedCityTest(TestCase):
                         "competitions": [],
                         "data_export_password": "",
                         "data_export_url": None,
+                        "heatmap_export_url": None,
                     }
                 ],
             },
         )
 
+    def test_city_list_query_count(self):
+        """Test, that number of queries doesn't depend on number of cities"""
+        address = reverse("city-list")
+        self.client.get(address)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(address)
+        self.assertEqual(response.json()["count"], 2)
+
+        mommy.make(
+            "CityInCampaign",
+            city=models.City.objects.get(slug="hradec-kralove"),
+            campaign=models.Campaign.objects.get(slug="testing-campaign"),
+        )
+        with CaptureQueriesContext(connection) as more_cities_queries:
+            response = self.client.get(address)
+        self.assertEqual(response.json()["count"], 3)
+        self.assertEqual(len(more_cities_queries), len(queries))
+
 
 @override_settings(
     SITE_ID=2,
@@ -1,10 +1,16 @@
 import datetime
 from itertools import cycle
+from unittest.mock import patch
 
+from denorm.models import DirtyInstance
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase
 from django.test.utils import override_settings
 
-from dpnk import models, results, util
+from dpnk import bulk_stats, models, recalculation_queue, results, tasks, util
 from dpnk.test.util import ClearCacheMixin, DenormMixin
 from dpnk.test.util import print_response  # noqa
 
@@ -146,6 +152,545 @@ class ResultsTests(DenormMixin, ClearCacheMixin, TestCase):
         )
         self.assertEqual(result, (3, 96, 3 / 96.0))
 
+    def complete_user_attendances(self):
+        """Fill everything needed to enter competitions"""
+        user_attendances = models.UserAttendance.objects.filter(
+            campaign=self.testing_campaign
+        )
+        user_attendances.update(personal_data_opt_in=True)
+        models.UserProfile.objects.filter(
+            userattendance_set__in=user_attendances
+        ).update(sex="female")
+        User.objects.filter(
+            userprofile__userattendance_set__in=user_attendances
+        ).update(first_name="Foo", last_name="Bar", email="foo@bar.cz")
+        util.rebuild_denorm_models(user_attendances)
+        util.rebuild_denorm_models([self.user_attendance.team])
+
+    def test_recalculate_result_competition(self):
+        """
+        Test that recalculating whole competition at once gives the same results
+        as recalculating results of every competitor separately
+        """
+        self.complete_user_attendances()
+        result_fields = (
+            "user_attendance",
+            "team",
+            "company",
+            "subsidiary",
+            "result",
+            "result_divident",
+            "result_divisor",
+            "frequency",
+            "distance",
+            "rank_from",
+            "rank_to",
+        )
+        for competitor_type in ("single_user", "team", "company", "subsidiary"):
+            for competition_type in ("length", "frequency", "questionnaire"):
+                competition = mommy.make(
+                    "Competition",
+                    competition_type=competition_type,
+                    competitor_type=competitor_type,
+                    campaign=self.testing_campaign,
+                    date_from=datetime.date(2017, 4, 3),
+                    date_to=datetime.date(2017, 5, 23),
+                    commute_modes=models.CommuteMode.objects.filter(
+                        slug__in=("bicycle", "by_foot")
+                    ),
+                )
+                models.CompetitionResult.objects.filter(
+                    competition=competition
+                ).delete()
+                for competitor in competition.get_competitors():
+                    results.recalculate_result(competition, competitor)
+                expected_results = list(
+                    competition.results.order_by(*result_fields[:4]).values_list(
+                        *result_fields
+                    )
+                )
+
+                results.recalculate_result_competition(competition)
+                self.assertEqual(
+                    list(
+                        competition.results.order_by(*result_fields[:4]).values_list(
+                            *result_fields
+                        )
+                    ),
+                    expected_results,
+                    (competitor_type, competition_type),
+                )
+
+    @override_settings(RESULTS_RECALCULATION_CHUNK_SIZE=1)
+    def test_recalculate_result_competition_parallel(self):
+        """
+        Test that recalculating competition in chunks gives the same results
+        as recalculating it at once
+        """
+        self.complete_user_attendances()
+        result_fields = (
+            "user_attendance",
+            "team",
+            "company",
+            "subsidiary",
+            "result",
+            "result_divident",
+            "result_divisor",
+            "frequency",
+            "distance",
+            "rank_from",
+            "rank_to",
+        )
+        for competitor_type in ("single_user", "team", "company"):
+            competition = mommy.make(
+                "Competition",
+                competition_type="frequency",
+                competitor_type=competitor_type,
+                campaign=self.testing_campaign,
+                date_from=datetime.date(2017, 4, 3),
+                date_to=datetime.date(2017, 5, 23),
+                commute_modes=models.CommuteMode.objects.filter(
+                    slug__in=("bicycle", "by_foot")
+                ),
+            )
+            results.recalculate_result_competition(competition)
+            expected_results = list(
+                competition.results.order_by(*result_fields[:4]).values_list(
+                    *result_fields
+                )
+            )
+            competition.results.all().delete()
+
+            recalculation = results.recalculate_result_competition_parallel(competition)
+            recalculation.refresh_from_db()
+            self.assertEqual(recalculation.chunks_done, recalculation.chunks_total)
+            self.assertIsNotNone(recalculation.finished)
+            self.assertFalse(recalculation.chunks.exists())
+            self.assertEqual(
+                list(
+                    competition.results.order_by(*result_fields[:4]).values_list(
+                        *result_fields
+                    )
+                ),
+                expected_results,
+                competitor_type,
+            )
+
+    def test_recalculate_competition_chunk_retry(self):
+        """Test that repeated chunk is counted only once"""
+        competition = mommy.make(
+            "Competition",
+            competition_type="length",
+            competitor_type="single_user",
+            campaign=self.testing_campaign,
+        )
+        recalculation = mommy.make(
+            "CompetitionRecalculation",
+            competition=competition,
+            chunks_total=2,
+        )
+        chunk = mommy.make(
+            "CompetitionRecalculationChunk",
+            recalculation=recalculation,
+            index=0,
+            competitor_ids=[self.user_attendance.pk],
+        )
+        results.recalculate_competition_chunk(chunk.pk)
+        results.recalculate_competition_chunk(chunk.pk)
+        recalculation.refresh_from_db()
+        self.assertEqual(recalculation.get_progress(), "1/2")
+        self.assertIsNone(recalculation.finished)
+        self.assertIsNotNone(recalculation.get_eta())
+
+    def test_recalculate_competition_chunk_failed(self):
+        """Test that failed chunk marks the recalculation failed"""
+        competition = mommy.make(
+            "Competition",
+            competition_type="length",
+            competitor_type="single_user",
+            campaign=self.testing_campaign,
+        )
+        recalculation = mommy.make(
+            "CompetitionRecalculation",
+            competition=competition,
+            chunks_total=2,
+        )
+        chunks = [
+            mommy.make(
+                "CompetitionRecalculationChunk",
+                recalculation=recalculation,
+                index=index,
+                competitor_ids=[self.user_attendance.pk],
+            )
+            for index in range(2)
+        ]
+        with patch.object(
+            results, "get_competition_results", side_effect=ValueError("error")
+        ):
+            with self.assertRaises(ValueError):
+                tasks.recalculate_competition_chunk(chunks[0].pk)
+        recalculation.refresh_from_db()
+        self.assertIsNotNone(recalculation.failed)
+        self.assertIn("ValueError('error')", recalculation.error)
+        self.assertIsNone(recalculation.get_eta())
+        results.recalculate_competition_chunk(chunks[1].pk)
+        recalculation.refresh_from_db()
+        self.assertEqual(recalculation.get_progress(), "0/2")
+        self.assertIsNone(recalculation.finished)
+
+    @override_settings(RESULTS_INCREMENTAL_UPDATES=True)
+    def test_update_results_trip_changed(self):
+        """
+        Test that results updated incrementally after trip changes are the same
+        as fully recalculated results
+        """
+        self.complete_user_attendances()
+        result_fields = (
+            "result",
+            "result_divident",
+            "result_divisor",
+            "distance",
+            "rank_from",
+            "rank_to",
+        )
+        competitions = [
+            mommy.make(
+                "Competition",
+                competition_type=competition_type,
+                competitor_type=competitor_type,
+                campaign=self.testing_campaign,
+                date_from=datetime.date(2017, 4, 3),
+                date_to=datetime.date(2017, 5, 23),
+                commute_modes=models.CommuteMode.objects.filter(
+                    slug__in=("bicycle", "by_foot")
+                ),
+            )
+            for competitor_type, competition_type in (
+                ("single_user", "frequency"),
+                ("single_user", "length"),
+                ("team", "frequency"),
+                ("team", "length"),
+                ("company", "length"),
+                ("subsidiary", "frequency"),
+            )
+        ]
+        for competition in competitions:
+            results.recalculate_result_competition(competition)
+
+        mommy.make(
+            "Trip",
+            commute_mode=models.CommuteMode.objects.get(slug="bicycle"),
+            distance=5,
+            direction="trip_to",
+            date=datetime.date(2017, 5, 4),
+            user_attendance=self.user_attendance,
+        )
+        trip = models.Trip.objects.get(
+            user_attendance=self.user_attendance,
+            date=datetime.date(2017, 5, 2),
+            direction="trip_to",
+        )
+        trip.commute_mode = models.CommuteMode.objects.get(slug="by_foot")
+        trip.distance = 2
+        trip.save()
+        models.Trip.objects.get(
+            user_attendance=self.user_attendance,
+            date=datetime.date(2017, 5, 1),
+            direction="trip_from",
+        ).delete()
+
+        for competition in competitions:
+            updated_results = list(
+                competition.results.order_by("pk").values_list(*result_fields)
+            )
+            results.recalculate_result_competition(competition)
+            self.assertEqual(
+                list(competition.results.order_by("pk").values_list(*result_fields)),
+                updated_results,
+                (competition.competitor_type, competition.competition_type),
+            )
+
+    @override_settings(RESULTS_INCREMENTAL_UPDATES=True)
+    def test_update_results_trip_changed_fallback(self):
+        """
+        Test that result missing for incremental update is recalculated
+        by recalculate_result_competitor and deleted trip with
+        dont_recalculate doesn't change results
+        """
+        self.complete_user_attendances()
+        mommy.make(
+            "Competition",
+            competition_type="length",
+            competitor_type="single_user",
+            campaign=self.testing_campaign,
+            date_from=datetime.date(2017, 4, 3),
+            date_to=datetime.date(2017, 5, 23),
+            commute_modes=models.CommuteMode.objects.filter(
+                slug__in=("bicycle", "by_foot")
+            ),
+        )
+        trip = models.Trip.objects.get(
+            user_attendance=self.user_attendance,
+            date=datetime.date(2017, 5, 2),
+            direction="trip_to",
+        )
+        with patch.object(results, "recalculate_result_competitor") as recalculate:
+            trip.commute_mode = models.CommuteMode.objects.get(slug="by_foot")
+            trip.distance = (trip.distance or 0) + 1
+            trip.save()
+            recalculate.assert_called_once_with(self.user_attendance)
+
+            recalculate.reset_mock()
+            with patch.object(results, "update_results_trip_changed") as update:
+                trip.dont_recalculate = True
+                trip.delete()
+            update.assert_not_called()
+            recalculate.assert_not_called()
+
+    def test_get_competitions_with_info(self):
+        self.complete_user_attendances()
+        competition = mommy.make(
+            "Competition",
+            competition_type="length",
+            competitor_type="single_user",
+            campaign=self.testing_campaign,
+            is_public=True,
+            date_from=datetime.date(2017, 4, 3),
+            date_to=datetime.date(2017, 5, 23),
+            commute_modes=models.CommuteMode.objects.filter(
+                slug__in=("bicycle", "by_foot")
+            ),
+        )
+        results.recalculate_result_competition(competition)
+        competitions = results.get_competitions_with_info(self.user_attendance)
+        competition = next(c for c in competitions if c.pk == competition.pk)
+        my_result = competition.results.get(user_attendance=self.user_attendance)
+        self.assertEqual(competition.competitor_count, 2)
+        self.assertEqual(competition.my_results.id, my_result.id)
+        self.assertEqual(competition.my_results.result, my_result.result)
+        self.assertEqual(competition.my_results.position, 1)
+
+    def test_bulk_stats_get_trip_stats(self):
+        """Test that vectorised trip stats are the same as computed by the query"""
+        competition = mommy.make(
+            "Competition",
+            competition_type="frequency",
+            competitor_type="single_user",
+            campaign=self.testing_campaign,
+            date_from=datetime.date(2017, 4, 3),
+            date_to=datetime.date(2017, 5, 23),
+            commute_modes=models.CommuteMode.objects.filter(
+                slug__in=("bicycle", "by_foot")
+            ),
+        )
+        user_attendances = models.UserAttendance.objects.filter(
+            campaign=self.testing_campaign
+        )
+        self.assertEqual(
+            bulk_stats.get_trip_stats(user_attendances, competition),
+            results.get_trip_stats(user_attendances, competition),
+        )
+
+    def test_recalculate_campaign_trip_stats(self):
+        self.assertEqual(
+            bulk_stats.recalculate_campaign_trip_stats(self.testing_campaign), 2
+        )
+        self.user_attendance.refresh_from_db()
+        self.assertEqual(self.user_attendance.get_rides_count_denorm, 3)
+        self.assertEqual(self.user_attendance.working_rides_base_count, 48)
+        self.assertEqual(self.user_attendance.frequency, 0.0625)
+        self.assertEqual(self.user_attendance.trip_length_total, 5.0)
+        self.user_attendance.team.refresh_from_db()
+        self.assertEqual(self.user_attendance.team.get_rides_count_denorm, 3)
+        self.assertEqual(self.user_attendance.team.frequency, 0.03125)
+
+    def test_recalculate_campaign_trip_stats_no_competition_phase(self):
+        campaign = mommy.make("Campaign")
+        self.assertEqual(bulk_stats.recalculate_campaign_trip_stats(campaign), 0)
+
+    def test_recalculate_campaign_trip_stats_pending_marks(self):
+        """Test that team marked dirty before stays marked for the other fields"""
+        team = self.user_attendance.team
+        util.mark_denorm_dirty([team])
+        bulk_stats.recalculate_campaign_trip_stats(self.testing_campaign)
+        self.assertTrue(
+            DirtyInstance.objects.filter(
+                content_type=ContentType.objects.get_for_model(models.Team),
+                object_id=str(team.pk),
+            ).exists()
+        )
+
+    def test_get_user_attendance_trip_stats(self):
+        """
+        Test that the denormalized trip statistics computed by one query
+        are the same as computed field by field
+        """
+        phase = self.testing_campaign.phase("competition")
+        stats = results.get_user_attendance_trip_stats(
+            models.UserAttendance.objects.filter(campaign=self.testing_campaign),
+        )[self.user_attendance.pk]
+        self.assertEqual(stats.get_rides_count_denorm, 3)
+        self.assertEqual(
+            stats.get_rides_count_denorm,
+            results.get_rides_count(self.user_attendance, phase),
+        )
+        self.assertEqual(stats.frequency, 0.0625)
+        self.assertEqual(
+            stats.frequency,
+            results.get_userprofile_frequency(self.user_attendance, phase)[2],
+        )
+        self.assertEqual(stats.trip_length_total, 5.0)
+        self.assertEqual(
+            stats.total_trip_length_including_recreational,
+            results.get_userprofile_length(
+                [self.user_attendance], phase, recreational=True
+            ),
+        )
+        self.assertEqual(stats.working_rides_base_count, 48)
+        self.assertEqual(
+            stats.trip_points_total,
+            sum(
+                trip.commute_mode.points
+                for trip in self.user_attendance.user_trips.all()
+            ),
+        )
+
+    def test_update_user_attendance_trip_stats(self):
+        user_attendances = models.UserAttendance.objects.filter(
+            campaign=self.testing_campaign
+        )
+        user_attendances.update(get_rides_count_denorm=0, frequency=0)
+        self.assertEqual(results.update_user_attendance_trip_stats(user_attendances), 2)
+        self.user_attendance.refresh_from_db()
+        self.assertEqual(self.user_attendance.get_rides_count_denorm, 3)
+        self.assertEqual(self.user_attendance.frequency, 0.0625)
+        self.assertEqual(self.user_attendance.working_rides_base_count, 48)
+
+    def test_get_team_stats(self):
+        """
+        Test that the team statistics computed by one query
+        are the same as computed from the members one by one
+        """
+        team = self.user_attendance.team
+        stats = results.get_team_stats(
+            models.Team.objects.filter(campaign=self.testing_campaign),
+        )[team.pk]
+        self.assertEqual(stats.member_count, team.members.count())
+        self.assertEqual(stats.paid_member_count, team.paid_members().count())
+        self.assertEqual(
+            stats.unapproved_member_count, team.unapproved_members().count()
+        )
+        self.assertEqual(stats.get_rides_count_denorm, 3)
+        self.assertEqual(stats.frequency, 0.03125)
+        self.assertEqual(stats.working_trips_count, 96)
+        self.assertEqual(
+            stats.name_with_members,
+            "%s (%s)"
+            % (
+                team.name,
+                ", ".join(sorted(u.userprofile.name() for u in team.members)),
+            ),
+        )
+
+    def test_team_save_member_stats(self):
+        """Test that team saves denormalized fields from fresh member statistics"""
+        team = models.Team.objects.get(pk=self.user_attendance.team.pk)
+        # Statistics read before the members change
+        team.get_working_trips_count()
+        models.UserAttendance.objects.filter(pk=self.user_attendance.pk).update(
+            get_rides_count_denorm=10,
+        )
+        rides_count = results.get_team_stats(
+            models.Team.objects.filter(pk=team.pk),
+        )[team.pk].get_rides_count_denorm
+        team.save()
+        team.refresh_from_db()
+        self.assertEqual(team.get_rides_count_denorm, rides_count)
+
+    def test_update_team_stats(self):
+        teams = models.Team.objects.filter(campaign=self.testing_campaign)
+        teams.update(get_rides_count_denorm=0, frequency=0, member_count=0)
+        self.assertEqual(results.update_team_stats(teams), teams.count())
+        team = models.Team.objects.get(pk=self.user_attendance.team.pk)
+        self.assertEqual(team.get_rides_count_denorm, 3)
+        self.assertEqual(team.frequency, 0.03125)
+        self.assertEqual(team.member_count, team.members.count())
+
+    def test_recalculation_queue_coalesce(self):
+        queue = recalculation_queue.LocalRecalculationQueue()
+        queue.add([self.user_attendance.pk, self.user_attendance.pk])
+        queue.add([self.user_attendance.pk])
+        self.assertEqual(queue.stats().depth, 1)
+        self.assertTrue(queue.schedule(30))
+        self.assertFalse(queue.schedule(30))
+        self.assertEqual(queue.pop(10), [self.user_attendance.pk])
+        self.assertEqual(queue.pop(10), [])
+        self.assertEqual(queue.stats(), (0, 0))
+        queue.ack([self.user_attendance.pk])
+        queue.requeue_stale(0)
+        self.assertEqual(queue.stats().depth, 0)
+
+    def test_recalculation_queue_requeue(self):
+        """Test that popped user attendances are not lost until acknowledged"""
+        queue = recalculation_queue.LocalRecalculationQueue()
+        queue.add([1, 2])
+        self.assertEqual(queue.pop(10), [1, 2])
+        queue.requeue([1])
+        self.assertEqual(queue.stats().depth, 1)
+        queue.requeue_stale(3600)
+        self.assertEqual(queue.stats().depth, 1)
+        queue.requeue_stale(0)
+        self.assertEqual(queue.stats().depth, 2)
+
+    @override_settings(RESULTS_RECALCULATION_QUEUE="local")
+    def test_recalculation_queue_drain_failed(self):
+        queue = recalculation_queue.get_queue()
+        queue.add([self.user_attendance.pk])
+        with patch.object(
+            results,
+            "recalculate_result_competitor_nothread",
+            side_effect=Exception("Recalculation failed"),
+        ):
+            with self.assertRaises(Exception):
+                tasks.drain_recalculation_queue()
+        self.assertEqual(queue.stats().depth, 1)
+        self.assertEqual(tasks.drain_recalculation_queue(), 1)
+        self.assertEqual(queue.stats().depth, 0)
+
+    @override_settings(
+        RESULTS_RECALCULATION_QUEUE="local",
+        CELERY_TASK_ALWAYS_EAGER=False,
+    )
+    def test_recalculation_queue_local_not_eager(self):
+        with self.assertRaises(ImproperlyConfigured):
+            recalculation_queue.get_queue()
+
+    @override_settings(RESULTS_RECALCULATION_QUEUE="local")
+    def test_recalculation_queue_drain(self):
+        self.complete_user_attendances()
+        competition = mommy.make(
+            "Competition",
+            competition_type="length",
+            competitor_type="single_user",
+            campaign=self.testing_campaign,
+            date_from=datetime.date(2017, 4, 3),
+            date_to=datetime.date(2017, 5, 23),
+            commute_modes=models.CommuteMode.objects.filter(
+                slug__in=("bicycle", "by_foot")
+            ),
+        )
+        mommy.make(
+            "Trip",
+            commute_mode=models.CommuteMode.objects.get(slug="bicycle"),
+            distance=5,
+            direction="trip_to",
+            date=datetime.date(2017, 5, 4),
+            user_attendance=self.user_attendance,
+        )
+        self.assertEqual(recalculation_queue.get_queue().stats().depth, 0)
+        result = competition.results.get(user_attendance=self.user_attendance)
+        self.assertEqual(result.result, 10.0)
+
     def test_get_userprofile_length_by_foot(self):
         competition = mommy.make(
             "Competition",
@@ -18,12 +18,14 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 import datetime
+from unittest.mock import patch
 
+from django.contrib.gis.geos import LineString, MultiLineString
 from django.core import mail
 from django.test import TestCase
 from django.test.utils import override_settings
 
-from dpnk import tasks
+from dpnk import denorm_flush, models, tasks, util
 
 from freezegun import freeze_time
 
@@ -306,3 +308,99 @@ class TestSendUnpaidInvoiceNotification(TestCase):
             campaign_slug=testing_campaign().slug
         )
         self.assertEqual(mail_count, 0)
+
+
+@override_settings(DENORM_FLUSH_SINGLE_FLIGHT="local")
+class TestFlushDenorm(TestCase):
+    def test_flush_requests_collapsed(self):
+        """
+        Test that flush requested while other flush is running
+        is left for one follow-up run of the running flush
+        """
+        coordinator = denorm_flush.get_coordinator()
+        coordinator.take_request()
+        lock = coordinator.lock()
+        lock.acquire()
+        try:
+            denorm_flush.request_flush()
+            denorm_flush.request_flush()
+            self.assertTrue(coordinator.is_requested())
+            self.assertFalse(denorm_flush.flush())
+        finally:
+            lock.release()
+        self.assertTrue(denorm_flush.flush())
+        self.assertFalse(coordinator.is_requested())
+        metrics = coordinator.get_metrics()
+        self.assertEqual(metrics["backlog"], 0)
+        self.assertIn("rows_per_second", metrics)
+
+    def test_flush_refused_requested(self):
+        """
+        Test that flush refused by the running flush
+        requests the follow-up run of the running flush
+        """
+        coordinator = denorm_flush.get_coordinator()
+        coordinator.take_request()
+        lock = coordinator.lock()
+        lock.acquire()
+        try:
+            self.assertFalse(denorm_flush.flush())
+            self.assertTrue(coordinator.is_requested())
+        finally:
+            lock.release()
+        coordinator.take_request()
+
+    def test_request_flush_failed(self):
+        """Test that request of flush, that couldn't be scheduled, is cleared"""
+        coordinator = denorm_flush.get_coordinator()
+        coordinator.take_request()
+        with patch.object(
+            tasks.flush_denorm, "delay", side_effect=ConnectionError
+        ) as delay:
+            with self.assertRaises(ConnectionError):
+                denorm_flush.request_flush()
+            self.assertFalse(coordinator.is_requested())
+            with self.assertRaises(ConnectionError):
+                denorm_flush.request_flush()
+        self.assertEqual(delay.call_count, 2)
+
+    @override_settings(DENORM_FLUSH_LOCK_TIMEOUT=600)
+    def test_redis_request_expires(self):
+        coordinator = denorm_flush.RedisFlushCoordinator("redis://localhost:6379")
+        with patch.object(coordinator, "redis") as redis_mock:
+            redis_mock.set.return_value = True
+            self.assertTrue(coordinator.request())
+        redis_mock.set.assert_called_once_with(
+            coordinator.pending_key, 1, nx=True, ex=600
+        )
+
+
+class TestUpdateTripsDistance(TestCase):
+    def test_update_trips_distance(self):
+        """Test that distances of trips without them are computed by chunks"""
+        track = MultiLineString(LineString((14.4, 50.0), (14.5, 50.1)))
+        user_attendance = UserAttendanceRecipe.make()
+        trips = mommy.make(
+            "Trip",
+            user_attendance=user_attendance,
+            date=iter(datetime.date(2017, 5, day) for day in range(1, 4)),
+            track=track,
+            _quantity=3,
+        )
+        without_track = mommy.make(
+            "Trip",
+            user_attendance=user_attendance,
+            date=datetime.date(2017, 5, 4),
+            track=None,
+        )
+        models.Trip.objects.filter(
+            pk__in=[trip.pk for trip in trips] + [without_track.pk]
+        ).update(distance=None)
+        self.assertEqual(tasks.update_trips_distance(chunk_size=2), 3)
+        for trip in trips:
+            trip.refresh_from_db()
+            self.assertAlmostEqual(
+                trip.distance, util.get_multilinestring_length(track), delta=0.01
+            )
+        without_track.refresh_from_db()
+        self.assertIsNone(without_track.distance)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2026 o.s. Auto*Mat
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+import io
+import zipfile
+
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.test import TestCase
+
+from django_gpxpy import gpx_parse
+
+from dpnk import track_parser
+
+TCX = b"""<?xml version="1.0" encoding="UTF-8"?>
+<TrainingCenterDatabase
+    xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2">
+  <Activities><Activity Sport="Biking"><Lap><Track>
+    <Trackpoint>
+      <Position>
+        <LatitudeDegrees>50.1</LatitudeDegrees>
+        <LongitudeDegrees>14.4</LongitudeDegrees>
+      </Position>
+    </Trackpoint>
+    <Trackpoint><DistanceMeters>10</DistanceMeters></Trackpoint>
+    <Trackpoint>
+      <Position>
+        <LatitudeDegrees>50.2</LatitudeDegrees>
+        <LongitudeDegrees>14.5</LongitudeDegrees>
+      </Position>
+    </Trackpoint>
+  </Track></Lap></Activity></Activities>
+</TrainingCenterDatabase>
+"""
+
+
+class TrackParserTests(TestCase):
+    def assertSameTrack(self, file_name):
+        with open("apps/dpnk/test_files/%s" % file_name, "rb") as track_file:
+            track = track_parser.parse_track_file(track_file)
+            track_file.seek(0)
+            expected = gpx_parse.parse_gpx(track_file.read().decode("utf-8"))
+        self.assertEqual(track.coords, expected.coords)
+        return track
+
+    def test_parse_gpx_track(self):
+        track = self.assertSameTrack("modranska-rokle.gpx")
+        self.assertEqual(track.num_points, 455)
+
+    def test_parse_gpx_route(self):
+        self.assertSameTrack("route.gpx")
+
+    def test_parse_gzip(self):
+        with open("apps/dpnk/test_files/modranska-rokle.gpx.gz", "rb") as track_file:
+            track = track_parser.parse_track_file(track_file)
+        self.assertEqual(track.num_points, 455)
+
+    def test_parse_zip(self):
+        archive_file = io.BytesIO()
+        with zipfile.ZipFile(archive_file, "w") as archive:
+            archive.write("apps/dpnk/test_files/modranska-rokle.gpx", "track.gpx")
+        track = track_parser.parse_track_file(ContentFile(archive_file.getvalue()))
+        self.assertEqual(track.num_points, 455)
+
+    def test_parse_tcx(self):
+        track = track_parser.parse_track_file(ContentFile(TCX))
+        self.assertEqual(track.coords, (((14.4, 50.1), (14.5, 50.2)),))
+
+    def test_max_points(self):
+        with open("apps/dpnk/test_files/modranska-rokle.gpx", "rb") as track_file:
+            with self.assertRaises(ValidationError) as context:
+                track_parser.parse_track_file(track_file, max_points=100)
+        self.assertIn("gpx_file", context.exception.message_dict)
+
+    def test_parse_error(self):
+        with open("apps/dpnk/test_files/DSC00002.JPG", "rb") as track_file:
+            with self.assertRaises(ValidationError) as context:
+                track_parser.parse_track_file(track_file, field="file")
+        self.assertIn("file", context.exception.message_dict)
@@ -18,19 +18,32 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 import datetime
+from unittest.mock import patch
+
+from denorm.models import DirtyInstance
 
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.gis.geos import LineString, MultiLineString
 from django.test import TestCase
 from django.test.utils import override_settings
 
-from dpnk import util
+from dpnk import models, util
+
+import geopy.distance
+
+from model_mommy import mommy
 
 
 @override_settings(
     FAKE_DATE=datetime.date(year=2010, month=11, day=20),
 )
 class UtilTests(TestCase):
-    fixtures = ["sites", "campaign", "auth_user", "users"]
+    fixtures = ["sites", "campaign", "auth_user", "users", "public_holidays"]
+
+    def setUp(self):
+        # Public holidays could be loaded by other test before
+        util.clear_calendar_cache()
 
     def test_working_day(self):
         self.assertTrue(util.working_day(datetime.date(2016, 6, 1)))
@@ -41,6 +54,156 @@ class UtilTests(TestCase):
         self.assertFalse(util.working_day(datetime.date(2018, 5, 8)))
         self.assertFalse(util.working_day(datetime.date(2018, 5, 1)))
 
+    def test_working_day_public_holiday(self):
+        holiday = models.PublicHoliday.objects.create(date=datetime.date(2018, 1, 19))
+        self.assertFalse(util.working_day(datetime.date(2018, 1, 19)))
+        holiday.delete()
+        self.assertTrue(util.working_day(datetime.date(2018, 1, 19)))
+
+    def test_calendar(self):
+        calendar = util.get_calendar(
+            datetime.date(2016, 4, 29), datetime.date(2016, 5, 10)
+        )
+        self.assertEqual(len(calendar.days_until(datetime.date(2016, 5, 3))), 5)
+        self.assertEqual(
+            calendar.working_days_until(datetime.date(2016, 5, 3)),
+            [
+                datetime.date(2016, 4, 29),
+                datetime.date(2016, 5, 2),
+                datetime.date(2016, 5, 3),
+            ],
+        )
+        self.assertEqual(calendar.working_days_count(datetime.date(2016, 5, 3)), 3)
+        self.assertEqual(calendar.working_days_count(datetime.date(2016, 4, 1)), 0)
+        self.assertEqual(calendar.working_days_count(datetime.date(2016, 6, 1)), 8)
+        self.assertEqual(
+            calendar.non_working_days_until(datetime.date(2016, 5, 8)),
+            [
+                datetime.date(2016, 4, 30),
+                datetime.date(2016, 5, 1),
+                datetime.date(2016, 5, 7),
+                datetime.date(2016, 5, 8),
+            ],
+        )
+
+    def test_mark_denorm_dirty(self):
+        user_attendances = models.UserAttendance.objects.all()
+        count = user_attendances.count()
+        progress = []
+        marked = util.mark_denorm_dirty(
+            user_attendances,
+            chunk_size=2,
+            progress_callback=lambda done, total: progress.append((done, total)),
+        )
+        self.assertEqual(marked, count)
+        self.assertEqual(progress[-1], (count, count))
+        self.assertEqual(len(progress), (count + 1) // 2)
+        # Already marked models are skipped
+        self.assertEqual(util.mark_denorm_dirty(list(user_attendances)), 0)
+        self.assertEqual(
+            DirtyInstance.objects.filter(
+                content_type=ContentType.objects.get_for_model(models.UserAttendance),
+            ).count(),
+            count,
+        )
+
+    def test_get_multilinestring_length(self):
+        """Test that the vectorised length is the same as computed by geopy"""
+        track = MultiLineString(
+            LineString((14.4, 50.0), (14.5, 50.1), (14.6, 50.1), (14.6, 50.1)),
+            LineString((16.6, 49.2), (16.5, 49.3)),
+        )
+        expected = sum(
+            geopy.distance.vincenty((lat1, lon1), (lat2, lon2)).km
+            for linestring in track
+            for (lon1, lat1), (lon2, lat2) in util.pairwise(linestring)
+        )
+        self.assertAlmostEqual(
+            util.get_multilinestring_length(track), expected, delta=0.001
+        )
+        self.assertEqual(util.get_multilinestring_length(MultiLineString()), 0)
+
+    def test_update_trips_distance(self):
+        track = MultiLineString(LineString((14.4, 50.0), (14.5, 50.1)))
+        trip = mommy.make(
+            "Trip",
+            user_attendance=models.UserAttendance.objects.first(),
+            track=track,
+        )
+        trips = models.Trip.objects.filter(pk=trip.pk)
+        trips.update(distance=None)
+        self.assertEqual(util.update_trips_distance(trips), 1)
+        trip.refresh_from_db()
+        self.assertAlmostEqual(
+            trip.distance, util.get_multilinestring_length(track), delta=0.01
+        )
+
+
+class MemoizeWithExpiryTests(TestCase):
+    def setUp(self):
+        self.calls = []
+
+        @util.memoize_with_expiry(expiry_time=60, maxsize=2)
+        def square(number):
+            self.calls.append(number)
+            return number * number
+
+        self.square = square
+
+    def test_disabled(self):
+        """Test, that memoization is turned off in tests by default"""
+        self.assertEqual(self.square(2), 4)
+        self.assertEqual(self.square(2), 4)
+        self.assertEqual(self.calls, [2, 2])
+        self.assertEqual(self.square.cache_info().currsize, 0)
+
+    @override_settings(MEMOIZE_WITH_EXPIRY=True)
+    def test_hits(self):
+        self.assertEqual(self.square(2), 4)
+        self.assertEqual(self.square(2), 4)
+        self.assertEqual(self.calls, [2])
+        self.assertEqual(
+            self.square.cache_info(),
+            util.MemoizeInfo(hits=1, misses=1, maxsize=2, currsize=1),
+        )
+        self.assertIn(
+            "dpnk.test.test_utils.MemoizeWithExpiryTests.setUp.<locals>.square",
+            util.memoize_with_expiry.get_stats(),
+        )
+
+    @override_settings(MEMOIZE_WITH_EXPIRY=True)
+    def test_expiry(self):
+        with patch("dpnk.util.time.monotonic", side_effect=[0, 59, 61]):
+            self.square(2)
+            self.square(2)
+            self.square(2)
+        self.assertEqual(self.calls, [2, 2])
+
+    @override_settings(MEMOIZE_WITH_EXPIRY=True)
+    def test_maxsize(self):
+        """Test, that least recently used result is dropped"""
+        self.square(1)
+        self.square(2)
+        self.square(1)
+        self.square(3)
+        self.square(1)
+        self.square(2)
+        self.assertEqual(self.calls, [1, 2, 3, 2])
+        self.assertEqual(self.square.cache_info().currsize, 2)
+
+    @override_settings(MEMOIZE_WITH_EXPIRY=True)
+    def test_invalidate(self):
+        self.square(1)
+        self.square(2)
+        self.square(3)
+        self.square.invalidate(3)
+        self.square.invalidate_where(lambda number: number == 2)
+        self.assertEqual(self.square.cache_info().currsize, 0)
+        self.square(1)
+        self.square.clear()
+        self.square(1)
+        self.assertEqual(self.calls, [1, 2, 3, 1, 1])
+
 
 class TodayTests(TestCase):
     def test_today(self):
@@ -20,6 +20,8 @@
 from django.core.cache import cache
 from django.core.management import call_command
 
+from dpnk.util import clear_calendar_cache, memoize_with_expiry
+
 
 def print_response(response, stdout=False, filename="response.html"):
     content = response.content.decode()
@@ -44,3 +46,6 @@ class ClearCacheMixin(object):
     def tearDown(self):
         super().tearDown()
         cache.clear()
+        clear_calendar_cache()
+        for memoized in memoize_with_expiry.instances.values():
+            memoized.clear()
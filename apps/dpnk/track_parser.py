@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2026 o.s. Auto*Mat
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Streaming parser of GPX and TCX track files.
+
+The file is read by incremental XML parsing and the track is built point
+by point, parsed elements are dropped immediately, so the memory used
+depends only on the number of points (limited by TRACK_MAX_POINTS),
+not on the size of the file.
+Gzipped and zipped files are decompressed on the fly.
+
+The result is the same as of django_gpxpy.gpx_parse.parse_gpx:
+lines of track segments followed by lines of routes.
+"""
+import gzip
+import zipfile
+from array import array
+
+from django.conf import settings
+from django.contrib.gis.geos import LineString, MultiLineString
+from django.core.exceptions import ValidationError
+from django.utils.translation import gettext_lazy as _
+
+from lxml import etree
+
+import numpy as np
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZIP_MAGIC = b"PK\x03\x04"
+TRACK_FILE_EXTENSIONS = (".gpx", ".tcx")
+
+# Elements containing points of one line (GPX track segment and route,
+# TCX track) and kind of the line
+LINE_ELEMENTS = {
+    "trkseg": "track",
+    "rte": "route",
+    "Track": "track",
+}
+POINT_ELEMENTS = {"trkpt", "rtept", "Trackpoint"}
+
+
+def open_track_file(track_file):
+    """
+    Return file object with the content of the track file,
+    gzipped and zipped files are decompressed on the fly.
+    """
+    track_file.seek(0)
+    magic = track_file.read(len(ZIP_MAGIC))
+    track_file.seek(0)
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=track_file)
+    if magic == ZIP_MAGIC:
+        archive = zipfile.ZipFile(track_file)
+        for name in archive.namelist():
+            if name.lower().endswith(TRACK_FILE_EXTENSIONS):
+                return archive.open(name)
+        raise ValidationError(_("Archiv neobsahuje žádný GPX nebo TCX soubor."))
+    return track_file
+
+
+def _drop(element):
+    """Free memory of already processed element and its preceding siblings"""
+    element.clear(keep_tail=True)
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def iter_lines(source, max_points=None):
+    """
+    Parse the GPX or TCX file incrementally
+    and yield (kind, coordinates) for every line,
+    coordinates are flat array of longitudes and latitudes.
+    """
+    coordinates = None
+    latitude = longitude = None
+    points_count = 0
+    for event, element in etree.iterparse(
+        source,
+        events=("start", "end"),
+        resolve_entities=False,
+        no_network=True,
+    ):
+        tag = etree.QName(element).localname
+        if event == "start":
+            if tag in LINE_ELEMENTS:
+                coordinates = array("d")
+            continue
+        if tag == "LatitudeDegrees":
+            latitude = element.text
+        elif tag == "LongitudeDegrees":
+            longitude = element.text
+        elif tag in POINT_ELEMENTS:
+            if tag != "Trackpoint":
+                latitude, longitude = element.get("lat"), element.get("lon")
+            # TCX trackpoints without position are pauses
+            if coordinates is not None and latitude and longitude:
+                points_count += 1
+                if max_points and points_count > max_points:
+                    raise ValidationError(
+                        _("Trasa obsahuje příliš mnoho bodů (nejvýše %s).")
+                        % max_points,
+                    )
+                coordinates.append(float(longitude))
+                coordinates.append(float(latitude))
+            latitude = longitude = None
+        elif tag in LINE_ELEMENTS:
+            yield LINE_ELEMENTS[tag], coordinates
+            coordinates = None
+        _drop(element)
+
+
+def parse_track_file(track_file, max_points=None, field="gpx_file"):
+    """
+    Return MultiLineString with the track of GPX or TCX file
+    (can be gzipped or zipped).
+
+    Raise ValidationError of the field if the file can't be parsed
+    or has more than max_points (default TRACK_MAX_POINTS) points.
+    """
+    if max_points is None:
+        max_points = settings.TRACK_MAX_POINTS
+    lines = {"track": [], "route": []}
+    try:
+        for kind, coordinates in iter_lines(open_track_file(track_file), max_points):
+            # Line has to have at least two points
+            if len(coordinates) > 2:
+                lines[kind].append(
+                    LineString(np.frombuffer(coordinates).reshape(-1, 2)),
+                )
+    except ValidationError as e:
+        raise ValidationError({field: e.messages})
+    except (
+        etree.XMLSyntaxError,
+        zipfile.BadZipFile,
+        OSError,
+        EOFError,
+        ValueError,
+    ) as e:
+        raise ValidationError({field: _("Vadný soubor s trasou: %s") % e})
+    return MultiLineString(lines["track"] + lines["route"], srid=4326)
@@ -187,6 +187,12 @@ urlpatterns = [
         views.MapView.as_view(),
         name="map",
     ),
+    re_path(
+        r"^heatmap/(?P<campaign_slug>[\w-]+)/(?:(?P<city_slug>[\w-]+)/)?"
+        r"(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.mvt$",
+        views.HeatmapTileView.as_view(),
+        name="heatmap_tile",
+    ),
     re_path(
         r"^nekompletni$",
         views.RegistrationUncompleteForm.as_view(),
@@ -20,8 +20,11 @@
 
 import datetime
 import decimal
+import functools
 import time
 import logging
+import threading
+from collections import OrderedDict, namedtuple
 from operator import attrgetter
 from itertools import tee
 import re
@@ -36,12 +39,14 @@ from django.contrib.sessions.models import Session
 from django.contrib.sites.shortcuts import get_current_site
 from django.core.paginator import Paginator
 from django.db import connection, OperationalError, transaction
+from django.db.models import F, FloatField, Func
+from django.db.models.functions import Round
 from django.utils import timezone
 from django.utils.functional import cached_property, lazy
 from django.utils.safestring import mark_safe
 from django.utils.translation import gettext as _
 
-import geopy.distance
+import numpy as np
 
 from ipware.ip import get_real_ip
 
@@ -51,23 +56,112 @@ logger = logging.getLogger(__name__)
 
 mark_safe_lazy = lazy(mark_safe, str)
 
-DAYS_EXCLUDE = (
-    datetime.date(year=2016, day=5, month=7),
-    datetime.date(year=2016, day=6, month=7),
-    datetime.date(year=2016, day=28, month=9),
-    datetime.date(year=2016, day=28, month=10),
-)
-
 
 def daterange(start_date, end_date):
     for n in range(int((end_date - start_date).days + 1)):
         yield start_date + datetime.timedelta(n)
 
 
+PublicHolidays = namedtuple("PublicHolidays", ("dates", "every_year"))
+
+PUBLIC_HOLIDAYS_VERSION_CACHE_KEY = "public-holidays-version"
+# How often (in seconds) is the shared cache asked,
+# if public holidays were changed in other process
+PUBLIC_HOLIDAYS_VERSION_CHECK_INTERVAL = 60
+
+# Public holidays loaded from the database in this process
+_public_holidays = {}
+
+
+def get_public_holidays():
+    """Return dates of public holidays and (month, day) of yearly public holidays"""
+    now = time.time()
+    if (
+        _public_holidays.get("checked", 0) + PUBLIC_HOLIDAYS_VERSION_CHECK_INTERVAL
+        < now
+    ):
+        version = cache.get(PUBLIC_HOLIDAYS_VERSION_CACHE_KEY)
+        if _public_holidays.get("version") != version:
+            _public_holidays.clear()
+            get_calendar.cache_clear()
+            _public_holidays["version"] = version
+        _public_holidays["checked"] = now
+    if "holidays" not in _public_holidays:
+        from .models import PublicHoliday
+
+        dates = set()
+        every_year = set()
+        for date, is_every_year in PublicHoliday.objects.values_list(
+            "date", "every_year"
+        ):
+            if is_every_year:
+                every_year.add((date.month, date.day))
+            else:
+                dates.add(date)
+        _public_holidays["holidays"] = PublicHolidays(
+            frozenset(dates), frozenset(every_year)
+        )
+    return _public_holidays["holidays"]
+
+
+def clear_calendar_cache():
+    """Invalidate public holidays and calendars in all processes"""
+    cache.set(PUBLIC_HOLIDAYS_VERSION_CACHE_KEY, time.time(), None)
+    _public_holidays.clear()
+    get_calendar.cache_clear()
+
+
 def working_day(day):
-    if day.day in (1, 8) and day.month == 5:  # Public holiday at may
-        return False
-    return day not in DAYS_EXCLUDE and day.weekday() not in (5, 6)
+    public_holidays = get_public_holidays()
+    return (
+        day not in public_holidays.dates
+        and (day.month, day.day) not in public_holidays.every_year
+        and day.weekday() not in (5, 6)
+    )
+
+
+class Calendar:
+    """
+    Working and non-working days between start_day and end_day (inclusive)
+    with prefix counts for counting working days up to some day in O(1).
+    """
+
+    def __init__(self, start_day, end_day):
+        self.start_day = start_day
+        self.end_day = end_day
+        self.days = list(daterange(start_day, end_day))
+        self.working_days = []
+        self.non_working_days = []
+        # _working_days_count[i] is count of working days in self.days[:i]
+        self._working_days_count = [0]
+        for d in self.days:
+            if working_day(d):
+                self.working_days.append(d)
+            else:
+                self.non_working_days.append(d)
+            self._working_days_count.append(len(self.working_days))
+
+    def _index(self, day):
+        """Return count of calendar days up to day (inclusive)"""
+        return max(0, min((day - self.start_day).days + 1, len(self.days)))
+
+    def days_until(self, day):
+        return self.days[: self._index(day)]
+
+    def working_days_count(self, day):
+        return self._working_days_count[self._index(day)]
+
+    def working_days_until(self, day):
+        return self.working_days[: self.working_days_count(day)]
+
+    def non_working_days_until(self, day):
+        index = self._index(day)
+        return self.non_working_days[: index - self._working_days_count[index]]
+
+
+@functools.lru_cache(maxsize=256)
+def get_calendar(start_day, end_day):
+    return Calendar(start_day, end_day)
 
 
 def dates(competition, day=None):
@@ -83,19 +177,39 @@ def dates(competition, day=None):
     return start_day, end_day
 
 
-def working_days(competition, day=None):
+def competition_calendar(competition, day=None):
+    """
+    Return calendar of the whole competition
+    and the last day of the competition until the day
+    """
+    if not day:
+        day = _today()
     start_day, end_day = dates(competition, day)
-    return [d for d in daterange(start_day, end_day) if working_day(d)]
+    calendar_end_day = max(
+        competition.date_to or competition.campaign.phase("competition").date_to or day,
+        end_day,
+    )
+    return get_calendar(start_day, calendar_end_day), end_day
+
+
+def working_days(competition, day=None):
+    calendar, end_day = competition_calendar(competition, day)
+    return calendar.working_days_until(end_day)
+
+
+def working_days_count(competition, day=None):
+    calendar, end_day = competition_calendar(competition, day)
+    return calendar.working_days_count(end_day)
 
 
 def non_working_days(competition, day=None):
-    start_day, end_day = dates(competition, day)
-    return [d for d in daterange(start_day, end_day) if not working_day(d)]
+    calendar, end_day = competition_calendar(competition, day)
+    return calendar.non_working_days_until(end_day)
 
 
 def days(competition, day=None):
-    start_day, end_day = dates(competition, day)
-    return daterange(start_day, end_day)
+    calendar, end_day = competition_calendar(competition, day)
+    return calendar.days_until(end_day)
 
 
 def days_count(competition, day=None):
@@ -144,21 +258,80 @@ def format_psc(integer):
 
 
 # TODO: move this to denorm application
-def rebuild_denorm_models(models, async_denorm_flush=False):
-    from dpnk.tasks import flush_denorm
+def _denorm_pk_chunks(models, chunk_size):
+    """
+    Yield (model class, list of pks) chunks of the models,
+    models can be queryset or list of instances (even of different classes).
+    """
+    if hasattr(models, "values_list"):
+        chunk = []
+        for pk in models.values_list("pk", flat=True).iterator(chunk_size=chunk_size):
+            chunk.append(pk)
+            if len(chunk) == chunk_size:
+                yield models.model, chunk
+                chunk = []
+        if chunk:
+            yield models.model, chunk
+    else:
+        pks_by_class = {}
+        for model in models:
+            pks_by_class.setdefault(model.__class__, []).append(model.pk)
+        for model_class, pks in pks_by_class.items():
+            for i in range(0, len(pks), chunk_size):
+                yield model_class, pks[i : i + chunk_size]
+
+
+def mark_denorm_dirty(models, chunk_size=1000, progress_callback=None):
+    """
+    Mark the models dirty for the next denorm flush.
 
-    for model in models:
+    DirtyInstance rows are bulk inserted in chunks of chunk_size,
+    models already marked dirty are skipped.
+    progress_callback(done, total) is called after every chunk.
+    Return number of newly marked models.
+    """
+    total = models.count() if hasattr(models, "values_list") else len(models)
+    done = 0
+    marked = 0
+    for model_class, pks in _denorm_pk_chunks(models, chunk_size):
         content_type = contenttypes.models.ContentType.objects.get_for_model(
-            model.__class__
+            model_class
+        )
+        object_ids = {str(pk) for pk in pks}
+        object_ids -= set(
+            denorm.models.DirtyInstance.objects.filter(
+                content_type=content_type,
+                object_id__in=object_ids,
+            ).values_list("object_id", flat=True)
         )
-        denorm.models.DirtyInstance.objects.create(
-            content_type=content_type,
-            object_id=model.pk,
+        denorm.models.DirtyInstance.objects.bulk_create(
+            denorm.models.DirtyInstance(
+                content_type=content_type,
+                object_id=object_id,
+            )
+            for object_id in object_ids
         )
-        if async_denorm_flush:
-            flush_denorm.delay()
-        else:
-            flush_denorm()
+        marked += len(object_ids)
+        done += len(pks)
+        if progress_callback:
+            progress_callback(done, total)
+    return marked
+
+
+def rebuild_denorm_models(
+    models, async_denorm_flush=False, chunk_size=1000, progress_callback=None
+):
+    """
+    Mark the models (queryset or list of instances) dirty
+    and recalculate their denormalized fields by one denorm flush.
+    """
+    from dpnk import denorm_flush
+
+    mark_denorm_dirty(models, chunk_size, progress_callback)
+    if async_denorm_flush:
+        denorm_flush.request_flush()
+    else:
+        denorm_flush.flush(blocking=True)
 
 
 def parse_date(date):
@@ -202,17 +375,122 @@ def pairwise(iterable):
     return zip(a, b)
 
 
+# WGS-84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+
+
+def vincenty_distances(lon1, lat1, lon2, lat2, iterations=200, tolerance=1e-12):
+    """
+    Vectorised Vincenty's inverse formula on the WGS-84 ellipsoid
+    (the same as geopy.distance.vincenty), coordinates are arrays in degrees.
+
+    Returns array of distances in meters.
+    """
+    lon1, lat1, lon2, lat2 = (
+        np.radians(np.asarray(coordinate, dtype=np.float64))
+        for coordinate in (lon1, lat1, lon2, lat2)
+    )
+    u1 = np.arctan((1 - WGS84_F) * np.tan(lat1))
+    u2 = np.arctan((1 - WGS84_F) * np.tan(lat2))
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+    lon_difference = lon2 - lon1
+    lambda_ = lon_difference
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for _iteration in range(iterations):
+            sin_lambda, cos_lambda = np.sin(lambda_), np.cos(lambda_)
+            sin_sigma = np.hypot(
+                cos_u2 * sin_lambda,
+                cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lambda,
+            )
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lambda
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            # Coincident points have zero sin_sigma
+            sin_alpha = np.where(
+                sin_sigma == 0, 0, cos_u1 * cos_u2 * sin_lambda / sin_sigma
+            )
+            cos_sq_alpha = 1 - sin_alpha**2
+            # Line along the equator has zero cos_sq_alpha
+            cos_2_sigma_m = np.where(
+                cos_sq_alpha == 0,
+                0,
+                cos_sigma - 2 * sin_u1 * sin_u2 / cos_sq_alpha,
+            )
+            c = WGS84_F / 16 * cos_sq_alpha * (4 + WGS84_F * (4 - 3 * cos_sq_alpha))
+            previous_lambda = lambda_
+            lambda_ = lon_difference + (1 - c) * WGS84_F * sin_alpha * (
+                sigma
+                + c
+                * sin_sigma
+                * (cos_2_sigma_m + c * cos_sigma * (-1 + 2 * cos_2_sigma_m**2))
+            )
+            if np.all(np.abs(lambda_ - previous_lambda) <= tolerance):
+                break
+    u_sq = cos_sq_alpha * (WGS84_A**2 - WGS84_B**2) / WGS84_B**2
+    a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = (
+        b
+        * sin_sigma
+        * (
+            cos_2_sigma_m
+            + b
+            / 4
+            * (
+                cos_sigma * (-1 + 2 * cos_2_sigma_m**2)
+                - b
+                / 6
+                * cos_2_sigma_m
+                * (-3 + 4 * sin_sigma**2)
+                * (-3 + 4 * cos_2_sigma_m**2)
+            )
+        )
+    )
+    return WGS84_B * a * (sigma - delta_sigma)
+
+
 def get_multilinestring_length(mls):
     """
     Returns the length of a multiline string in kilometers.
+
+    Lengths of all segments are computed at once by vincenty_distances.
     """
-    length = 0
+    starts = []
+    ends = []
     for linestring in mls:
-        for (start_long, start_lat), (end_long, end_lat) in pairwise(linestring):
-            length += geopy.distance.vincenty(
-                (start_lat, start_long), (end_lat, end_long)
-            ).km
-    return length
+        coordinates = np.asarray(
+            getattr(linestring, "coords", linestring), dtype=np.float64
+        ).reshape(-1, 2)
+        starts.append(coordinates[:-1])
+        ends.append(coordinates[1:])
+    if not starts:
+        return 0
+    starts = np.concatenate(starts)
+    ends = np.concatenate(ends)
+    if not len(starts):
+        return 0
+    return float(
+        vincenty_distances(starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]).sum()
+        / 1000
+    )
+
+
+def update_trips_distance(trips):
+    """
+    Set distance of the trips without distance from their tracks
+    by one UPDATE computing lengths server-side by PostGIS
+    (ST_Length of geography is measured on the spheroid).
+
+    Returns number of updated trips.
+    """
+    return trips.filter(distance=None, track__isnull=False).update(
+        distance=Round(
+            Func(F("track"), function="ST_Length", output_field=FloatField()) / 1000,
+            2,
+        ),
+    )
 
 
 class CustomPaginator(Paginator):
@@ -353,25 +631,92 @@ def decimal_round(number, decimal_precision="1", rounding=decimal.ROUND_HALF_UP)
     )
 
 
+MemoizeInfo = namedtuple("MemoizeInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
 class memoize_with_expiry:
-    def __init__(self, expiry_time=0):
-        self.cache = {}
+    """
+    Memoize results of the function by its (hashable) arguments
+    for expiry_time seconds in the memory of this process,
+    least recently used results are dropped above maxsize results.
+
+    Decorate module level functions, so the cache is shared by all calls.
+    Results are removed by invalidate(*args), invalidate_where(predicate)
+    or clear() of the decorated function (e.g. from signal handlers)
+    and hit/miss counters are returned by its cache_info().
+    Memoization can be turned off by settings.MEMOIZE_WITH_EXPIRY.
+    """
+
+    instances = {}
+
+    def __init__(self, expiry_time=0, maxsize=128):
+        self.cache = OrderedDict()
         self.expiry_time = expiry_time
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        # Results computed during invalidation are not stored
+        self.generation = 0
+        self.lock = threading.Lock()
 
     def __call__(self, func):
+        @functools.wraps(func)
         def wrapped(*args):
-            current_time = time.time()
-            if args in self.cache:
-                result, timestamp = self.cache[args]
-                if current_time - timestamp < self.expiry_time:
-                    return result
+            if not settings.MEMOIZE_WITH_EXPIRY:
+                return func(*args)
+            current_time = time.monotonic()
+            with self.lock:
+                if args in self.cache:
+                    result, timestamp = self.cache[args]
+                    if current_time - timestamp < self.expiry_time:
+                        self.cache.move_to_end(args)
+                        self.hits += 1
+                        return result
+                    del self.cache[args]
+                self.misses += 1
+                generation = self.generation
 
             result = func(*args)
-            self.cache[args] = (result, current_time)
+            with self.lock:
+                if generation == self.generation:
+                    self.cache[args] = (result, current_time)
+                    while len(self.cache) > self.maxsize:
+                        self.cache.popitem(last=False)
             return result
 
+        wrapped.invalidate = self.invalidate
+        wrapped.invalidate_where = self.invalidate_where
+        wrapped.clear = self.clear
+        wrapped.cache_info = self.cache_info
+        memoize_with_expiry.instances[f"{func.__module__}.{func.__qualname__}"] = self
         return wrapped
 
+    def invalidate(self, *args):
+        with self.lock:
+            self.generation += 1
+            self.cache.pop(args, None)
+
+    def invalidate_where(self, predicate):
+        """Remove results of arguments, for which predicate(*args) is true"""
+        with self.lock:
+            self.generation += 1
+            for args in [args for args in self.cache if predicate(*args)]:
+                del self.cache[args]
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.cache.clear()
+
+    def cache_info(self):
+        with self.lock:
+            return MemoizeInfo(self.hits, self.misses, self.maxsize, len(self.cache))
+
+    @classmethod
+    def get_stats(cls):
+        """Return cache_info() of all memoized functions by their names"""
+        return {name: memoized.cache_info() for name, memoized in cls.instances.items()}
+
 
 def create_token(payload, expiration, secret_key=None, algorithm="HS256"):
     """Create JWT token
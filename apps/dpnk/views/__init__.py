@@ -80,4 +80,5 @@ __all__ = (
     DrawResultsView,
     # map
     MapView,
+    HeatmapTileView,
 )
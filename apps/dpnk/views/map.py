@@ -1,10 +1,16 @@
 # Django imports
 from braces.views import LoginRequiredMixin
 from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
 from django.utils.translation import gettext_lazy as _  # noqa
-from django.views.generic.base import TemplateView
+from django.views.decorators.cache import cache_control
+from django.views.generic.base import TemplateView, View
 
 # Local imports
+from .. import heatmap
+from ..models import Campaign
 from ..views_permission_mixins import RegistrationCompleteMixin
 
 
@@ -15,3 +21,18 @@ class MapView(LoginRequiredMixin, RegistrationCompleteMixin, TemplateView):
         context_data = super().get_context_data(*args, **kwargs)
         context_data["leaflet_config"] = settings.LEAFLET_CONFIG
         return context_data
+
+
+class HeatmapTileView(View):
+    """Vector tile (MVT) of anonymized trips of the campaign (and the city)"""
+
+    @method_decorator(cache_control(max_age=settings.HEATMAP_TILES_MAX_AGE))
+    def get(self, request, campaign_slug, z, x, y, city_slug=None):
+        z, x, y = int(z), int(x), int(y)
+        if not heatmap.is_valid_tile(z, x, y):
+            raise Http404
+        campaign = get_object_or_404(Campaign, slug=campaign_slug)
+        tile = heatmap.get_tile(campaign, city_slug, z, x, y)
+        if tile is None:
+            raise Http404
+        return HttpResponse(tile, content_type=heatmap.TILE_CONTENT_TYPE)
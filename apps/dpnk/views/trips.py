@@ -29,6 +29,7 @@ from .. import results
 from .. import util
 from ..forms import UserProfileRidesUpdateForm
 from ..models import Trip
+from ..models.trip import simplify_track
 from ..rest import TripSerializer
 from ..views_mixins import (
     RegistrationMessagesMixin,
@@ -440,14 +441,33 @@ class TripView(TitleViewMixin, LoginRequiredMixin, WithTripMixin, TemplateView):
 
 
 class TripGeoJsonView(LoginRequiredMixin, WithTripMixin, View):
+    def get_track(self):
+        """
+        Return track of resolution given by "resolution" (full, medium, low)
+        or simplified by "tolerance" (in degrees) GET parameter,
+        invalid parameters are ignored
+        """
+        trip = self.get_object()
+        try:
+            tolerance = float(self.request.GET.get("tolerance", 0))
+        except ValueError:
+            tolerance = 0
+        if 0 < tolerance <= 0.1:
+            return simplify_track(trip.track, tolerance)
+        resolution = self.request.GET.get("resolution", "full")
+        if resolution in Trip.SIMPLIFIED_TRACK_FIELDS:
+            return getattr(trip, Trip.SIMPLIFIED_TRACK_FIELDS[resolution]) or trip.track
+        return trip.track
+
     def get(self, *args, **kwargs):
         geom = self.request.GET.get("geom", "MultiLineString")
-        if self.get_object().track:
+        track = self.get_track()
+        if track:
             if geom == "MultiLineString":
-                track_json = self.get_object().track.geojson
+                track_json = track.geojson
             if geom == "LineStrings":
                 linestrings = []
-                for ls in self.get_object().track:
+                for ls in track:
                     linestrings.append(ls.geojson)
                     track_json = "[" + ",".join(linestrings) + "]"
         else:
@@ -112,7 +112,7 @@ class CompetitionResultListJson(BaseDatatableView):
         if column == "donation_icon":
             return get_charitative_results_column(row.user_attendance)
         if column == "get_sequence_range":
-            sequence_range = self.rank_dict[row.id]
+            sequence_range = row.get_sequence_range()
             if sequence_range[0] == sequence_range[1]:
                 return "%s." % sequence_range[0]
             else:
@@ -149,19 +149,9 @@ class CompetitionResultListJson(BaseDatatableView):
         results = self.competition.get_results()
         return self.competition.select_related_results(results)
 
-    def prepare_results(self, results):
-        all_results = self.get_initial_queryset()
-        if not self.queryset_filtered:
-            all_results = self.paging(all_results)
-        all_results = self.competition.annotate_results_rank(all_results)
-        self.rank_dict = self.competition.get_result_id_rank_dict(all_results)
-        return super().prepare_results(results)
-
     def filter_queryset(self, qs):
-        self.queryset_filtered = False
         search = self.request.GET.get("search[value]", None)
         if search:
-            self.queryset_filtered = True
             qs = qs.annotate(
                 first_name=Case(
                     When(
@@ -214,7 +204,6 @@ class CompetitionResultListJson(BaseDatatableView):
             "columns[0][search][value]", None
         )  # the column 7 means always company column
         if company_search:
-            self.queryset_filtered = True
             querystring = self.competition.get_company_querystring()
 
             m = re.match(r'^"(.*)"$', company_search)
@@ -0,0 +1,14 @@
+#!/bin/bash
+# Benchmark the results engine on a synthetic campaign against local PostGIS
+# and the track length computation.
+# Size of the campaign: DPNK_BENCHMARK_USERS, DPNK_BENCHMARK_TEAMS,
+# DPNK_BENCHMARK_SUBSIDIARIES, DPNK_BENCHMARK_DAYS, DPNK_BENCHMARK_TRIPS_PER_DAY
+# Results are saved to .benchmarks/, compare commits by:
+#   pytest-benchmark compare --group-by=group --columns=min,mean,max
+pytest apps/dpnk/test/pytest/test_py_benchmark_*.py \
+    --reuse-db \
+    --benchmark-only \
+    --benchmark-autosave \
+    --benchmark-save-data \
+    --benchmark-json="benchmark-$(git rev-parse --short HEAD).json" \
+    "$@"
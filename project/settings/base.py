@@ -120,6 +120,54 @@ else:
         },
     }
 
+# In-process memoization of model lookups (campaign phases, city statistics)
+# by util.memoize_with_expiry
+MEMOIZE_WITH_EXPIRY = str_to_bool(os.environ.get("DPNK_MEMOIZE_WITH_EXPIRY", True))
+
+# Cache of heatmap vector tiles, tiles are stored on disk
+# if DPNK_HEATMAP_TILES_CACHE_DIR is set
+HEATMAP_TILES_CACHE_DIR = os.environ.get("DPNK_HEATMAP_TILES_CACHE_DIR", None)
+if HEATMAP_TILES_CACHE_DIR is not None:
+    CACHES["heatmap_tiles"] = {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": HEATMAP_TILES_CACHE_DIR,
+        "OPTIONS": {
+            "MAX_ENTRIES": int(
+                os.environ.get("DPNK_HEATMAP_TILES_CACHE_MAX_ENTRIES", 100000)
+            ),
+        },
+    }
+    HEATMAP_TILES_CACHE = "heatmap_tiles"
+else:
+    HEATMAP_TILES_CACHE = "default"
+HEATMAP_TILES_CACHE_TIMEOUT = int(
+    os.environ.get("DPNK_HEATMAP_TILES_CACHE_TIMEOUT", 7 * 24 * 60 * 60)
+)
+# Raster heatmaps of cities (PNG tile pyramids) generated by
+# tasks.generate_city_heatmap, interrupted computations are continued
+# from the state stored in HEATMAP_RASTER_WORK_DIR
+HEATMAP_RASTER_ZOOMS = [
+    int(zoom)
+    for zoom in os.environ.get("DPNK_HEATMAP_RASTER_ZOOMS", "8 9 10 11 12 13").split(
+        " "
+    )
+]
+HEATMAP_RASTER_WORK_DIR = os.environ.get(
+    "DPNK_HEATMAP_RASTER_WORK_DIR",
+    normpath(PROJECT_ROOT, "heatmap_raster"),
+)
+HEATMAP_RASTER_CHECKPOINT_ROWS = int(
+    os.environ.get("DPNK_HEATMAP_RASTER_CHECKPOINT_ROWS", 50000)
+)
+# Maximal size of density grid of one zoom level (in pixels)
+HEATMAP_RASTER_MAX_PIXELS = int(
+    os.environ.get("DPNK_HEATMAP_RASTER_MAX_PIXELS", 64000000)
+)
+# Max age of heatmap tiles in browser cache (in seconds)
+HEATMAP_TILES_MAX_AGE = int(os.environ.get("DPNK_HEATMAP_TILES_MAX_AGE", 60 * 60))
+HEATMAP_TILES_MIN_ZOOM = int(os.environ.get("DPNK_HEATMAP_TILES_MIN_ZOOM", 7))
+HEATMAP_TILES_MAX_ZOOM = int(os.environ.get("DPNK_HEATMAP_TILES_MAX_ZOOM", 18))
+
 LOCALE_PATHS = (
     normpath(PROJECT_ROOT, "avatar_locale/locale"),
     normpath(PROJECT_ROOT, "dpnk/locale"),
@@ -458,7 +506,7 @@ REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": "rest_framework.schemas.openapi.AutoSchema",
     "DEFAULT_VERSIONING_CLASS": "rest_framework.versioning.NamespaceVersioning",
     "DEFAULT_VERSION": "v1",
-    "ALLOWED_VERSIONS": ["v1", "v2"],
+    "ALLOWED_VERSIONS": ["v1", "v2", "v3"],
 }
 
 REST_USE_JWT = True
@@ -1031,6 +1079,107 @@ CELERYBEAT_SCHEDULE = {
     },
 }
 
+# Apply only the trip difference to the competition results on trip change
+# instead of recalculating all results of the user, reconcile them every night
+RESULTS_INCREMENTAL_UPDATES = str_to_bool(
+    os.environ.get("DPNK_RESULTS_INCREMENTAL_UPDATES", False)
+)
+if RESULTS_INCREMENTAL_UPDATES:
+    CELERYBEAT_SCHEDULE["recalculate_active_competitions_results"] = {
+        "task": "dpnk.tasks.recalculate_active_competitions_results",
+        "schedule": crontab(hour=3, minute=0),
+    }
+
+# Coalesce results recalculations of changed user attendances into a queue
+# ("redis" or in-process "local" for CELERY_TASK_ALWAYS_EAGER only)
+# drained in batches after a delay instead of running one task per trip change
+RESULTS_RECALCULATION_QUEUE = os.environ.get("DPNK_RESULTS_RECALCULATION_QUEUE", None)
+RESULTS_RECALCULATION_QUEUE_REDIS_URL = os.environ.get(
+    "DPNK_RESULTS_RECALCULATION_QUEUE_REDIS_URL", None
+)
+RESULTS_RECALCULATION_QUEUE_DELAY = int(
+    os.environ.get("DPNK_RESULTS_RECALCULATION_QUEUE_DELAY", 30)
+)
+RESULTS_RECALCULATION_QUEUE_BATCH_SIZE = int(
+    os.environ.get("DPNK_RESULTS_RECALCULATION_QUEUE_BATCH_SIZE", 100)
+)
+# User attendances popped by a drain, that didn't finish in this time (seconds),
+# are returned to the queue
+RESULTS_RECALCULATION_QUEUE_PROCESSING_TIMEOUT = int(
+    os.environ.get("DPNK_RESULTS_RECALCULATION_QUEUE_PROCESSING_TIMEOUT", 3600)
+)
+if RESULTS_RECALCULATION_QUEUE:
+    CELERYBEAT_SCHEDULE["drain_recalculation_queue"] = {
+        "task": "dpnk.tasks.drain_recalculation_queue",
+        "schedule": crontab(minute="*/5"),
+    }
+
+# Ranks of competition results changed by single competitors are updated
+# by one task per competition after this delay (seconds)
+RESULTS_RANK_UPDATE_DELAY = int(os.environ.get("DPNK_RESULTS_RANK_UPDATE_DELAY", 60))
+
+# Update the table of anonymized trips (heatmaps, GIS exports) every night
+# by trips changed since the last update
+ANONYMIZED_TRIPS_INCREMENTAL_UPDATES = str_to_bool(
+    os.environ.get("DPNK_ANONYMIZED_TRIPS_INCREMENTAL_UPDATES", False)
+)
+if ANONYMIZED_TRIPS_INCREMENTAL_UPDATES:
+    CELERYBEAT_SCHEDULE["update_anonymized_trips_table"] = {
+        "task": "dpnk.tasks.generate_anonymized_trips_table",
+        "schedule": crontab(hour=2, minute=0),
+        "kwargs": {"update_anon_table": True},
+    }
+# Trips changed this number of seconds before the start of the last update
+# of the anonymized trips table are updated again (their transactions could
+# have been committed after the last update started)
+ANONYMIZED_TRIPS_UPDATE_MARGIN = int(
+    os.environ.get("DPNK_ANONYMIZED_TRIPS_UPDATE_MARGIN", 600)
+)
+# Database role granted access to the table of anonymized trips (e.g. GeoServer)
+ANONYMIZED_TRIPS_TABLE_GRANT_ROLE = os.environ.get(
+    "DPNK_ANONYMIZED_TRIPS_TABLE_GRANT_ROLE", "dpnk"
+)
+# OGR driver of GIS data exports of cities ("ESRI Shapefile" or "GPKG")
+CITY_DATA_EXPORT_DRIVER = os.environ.get(
+    "DPNK_CITY_DATA_EXPORT_DRIVER", "ESRI Shapefile"
+)
+
+# Run only one denorm flush at a time ("redis" or in-process "local"),
+# flush requests arriving during the flush are collapsed into one follow-up flush
+DENORM_FLUSH_SINGLE_FLIGHT = os.environ.get("DPNK_DENORM_FLUSH_SINGLE_FLIGHT", None)
+DENORM_FLUSH_REDIS_URL = os.environ.get("DPNK_DENORM_FLUSH_REDIS_URL", None)
+DENORM_FLUSH_BATCH_SIZE = int(os.environ.get("DPNK_DENORM_FLUSH_BATCH_SIZE", 500))
+DENORM_FLUSH_LOCK_TIMEOUT = int(os.environ.get("DPNK_DENORM_FLUSH_LOCK_TIMEOUT", 3600))
+
+# Number of competitors recalculated by one task
+# of the parallel competition results recalculation
+RESULTS_RECALCULATION_CHUNK_SIZE = int(
+    os.environ.get("DPNK_RESULTS_RECALCULATION_CHUNK_SIZE", 500)
+)
+
+# Maximal number of points of track uploaded in GPX/TCX file
+TRACK_MAX_POINTS = int(os.environ.get("DPNK_TRACK_MAX_POINTS", 200000))
+# Parse tracks of uploaded GPX/TCX files by Celery task instead of the request,
+# the trip is marked as track_processing until the task finishes
+TRIP_TRACK_ASYNC_PROCESSING = str_to_bool(
+    os.environ.get("DPNK_TRIP_TRACK_ASYNC_PROCESSING", False)
+)
+
+# Tolerances (in degrees) of simplified tracks stored for display
+TRACK_SIMPLIFY_TOLERANCES = {
+    "medium": float(os.environ.get("DPNK_TRACK_SIMPLIFY_TOLERANCE_MEDIUM", 0.00005)),
+    "low": float(os.environ.get("DPNK_TRACK_SIMPLIFY_TOLERANCE_LOW", 0.0005)),
+}
+
+# Maximal number of trips sent at once to the bulk trips endpoint (REST API v3)
+REST_TRIPS_BULK_MAX_LENGTH = int(os.environ.get("DPNK_REST_TRIPS_BULK_MAX_LENGTH", 200))
+
+# Number of decimal digits of track coordinates in REST API responses
+# (6 digits are about 10 cm)
+REST_TRACK_GEOJSON_PRECISION = int(
+    os.environ.get("DPNK_REST_TRACK_GEOJSON_PRECISION", 6)
+)
+
 CELERYBEAT_LIVENESS_REDIS_UNIQ_KEY = "celerybeat-liveness"
 
 DATA_UPLOAD_MAX_MEMORY_SIZE = int(
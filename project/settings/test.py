@@ -32,6 +32,7 @@ CACHES = {
         "BACKEND": "django.core.cache.backends.dummy.DummyCache",
     },
 }
+MEMOIZE_WITH_EXPIRY = False
 
 DATABASES = {
     "default": {
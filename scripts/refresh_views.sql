@@ -1,30 +1,37 @@
-CREATE OR REPLACE FUNCTION has_longer_section_than(line geometry, max_length integer) RETURNS boolean as $$
-    DECLARE
-       cur_length integer;
-    BEGIN
-    FOR i IN 1..ST_NPoints(line)-1
-    LOOP
-       cur_length := ST_distance(ST_PointN(line, i)::geography, ST_PointN(line, i+1)::geography);
-       IF cur_length>max_length THEN
-           RETURN True;
-       END IF;
-    END LOOP;
-    RETURN False;
-END;
-$$ LANGUAGE plpgsql;
+-- Rebuild of the anonymized trips table, the same as
+-- dpnk.anonymized_trips.rebuild_anonymized_trips_table
+-- (run by the generate_anonymized_trips_table Celery task).
+-- The table is built as a shadow table and replaces the old table by rename,
+-- so the old table can be read until the new one is complete.
 
-drop table  dpnk_trip_anonymized;
-CREATE TABLE dpnk_trip_anonymized as select * from (
-   select a.id, a.campaign_id, age_group, sex, commute_mode, city, occupation_id, ST_LineSubstring(a.track, 100/st_length(a.track::geography), 1 - 100/st_length(a.track::geography)) as the_geom from (
-   SELECT dpnk_trip.id, dpnk_userattendance.campaign_id, dpnk_userprofile.age_group, dpnk_userprofile.sex, dpnk_commutemode.slug as commute_mode, dpnk_city.slug as city, dpnk_userprofile.occupation_id, (ST_Dump(dpnk_trip.track::geometry)).geom AS track from dpnk_trip
-      join dpnk_userattendance on (dpnk_trip.user_attendance_id = dpnk_userattendance.id)
-      join dpnk_userprofile on (dpnk_userattendance.userprofile_id = dpnk_userprofile.id)
-      join dpnk_team on (dpnk_userattendance.team_id = dpnk_team.id)
-      join dpnk_subsidiary on (dpnk_team.subsidiary_id = dpnk_subsidiary.id)
-      join dpnk_city on (dpnk_subsidiary.city_id = dpnk_city.id)
-      join dpnk_commutemode on (dpnk_trip.commute_mode_id = dpnk_commutemode.id)
-   ) as a
-      where a.track is not null and st_numpoints(a.track::geometry) > 15 and st_length(a.track::geography)<100000 and st_length(a.track::geography)>200 and not has_longer_section_than(a.track::geometry, 1000)
-) as b where st_numpoints(b.the_geom)>15;
-GRANT ALL PRIVILEGES ON TABLE dpnk_trip_anonymized TO dpnk;
-CREATE INDEX dpnk_trip_anonymized_idx ON dpnk_trip_anonymized USING GIST (the_geom);
+DROP TABLE IF EXISTS dpnk_trip_anonymized_new, dpnk_trip_anonymized_old;
+CREATE TABLE dpnk_trip_anonymized_new AS SELECT * FROM (
+   SELECT a.id, a.campaign_id, a.age_group, a.sex, a.commute_mode, a.city, a.occupation_id, ST_LineSubstring(a.track, 100/ST_Length(a.track::geography), 1 - 100/ST_Length(a.track::geography)) AS the_geom, a.updated FROM (
+   SELECT dpnk_trip.id, dpnk_userattendance.campaign_id, dpnk_userprofile.age_group, dpnk_userprofile.sex, dpnk_commutemode.slug AS commute_mode, dpnk_city.slug AS city, dpnk_userprofile.occupation_id, dpnk_trip.updated, (ST_Dump(dpnk_trip.track::geometry)).geom AS track FROM dpnk_trip
+      JOIN dpnk_userattendance ON (dpnk_trip.user_attendance_id = dpnk_userattendance.id)
+      JOIN dpnk_userprofile ON (dpnk_userattendance.userprofile_id = dpnk_userprofile.id)
+      JOIN dpnk_team ON (dpnk_userattendance.team_id = dpnk_team.id)
+      JOIN dpnk_subsidiary ON (dpnk_team.subsidiary_id = dpnk_subsidiary.id)
+      JOIN dpnk_city ON (dpnk_subsidiary.city_id = dpnk_city.id)
+      JOIN dpnk_commutemode ON (dpnk_trip.commute_mode_id = dpnk_commutemode.id)
+   ) AS a
+      WHERE a.track IS NOT NULL AND ST_NumPoints(a.track) > 15 AND ST_Length(a.track::geography) < 100000 AND ST_Length(a.track::geography) > 200
+      AND NOT EXISTS (SELECT 1 FROM ST_DumpSegments(a.track) AS segment WHERE ST_Length(segment.geom::geography) > 1000)
+) AS b WHERE ST_NumPoints(b.the_geom) > 15;
+CREATE INDEX dpnk_trip_anonymized_new_idx ON dpnk_trip_anonymized_new USING GIST (the_geom);
+CREATE INDEX dpnk_trip_anonymized_new_id_idx ON dpnk_trip_anonymized_new (id);
+CREATE INDEX dpnk_trip_anonymized_new_campaign_city_idx ON dpnk_trip_anonymized_new (campaign_id, city);
+GRANT ALL PRIVILEGES ON TABLE dpnk_trip_anonymized_new TO dpnk;
+
+BEGIN;
+ALTER TABLE IF EXISTS dpnk_trip_anonymized RENAME TO dpnk_trip_anonymized_old;
+ALTER INDEX IF EXISTS dpnk_trip_anonymized_idx RENAME TO dpnk_trip_anonymized_old_idx;
+ALTER INDEX IF EXISTS dpnk_trip_anonymized_id_idx RENAME TO dpnk_trip_anonymized_old_id_idx;
+ALTER INDEX IF EXISTS dpnk_trip_anonymized_campaign_city_idx RENAME TO dpnk_trip_anonymized_old_campaign_city_idx;
+ALTER TABLE dpnk_trip_anonymized_new RENAME TO dpnk_trip_anonymized;
+ALTER INDEX dpnk_trip_anonymized_new_idx RENAME TO dpnk_trip_anonymized_idx;
+ALTER INDEX dpnk_trip_anonymized_new_id_idx RENAME TO dpnk_trip_anonymized_id_idx;
+ALTER INDEX dpnk_trip_anonymized_new_campaign_city_idx RENAME TO dpnk_trip_anonymized_campaign_city_idx;
+COMMIT;
+
+DROP TABLE IF EXISTS dpnk_trip_anonymized_old;